@@ -0,0 +1,20 @@
+-- 0016_slack_outbox.sql
+-- Durable outbox for Slack handoffs, written alongside the slack_post_id claim
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS slack_outbox (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  conversation_id uuid NOT NULL UNIQUE REFERENCES conversations(id) ON DELETE CASCADE,
+  slack_post_id text NOT NULL,
+  payload jsonb NOT NULL,
+  status text NOT NULL DEFAULT 'pending',
+  attempts int NOT NULL DEFAULT 0,
+  last_error text,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  settled_at timestamptz
+);
+
+CREATE INDEX IF NOT EXISTS idx_slack_outbox_pending ON slack_outbox(created_at) WHERE status = 'pending';
+
+COMMIT;
@@ -0,0 +1,25 @@
+-- 0017_api_conversations.sql
+-- Let the intake API persist anonymous prospect conversations, messages and briefs
+
+BEGIN;
+
+-- conversations
+ALTER TABLE conversations ALTER COLUMN account_id DROP NOT NULL;
+ALTER TABLE conversations ALTER COLUMN channel SET DEFAULT 'web';
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS status text NOT NULL DEFAULT 'active';
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS participant_name text;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS participant_email text;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+-- messages
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachments jsonb NOT NULL DEFAULT '[]'::jsonb;
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created ON messages(conversation_id, created_at);
+
+-- intake_briefs
+ALTER TABLE intake_briefs ALTER COLUMN account_id DROP NOT NULL;
+ALTER TABLE intake_briefs ALTER COLUMN summary DROP NOT NULL;
+ALTER TABLE intake_briefs ADD COLUMN IF NOT EXISTS conversation_id uuid REFERENCES conversations(id) ON DELETE CASCADE;
+ALTER TABLE intake_briefs ADD COLUMN IF NOT EXISTS payload jsonb;
+CREATE INDEX IF NOT EXISTS idx_intake_briefs_conversation_id ON intake_briefs(conversation_id, created_at);
+
+COMMIT;
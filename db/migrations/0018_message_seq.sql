@@ -0,0 +1,25 @@
+-- 0018_message_seq.sql
+-- Sequence-number messages per conversation so clients can fetch only new messages
+
+BEGIN;
+
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS message_seq bigint NOT NULL DEFAULT 0;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq bigint;
+
+UPDATE messages m
+SET seq = numbered.seq
+FROM (
+  SELECT id, row_number() OVER (PARTITION BY conversation_id ORDER BY created_at, id) AS seq
+  FROM messages
+) AS numbered
+WHERE m.id = numbered.id AND m.seq IS NULL;
+
+UPDATE conversations c
+SET message_seq = counts.max_seq
+FROM (SELECT conversation_id, max(seq) AS max_seq FROM messages GROUP BY conversation_id) AS counts
+WHERE c.id = counts.conversation_id;
+
+ALTER TABLE messages ALTER COLUMN seq SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_conversation_seq ON messages(conversation_id, seq);
+
+COMMIT;
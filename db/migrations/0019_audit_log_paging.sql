@@ -0,0 +1,8 @@
+-- 0019_audit_log_paging.sql
+-- Keyset paging index for GET /api/conversations/{id}/audit and batched COPY writes
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS idx_audit_logs_conversation_created ON audit_logs(conversation_id, created_at, id);
+
+COMMIT;
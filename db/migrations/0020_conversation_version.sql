@@ -0,0 +1,8 @@
+-- 0020_conversation_version.sql
+-- Version conversations for compare-and-swap updates, If-Match and version ETags
+
+BEGIN;
+
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 0;
+
+COMMIT;
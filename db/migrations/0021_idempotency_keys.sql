@@ -0,0 +1,19 @@
+-- 0021_idempotency_keys.sql
+-- Store responses to POSTs sent with an Idempotency-Key so every API worker can replay them
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  route text NOT NULL,
+  key text NOT NULL,
+  body_hash text NOT NULL,
+  status integer,
+  headers text,
+  body bytea,
+  expires_at double precision NOT NULL,
+  PRIMARY KEY (route, key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- 0022_attachment_content_hash.sql
+-- Record the sha256 of uploaded attachment content so duplicates resolve to one shared blob
+
+BEGIN;
+
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS content_sha256 text;
+CREATE INDEX IF NOT EXISTS idx_attachments_content_sha256 ON attachments(content_sha256);
+
+COMMIT;
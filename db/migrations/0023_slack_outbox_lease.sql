@@ -0,0 +1,12 @@
+-- 0023_slack_outbox_lease.sql
+-- Lease committed Slack outbox rows to one dispatcher at a time and settle them by slack_post_id
+
+BEGIN;
+
+ALTER TABLE slack_outbox ADD COLUMN IF NOT EXISTS lease_until timestamptz;
+
+DROP INDEX IF EXISTS idx_slack_outbox_pending;
+CREATE INDEX IF NOT EXISTS idx_slack_outbox_due ON slack_outbox(created_at) WHERE status IN ('pending', 'sending');
+CREATE UNIQUE INDEX IF NOT EXISTS idx_slack_outbox_slack_post_id ON slack_outbox(slack_post_id);
+
+COMMIT;
@@ -0,0 +1,9 @@
+-- 0024_slack_outbox_posts.sql
+-- Let POST /api/handoff/slack store its posts in slack_outbox next to the conversation's own handoff
+
+BEGIN;
+
+ALTER TABLE slack_outbox DROP CONSTRAINT IF EXISTS slack_outbox_conversation_id_key;
+CREATE INDEX IF NOT EXISTS idx_slack_outbox_conversation ON slack_outbox(conversation_id);
+
+COMMIT;
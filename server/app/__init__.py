@@ -0,0 +1,6 @@
+from pathlib import Path
+import sys
+
+APP_PATH = Path(__file__).resolve().parent
+if str(APP_PATH) not in sys.path:
+    sys.path.insert(0, str(APP_PATH))
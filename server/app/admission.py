@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any
+
+import anyio
+
+from metrics import REGISTRY
+
+ADMISSION_REJECTIONS = REGISTRY.counter(
+    "onb1_admission_rejections_total", "Requests turned away before reaching a handler, by route class and reason.", ("route", "reason")
+)
+ADMISSION_QUEUE_SECONDS = REGISTRY.histogram(
+    "onb1_admission_queue_seconds", "Time admitted requests waited for a concurrency slot.", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+DEFAULT_RATE_LIMITS = "create=2/20,message=20/60,end-and-send=0.5/5,default=50/200"
+
+
+class RouteClass:
+    # A group of endpoints sharing one limit. holds_slot=False is for long-lived
+    # responses (event streams) that would pin a concurrency slot for minutes.
+    __slots__ = ("name", "method", "pattern", "holds_slot")
+
+    def __init__(self, name: str, method: str, pattern: str, holds_slot: bool = True) -> None:
+        self.name = name
+        self.method = method
+        self.pattern = re.compile(pattern)
+        self.holds_slot = holds_slot
+
+
+class RouteLimit:
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        if rate > 0 and burst < 1:
+            raise ValueError("a rate limit's burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+
+
+def parse_rate_limits(spec: str) -> dict[str, RouteLimit]:
+    # "create=2/20,message=20/60": tokens per second / bucket size, per route class.
+    # A rate of 0 turns the buckets off for that class.
+    limits: dict[str, RouteLimit] = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        try:
+            limits[name.strip()] = RouteLimit(float(rate), float(burst or rate))
+        except ValueError as exc:
+            raise ValueError(f"ADMISSION_RATE_LIMITS entry {item!r} is not name=rate/burst") from exc
+    limits.setdefault("default", RouteLimit(0, 0))
+    return limits
+
+
+class AdmissionConfig:
+    def __init__(
+        self,
+        enabled: bool = False,
+        limits: dict[str, RouteLimit] | None = None,
+        no_queue: frozenset[str] = frozenset({"end-and-send"}),
+        max_concurrent: int = 32,
+        queue_size: int = 64,
+        queue_timeout: float = 0.25,
+        origin_multiplier: float = 10.0,
+        max_clients: int = 100_000,
+        trust_forwarded: bool = False,
+    ) -> None:
+        if max_concurrent < 1 or queue_size < 0 or queue_timeout < 0:
+            raise ValueError("ADMISSION_MAX_CONCURRENT must be at least 1, ADMISSION_QUEUE_SIZE and ADMISSION_QUEUE_TIMEOUT_MS non-negative")
+        self.enabled = enabled
+        self.limits = limits if limits is not None else parse_rate_limits(DEFAULT_RATE_LIMITS)
+        # Route classes that are cheaper to reject than to queue behind a full server.
+        self.no_queue = no_queue
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.origin_multiplier = origin_multiplier
+        self.max_clients = max_clients
+        self.trust_forwarded = trust_forwarded
+
+    @classmethod
+    def from_env(cls) -> AdmissionConfig:
+        no_queue = frozenset(name.strip() for name in os.getenv("ADMISSION_NO_QUEUE", "end-and-send").split(",") if name.strip())
+        return cls(
+            enabled=os.getenv("ADMISSION_ENABLED", "0").lower() in {"1", "true", "yes"},
+            limits=parse_rate_limits(os.getenv("ADMISSION_RATE_LIMITS", DEFAULT_RATE_LIMITS)),
+            no_queue=no_queue,
+            max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "32")),
+            queue_size=int(os.getenv("ADMISSION_QUEUE_SIZE", "64")),
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "250")) / 1000,
+            origin_multiplier=float(os.getenv("ADMISSION_ORIGIN_MULTIPLIER", "10")),
+            max_clients=int(os.getenv("ADMISSION_MAX_CLIENTS", "100000")),
+            trust_forwarded=os.getenv("ADMISSION_TRUST_FORWARDED", "0").lower() in {"1", "true", "yes"},
+        )
+
+
+class TokenBuckets:
+    # One bucket per key, refilled lazily from the time of its last use, so a request
+    # costs two dict operations and some float arithmetic. The table is an LRU bounded
+    # by max_clients; a bucket that falls out is simply full again next time, which is
+    # what an idle client's bucket would be anyway.
+
+    def __init__(self, max_clients: int) -> None:
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[tuple[str, ...], list[float]] = OrderedDict()
+
+    def take(self, keys: list[tuple[tuple[str, ...], float, float]], now: float) -> float:
+        # Takes a token from every (key, rate, burst) bucket, or from none of them.
+        # Returns 0 on success, else the seconds until all of them have one again.
+        states = []
+        wait = 0.0
+        for key, rate, burst in keys:
+            state = self._buckets.get(key)
+            if state is None:
+                state = [burst, now]
+                self._buckets[key] = state
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                state[0] = min(burst, state[0] + (now - state[1]) * rate)
+                state[1] = now
+            if state[0] < 1:
+                wait = max(wait, (1 - state[0]) / rate)
+            states.append(state)
+        if wait:
+            return wait
+        for state in states:
+            state[0] -= 1
+        return 0.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self) -> None:
+        self.event = anyio.Event()
+        self.granted = False
+
+
+class ConcurrencyGate:
+    # At most max_concurrent requests inside the app; up to queue_size more wait in
+    # FIFO order for queue_timeout, and the rest are turned away at once. A finishing
+    # request hands its slot straight to the oldest waiter. Everything runs on the
+    # event loop, so plain counters suffice.
+
+    def __init__(self, max_concurrent: int, queue_size: int, queue_timeout: float) -> None:
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: OrderedDict[_Waiter, None] = OrderedDict()
+
+    async def acquire(self, queue: bool) -> str | None:
+        # Returns None once a slot is held, else the rejection reason.
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return None
+        if not queue or self.queue_timeout <= 0:
+            return "busy"
+        if len(self._waiters) >= self.queue_size:
+            return "queue_full"
+        waiter = _Waiter()
+        self._waiters[waiter] = None
+        started = time.perf_counter()
+        try:
+            with anyio.move_on_after(self.queue_timeout):
+                await waiter.event.wait()
+        except BaseException:
+            if waiter.granted:
+                self.release()
+            else:
+                self._waiters.pop(waiter, None)
+            raise
+        if not waiter.granted:
+            self._waiters.pop(waiter, None)
+            return "queue_timeout"
+        ADMISSION_QUEUE_SECONDS.observe(time.perf_counter() - started)
+        return None
+
+    def release(self) -> None:
+        if self._waiters:
+            waiter, _ = self._waiters.popitem(last=False)
+            waiter.granted = True
+            waiter.event.set()
+            return
+        self.active -= 1
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+
+class Admission:
+    # A request first takes a token from its client's bucket for its route class, keyed
+    # by IP and, with a larger allowance shared by everyone on that origin, by the Origin
+    # header: over the limit is 429. It then needs a concurrency slot: a full server
+    # queues it briefly, or answers 503 for route classes configured not to queue. Both
+    # carry Retry-After. Paths outside /api (health, metrics, docs) are never limited.
+
+    def __init__(self, config: AdmissionConfig, routes: list[RouteClass]) -> None:
+        self.config = config
+        self.routes = routes
+        self.buckets = TokenBuckets(config.max_clients)
+        self.gate = ConcurrencyGate(config.max_concurrent, config.queue_size, config.queue_timeout)
+        self.counters = {"admitted": 0, "rate_limited": 0, "busy": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def classify(self, method: str, path: str) -> RouteClass | None:
+        for route in self.routes:
+            if route.method == method and route.pattern.match(path):
+                return route
+        return None
+
+    def bucket_keys(self, scope: dict[str, Any], name: str, limit: RouteLimit) -> list[tuple[tuple[str, ...], float, float]]:
+        keys = [((name, "ip", self.client_ip(scope)), limit.rate, limit.burst)]
+        origin = next((value for header, value in scope["headers"] if header == b"origin"), None)
+        if origin is not None:
+            multiplier = self.config.origin_multiplier
+            keys.append(((name, "origin", origin.decode("latin-1")), limit.rate * multiplier, limit.burst * multiplier))
+        return keys
+
+    def client_ip(self, scope: dict[str, Any]) -> str:
+        if self.config.trust_forwarded:
+            forwarded = next((value for header, value in scope["headers"] if header == b"x-forwarded-for"), None)
+            if forwarded:
+                return forwarded.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def rejected(self, route: str, reason: str) -> None:
+        self.counters[reason] += 1
+        ADMISSION_REJECTIONS.labels(route, reason).inc()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": self.config.enabled,
+            "active": self.gate.active,
+            "queued": self.gate.queued,
+            "max_concurrent": self.config.max_concurrent,
+            "clients": len(self.buckets),
+            **self.counters,
+        }
+
+
+class AdmissionMiddleware:
+    # Pure ASGI and outside the other middleware, so a rejection costs no routing,
+    # tracing or body parsing.
+
+    def __init__(self, app: Any, admission: Admission) -> None:
+        self.app = app
+        self.admission = admission
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        admission = self.admission
+        if not admission.config.enabled or scope["type"] != "http" or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        route = admission.classify(scope["method"], scope["path"])
+        name = route.name if route is not None else "default"
+        limit = admission.config.limits.get(name) or admission.config.limits["default"]
+        if limit.rate > 0:
+            wait = admission.buckets.take(admission.bucket_keys(scope, name, limit), time.monotonic())
+            if wait:
+                admission.rejected(name, "rate_limited")
+                await reject(send, 429, "rate_limited", math.ceil(wait))
+                return
+        if route is not None and not route.holds_slot:
+            admission.counters["admitted"] += 1
+            await self.app(scope, receive, send)
+            return
+        reason = await admission.gate.acquire(name not in admission.config.no_queue)
+        if reason is not None:
+            admission.rejected(name, reason)
+            await reject(send, 503, "server_busy", 1)
+            return
+        admission.counters["admitted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.gate.release()
+
+
+async def reject(send: Any, status: int, detail: str, retry_after: int) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode("latin-1")),
+        (b"retry-after", str(max(retry_after, 1)).encode("latin-1")),
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime, timezone
+from threading import Condition, Thread
+from typing import Any
+from uuid import UUID, uuid4
+
+logger = logging.getLogger(__name__)
+
+UTC = timezone.utc
+
+
+class AuditEvent:
+    __slots__ = ("id", "conversation_id", "event_type", "payload", "created_at")
+
+    def __init__(self, conversation_id: UUID, event_type: str, payload: dict[str, Any] | None = None) -> None:
+        self.id = uuid4()
+        self.conversation_id = conversation_id
+        self.event_type = event_type
+        self.payload = payload or {}
+        self.created_at = datetime.now(tz=UTC)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "id": str(self.id),
+            "event_type": self.event_type,
+            "payload": self.payload,
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+def audit_key(event: dict[str, Any]) -> tuple[datetime, UUID]:
+    # Page order for audit dicts: (created_at, id), the same as the audit_logs index.
+    return datetime.fromisoformat(event["created_at"]), UUID(event["id"])
+
+
+class AuditPipeline:
+    # submit() only appends to a bounded deque under a short lock; a single flusher
+    # thread hands batches to the sink. When the buffer is full a submit waits up to
+    # block_timeout for room (backpressure) and is then counted as dropped, so a slow
+    # or unavailable sink can never grow memory or stall a request indefinitely.
+
+    def __init__(
+        self,
+        sink: Callable[[list[AuditEvent]], None],
+        capacity: int = 10_000,
+        batch_size: int = 500,
+        flush_interval: float = 0.25,
+        block_timeout: float = 0.0,
+        max_attempts: int = 5,
+        retry_delay: float = 0.5,
+    ) -> None:
+        if capacity < 1 or batch_size < 1:
+            raise ValueError("capacity and batch_size must be at least 1")
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._cond = Condition()
+        self._buffer: deque[AuditEvent] = deque()
+        self._writing: list[AuditEvent] = []
+        self._thread: Thread | None = None
+        self._stopping = False
+        self._flush_requested = False
+        self._counters = {"submitted": 0, "written": 0, "dropped": 0, "batches": 0, "failed_batches": 0, "waits": 0}
+
+    def start(self) -> None:
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = Thread(target=self._run, name="audit-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def submit(self, event: AuditEvent) -> bool:
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if len(self._buffer) >= self.capacity:
+                if self.block_timeout > 0:
+                    self._counters["waits"] += 1
+                    self._cond.wait_for(lambda: len(self._buffer) < self.capacity, self.block_timeout)
+                if len(self._buffer) >= self.capacity:
+                    self._counters["dropped"] += 1
+                    return False
+            self._buffer.append(event)
+            self._counters["submitted"] += 1
+            if len(self._buffer) == 1 or len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._buffer or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def pending(self, conversation_id: UUID) -> list[AuditEvent]:
+        # Events for one conversation that the sink may not have stored yet: still
+        # buffered, or in the batch being written. Reading this before the store means
+        # every event submitted earlier is in one of the two.
+        with self._cond:
+            return [event for event in (*self._writing, *self._buffer) if event.conversation_id == conversation_id]
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {**self._counters, "buffered": len(self._buffer), "in_flight": len(self._writing), "capacity": self.capacity}
+
+    def _next_batch(self) -> list[AuditEvent] | None:
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._buffer) < self.batch_size and not self._stopping and not self._flush_requested:
+                if not self._buffer:
+                    # Idle pipelines sleep until an event arrives instead of polling.
+                    self._cond.wait()
+                    deadline = time.monotonic() + self.flush_interval
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._buffer:
+                self._flush_requested = False
+                return None if self._stopping else []
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            if not self._buffer:
+                self._flush_requested = False
+            self._writing = batch
+            # Room was just freed for submitters waiting on a full buffer.
+            self._cond.notify_all()
+            return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if not batch:
+                continue
+            self._write(batch)
+            with self._cond:
+                self._writing = []
+                self._cond.notify_all()
+
+    def _write(self, batch: list[AuditEvent]) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.sink(batch)
+            except Exception:
+                logger.exception("audit batch of %d events failed (attempt %d)", len(batch), attempt)
+                if attempt < self.max_attempts and not self._stopping:
+                    time.sleep(self.retry_delay * attempt)
+                    continue
+                with self._cond:
+                    self._counters["failed_batches"] += 1
+                    self._counters["dropped"] += len(batch)
+                return
+            with self._cond:
+                self._counters["batches"] += 1
+                self._counters["written"] += len(batch)
+            return
@@ -0,0 +1,60 @@
+from __future__ import annotations
+
+import os
+from collections.abc import Iterable, Sequence
+from functools import lru_cache
+from typing import Any
+
+# Child rows (messages, attachments, audit events) are written with one COPY or one
+# multi-row INSERT per call instead of a statement per row. COPY is the default;
+# "values" suits proxies or drivers without COPY support.
+BULK_METHODS = ("copy", "values")
+BULK_INSERT_METHOD = os.getenv("BULK_INSERT_METHOD", "copy").lower()
+# Postgres caps a statement at 65535 bind parameters.
+MAX_PARAMS = 65_535
+
+if BULK_INSERT_METHOD not in BULK_METHODS:
+    raise ValueError(f"BULK_INSERT_METHOD must be one of {BULK_METHODS}, got {BULK_INSERT_METHOD!r}")
+
+
+@lru_cache(maxsize=64)
+def copy_statement(table: str, columns: tuple[str, ...]) -> str:
+    return f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+
+
+@lru_cache(maxsize=256)
+def values_statement(table: str, columns: tuple[str, ...], rows: int) -> str:
+    row = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES " + ", ".join([row] * rows)
+
+
+def copy_rows(cursor: Any, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    count = 0
+    with cursor.copy(copy_statement(table, tuple(columns))) as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+
+def insert_rows(cursor: Any, table: str, columns: Sequence[str], rows: Sequence[Sequence[Any]], page_size: int = 1000) -> int:
+    columns = tuple(columns)
+    page_size = max(1, min(page_size, MAX_PARAMS // len(columns)))
+    for start in range(0, len(rows), page_size):
+        page = rows[start:start + page_size]
+        cursor.execute(values_statement(table, columns, len(page)), [value for row in page for value in row])
+    return len(rows)
+
+
+def write_rows(
+    cursor: Any,
+    table: str,
+    columns: Sequence[str],
+    rows: Sequence[Sequence[Any]],
+    method: str | None = None,
+) -> int:
+    if not rows:
+        return 0
+    if (method or BULK_INSERT_METHOD) == "copy":
+        return copy_rows(cursor, table, columns, rows)
+    return insert_rows(cursor, table, columns, rows)
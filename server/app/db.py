@@ -0,0 +1,447 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from collections import deque
+from collections.abc import Callable
+from threading import Condition
+from typing import Any
+
+from tracing import span, tracing_active
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+except ImportError:  # pragma: no cover - exercised only without the driver installed
+    psycopg = None
+    dict_row = None
+
+
+def statement_label(query: Any) -> str:
+    text = query if isinstance(query, str) else str(query)
+    return " ".join(text.split()[:4])
+
+
+class TracedCursor:
+    # Wraps a driver cursor while a request is being traced so that every statement
+    # becomes a span; everything else is passed straight through.
+
+    def __init__(self, cursor: Any) -> None:
+        self._cursor = cursor
+
+    def __enter__(self) -> TracedCursor:
+        self._cursor.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> Any:
+        return self._cursor.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        with span("db.execute", statement=statement_label(query)):
+            return self._cursor.execute(query, *args, **kwargs)
+
+    def executemany(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        with span("db.executemany", statement=statement_label(query)):
+            return self._cursor.executemany(query, *args, **kwargs)
+
+    def copy(self, statement: Any, *args: Any, **kwargs: Any) -> Any:
+        # Times opening the COPY; the rows are streamed by the caller afterwards.
+        with span("db.copy", statement=statement_label(statement)):
+            return self._cursor.copy(statement, *args, **kwargs)
+
+
+class AsyncTracedCursor(TracedCursor):
+    async def __aenter__(self) -> AsyncTracedCursor:
+        await self._cursor.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> Any:
+        return await self._cursor.__aexit__(exc_type, exc, tb)
+
+    async def execute(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        with span("db.execute", statement=statement_label(query)):
+            return await self._cursor.execute(query, *args, **kwargs)
+
+    async def executemany(self, query: Any, *args: Any, **kwargs: Any) -> Any:
+        with span("db.executemany", statement=statement_label(query)):
+            return await self._cursor.executemany(query, *args, **kwargs)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolClosed(Exception):
+    pass
+
+
+def _driver_connect(dsn: str, prepare_threshold: int | None) -> Any:
+    if psycopg is None:
+        raise RuntimeError("psycopg is required for STORE_BACKEND=postgres")
+    conn = psycopg.connect(dsn, row_factory=dict_row)
+    conn.prepare_threshold = prepare_threshold
+    return conn
+
+
+async def _async_driver_connect(dsn: str, prepare_threshold: int | None) -> Any:
+    if psycopg is None:
+        raise RuntimeError("psycopg is required for STORE_BACKEND=postgres")
+    conn = await psycopg.AsyncConnection.connect(dsn, row_factory=dict_row)
+    conn.prepare_threshold = prepare_threshold
+    return conn
+
+
+def _is_broken(conn: Any) -> bool:
+    return bool(getattr(conn, "closed", False) or getattr(conn, "broken", False))
+
+
+class _Slot:
+    __slots__ = ("conn", "checked_at")
+
+    def __init__(self, conn: Any) -> None:
+        self.conn = conn
+        self.checked_at = time.monotonic()
+
+
+class PoolConfig:
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 2,
+        max_size: int = 10,
+        timeout: float = 5.0,
+        health_check_interval: float = 30.0,
+        prepare_threshold: int | None = 0,
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.prepare_threshold = prepare_threshold
+
+    @classmethod
+    def from_env(cls) -> PoolConfig:
+        threshold = os.getenv("DB_PREPARE_THRESHOLD", "0")
+        return cls(
+            dsn=os.getenv("DATABASE_URL", ""),
+            min_size=int(os.getenv("DB_POOL_MIN", "2")),
+            max_size=int(os.getenv("DB_POOL_MAX", "10")),
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+            health_check_interval=float(os.getenv("DB_HEALTHCHECK_INTERVAL", "30")),
+            prepare_threshold=None if threshold.lower() == "off" else int(threshold),
+        )
+
+
+class PooledConnection:
+    # Commits on clean exit, rolls back on error, and always hands the connection back.
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self._pool = pool
+        self._slot: _Slot | None = None
+
+    def __enter__(self) -> PooledConnection:
+        self._slot = self._pool._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        slot, self._slot = self._slot, None
+        if slot is None:
+            return False
+        try:
+            if exc_type is None:
+                slot.conn.commit()
+            else:
+                slot.conn.rollback()
+        except Exception:
+            slot.conn.close()
+        self._pool._release(slot)
+        return False
+
+    @property
+    def raw(self) -> Any:
+        if self._slot is None:
+            raise RuntimeError("connection is not checked out")
+        return self._slot.conn
+
+    def cursor(self) -> Any:
+        cursor = self.raw.cursor()
+        return TracedCursor(cursor) if tracing_active() else cursor
+
+
+class ConnectionPool:
+    def __init__(self, config: PoolConfig, connect: Callable[[], Any] | None = None) -> None:
+        self.config = config
+        self._connect = connect or (lambda: _driver_connect(config.dsn, config.prepare_threshold))
+        self._cond = Condition()
+        self._idle: deque[_Slot] = deque()
+        self._size = 0
+        self._closed = False
+        self._counters = {"acquired": 0, "created": 0, "discarded": 0, "waited": 0, "timeouts": 0}
+
+    def open(self) -> None:
+        while True:
+            with self._cond:
+                if self._size >= self.config.min_size:
+                    return
+                self._size += 1
+            slot = self._new_slot()
+            with self._cond:
+                self._idle.append(slot)
+                self._cond.notify()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for slot in idle:
+            slot.conn.close()
+
+    def connection(self) -> PooledConnection:
+        return PooledConnection(self)
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {**self._counters, "size": self._size, "idle": len(self._idle)}
+
+    def _new_slot(self) -> _Slot:
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._counters["created"] += 1
+        return _Slot(conn)
+
+    def _healthy(self, slot: _Slot) -> bool:
+        if _is_broken(slot.conn):
+            return False
+        if time.monotonic() - slot.checked_at < self.config.health_check_interval:
+            return True
+        try:
+            slot.conn.execute("SELECT 1")
+            slot.conn.rollback()
+        except Exception:
+            return False
+        slot.checked_at = time.monotonic()
+        return True
+
+    def _discard(self, slot: _Slot) -> None:
+        try:
+            slot.conn.close()
+        finally:
+            with self._cond:
+                self._size -= 1
+                self._counters["discarded"] += 1
+                self._cond.notify()
+
+    def _acquire(self) -> _Slot:
+        deadline = time.monotonic() + self.config.timeout
+        while True:
+            with self._cond:
+                waited = False
+                while True:
+                    if self._closed:
+                        raise PoolClosed("connection pool is closed")
+                    if self._idle:
+                        slot = self._idle.pop()
+                        break
+                    if self._size < self.config.max_size:
+                        self._size += 1
+                        slot = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(f"no connection available within {self.config.timeout}s")
+                    waited = True
+                    self._cond.wait(remaining)
+                if waited:
+                    self._counters["waited"] += 1
+            if slot is None:
+                slot = self._new_slot()
+            elif not self._healthy(slot):
+                self._discard(slot)
+                continue
+            with self._cond:
+                self._counters["acquired"] += 1
+            return slot
+
+    def _release(self, slot: _Slot) -> None:
+        if _is_broken(slot.conn):
+            self._discard(slot)
+            return
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+            else:
+                self._idle.append(slot)
+                self._cond.notify()
+                return
+        slot.conn.close()
+
+
+class AsyncPooledConnection:
+    def __init__(self, pool: AsyncConnectionPool) -> None:
+        self._pool = pool
+        self._slot: _Slot | None = None
+
+    async def __aenter__(self) -> AsyncPooledConnection:
+        self._slot = await self._pool._acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        slot, self._slot = self._slot, None
+        if slot is None:
+            return False
+        try:
+            if exc_type is None:
+                await slot.conn.commit()
+            else:
+                await slot.conn.rollback()
+        except Exception:
+            await slot.conn.close()
+        await self._pool._release(slot)
+        return False
+
+    @property
+    def raw(self) -> Any:
+        if self._slot is None:
+            raise RuntimeError("connection is not checked out")
+        return self._slot.conn
+
+    def cursor(self) -> Any:
+        cursor = self.raw.cursor()
+        return AsyncTracedCursor(cursor) if tracing_active() else cursor
+
+
+class AsyncConnectionPool:
+    def __init__(self, config: PoolConfig, connect: Callable[[], Any] | None = None) -> None:
+        self.config = config
+        self._connect = connect or (lambda: _async_driver_connect(config.dsn, config.prepare_threshold))
+        self._cond: asyncio.Condition | None = None
+        self._idle: deque[_Slot] = deque()
+        self._size = 0
+        self._closed = False
+        self._counters = {"acquired": 0, "created": 0, "discarded": 0, "waited": 0, "timeouts": 0}
+
+    @property
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so the pool can be constructed outside a running event loop.
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def open(self) -> None:
+        while self._size < self.config.min_size:
+            self._size += 1
+            slot = await self._new_slot()
+            async with self._condition:
+                self._idle.append(slot)
+                self._condition.notify()
+
+    async def close(self) -> None:
+        async with self._condition:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._condition.notify_all()
+        for slot in idle:
+            await slot.conn.close()
+
+    def connection(self) -> AsyncPooledConnection:
+        return AsyncPooledConnection(self)
+
+    def stats(self) -> dict[str, int]:
+        return {**self._counters, "size": self._size, "idle": len(self._idle)}
+
+    async def _new_slot(self) -> _Slot:
+        try:
+            conn = await self._connect()
+        except Exception:
+            self._size -= 1
+            async with self._condition:
+                self._condition.notify()
+            raise
+        self._counters["created"] += 1
+        return _Slot(conn)
+
+    async def _healthy(self, slot: _Slot) -> bool:
+        if _is_broken(slot.conn):
+            return False
+        if time.monotonic() - slot.checked_at < self.config.health_check_interval:
+            return True
+        try:
+            await slot.conn.execute("SELECT 1")
+            await slot.conn.rollback()
+        except Exception:
+            return False
+        slot.checked_at = time.monotonic()
+        return True
+
+    async def _discard(self, slot: _Slot) -> None:
+        try:
+            await slot.conn.close()
+        finally:
+            self._size -= 1
+            self._counters["discarded"] += 1
+            async with self._condition:
+                self._condition.notify()
+
+    async def _acquire(self) -> _Slot:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config.timeout
+        while True:
+            async with self._condition:
+                waited = False
+                while True:
+                    if self._closed:
+                        raise PoolClosed("connection pool is closed")
+                    if self._idle:
+                        slot = self._idle.pop()
+                        break
+                    if self._size < self.config.max_size:
+                        self._size += 1
+                        slot = None
+                        break
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        self._counters["timeouts"] += 1
+                        raise PoolTimeout(f"no connection available within {self.config.timeout}s")
+                    waited = True
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                if waited:
+                    self._counters["waited"] += 1
+            if slot is None:
+                slot = await self._new_slot()
+            elif not await self._healthy(slot):
+                await self._discard(slot)
+                continue
+            self._counters["acquired"] += 1
+            return slot
+
+    async def _release(self, slot: _Slot) -> None:
+        if _is_broken(slot.conn):
+            await self._discard(slot)
+            return
+        async with self._condition:
+            if not self._closed:
+                self._idle.append(slot)
+                self._condition.notify()
+                return
+            self._size -= 1
+        await slot.conn.close()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from threading import Lock
+from typing import Any, TypeVar
+from uuid import UUID
+
+T = TypeVar("T")
+
+# The stored summary is itself derived from the other fields, so it is left out of the
+# fingerprint; views that read it (prompts, step replies, the brief) put its value in
+# their view key instead. That lets a summary built early in a request serve the
+# prompt built right after it.
+
+
+def fingerprint(fields: dict[str, str]) -> tuple[str, ...]:
+    # Keys then values in one flat tuple: a single allocation, compared in C.
+    if "summary" in fields:
+        fields = fields.copy()
+        del fields["summary"]
+    return (*fields, *fields.values())
+
+
+class FieldViews:
+    # Views derived from one set of fields. Lookups are plain dict reads; two threads
+    # racing on a miss both build the same value and one of them wins.
+    __slots__ = ("fingerprint", "values", "_counters")
+
+    def __init__(self, key: tuple[str, ...], counters: dict[str, int]) -> None:
+        self.fingerprint = key
+        self.values: dict[Hashable, Any] = {}
+        self._counters = counters
+
+    def get(self, view: Hashable, build: Callable[[], T]) -> T:
+        try:
+            value = self.values[view]
+        except KeyError:
+            value = self.values[view] = build()
+            self._counters["misses"] += 1
+            return value
+        self._counters["hits"] += 1
+        return value
+
+
+class DerivedViews:
+    # Per-conversation memo of text built purely from normalized_fields (summary,
+    # prompts, step replies, intake brief). A request fingerprints its fields once in
+    # for_fields(); views built for other fields are replaced rather than served, and
+    # retain() frees them as soon as a conversation's stored fields really change.
+    #
+    # Bounded to max_entries conversations (LRU), so it is safe to leave on: with the
+    # stock state machine it roughly breaks even, and it pays once summaries or prompts
+    # get expensive to build. max_entries=0 turns it off.
+
+    def __init__(self, max_entries: int = 10_000) -> None:
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries: OrderedDict[int, FieldViews] = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> DerivedViews:
+        return cls(max_entries=int(os.getenv("DERIVED_CACHE_MAX_ENTRIES", "10000")))
+
+    def for_fields(self, conversation_id: UUID | None, fields: dict[str, str]) -> FieldViews | None:
+        # None (cache disabled) sends callers down the plain builders with no bookkeeping.
+        if conversation_id is None or self.max_entries <= 0:
+            return None
+        key = fingerprint(fields)
+        # Keyed by the UUID's int: UUID.__hash__ is a Python-level call on every lookup.
+        entry_key = conversation_id.int
+        with self._lock:
+            views = self._entries.get(entry_key)
+            if views is None or views.fingerprint != key:
+                if views is not None:
+                    self._counters["invalidations"] += 1
+                views = self._entries[entry_key] = FieldViews(key, self._counters)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters["evictions"] += 1
+            else:
+                self._entries.move_to_end(entry_key)
+            return views
+
+    def retain(self, conversation_id: UUID, fields: dict[str, str]) -> None:
+        # Called when a conversation's stored fields change: drops its views only if they
+        # were built for different fields.
+        with self._lock:
+            views = self._entries.get(conversation_id.int)
+            if views is not None and views.fingerprint != fingerprint(fields):
+                del self._entries[conversation_id.int]
+                self._counters["invalidations"] += 1
+
+    def discard(self, conversation_id: UUID) -> None:
+        with self._lock:
+            self._entries.pop(conversation_id.int, None)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, **self._counters}
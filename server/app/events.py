@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from threading import Lock
+from typing import Any
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+
+
+class ConversationEvent:
+    __slots__ = ("event_type", "data", "event_id", "_encoded")
+
+    def __init__(self, event_type: str, data: dict[str, Any], event_id: int | None = None) -> None:
+        self.event_type = event_type
+        self.data = data
+        self.event_id = event_id
+        self._encoded: bytes | None = None
+
+    def encode(self) -> bytes:
+        # Encoded once per publish and shared by every subscriber of the conversation.
+        if self._encoded is None:
+            lines = []
+            if self.event_id is not None:
+                lines.append(f"id: {self.event_id}")
+            lines.append(f"event: {self.event_type}")
+            lines.append(f"data: {json.dumps(jsonable_encoder(self.data), separators=(',', ':'))}")
+            self._encoded = ("\n".join(lines) + "\n\n").encode("utf-8")
+        return self._encoded
+
+
+class Subscription:
+    def __init__(self, broker: EventBroker, conversation_id: UUID, max_pending: int) -> None:
+        self.broker = broker
+        self.conversation_id = conversation_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue[ConversationEvent | None] = asyncio.Queue(max_pending)
+        self.lagged = False
+
+    def _offer(self, event: ConversationEvent) -> None:
+        if self.lagged:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A reader that cannot keep up is cut off instead of buffering without bound;
+            # the client reconnects with Last-Event-ID and replays from the store.
+            self.lagged = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> ConversationEvent | None:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self) -> None:
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, max_pending: int = 256) -> None:
+        self.max_pending = max_pending
+        self._lock = Lock()
+        self._subscribers: dict[UUID, set[Subscription]] = {}
+
+    def subscribe(self, conversation_id: UUID) -> Subscription:
+        subscription = Subscription(self, conversation_id, self.max_pending)
+        with self._lock:
+            self._subscribers.setdefault(conversation_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.conversation_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.conversation_id]
+
+    def subscriber_count(self, conversation_id: UUID | None = None) -> int:
+        with self._lock:
+            if conversation_id is not None:
+                return len(self._subscribers.get(conversation_id, ()))
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, conversation_id: UUID, event_type: str, data: dict[str, Any], event_id: int | None = None) -> int:
+        with self._lock:
+            subscribers = tuple(self._subscribers.get(conversation_id, ()))
+        if not subscribers:
+            return 0
+        event = ConversationEvent(event_type, data, event_id)
+        delivered = 0
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, event)
+                delivered += 1
+            except RuntimeError:
+                self.unsubscribe(subscription)
+        return delivered
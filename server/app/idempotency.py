@@ -0,0 +1,438 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import anyio
+import anyio.to_thread
+
+from db import ConnectionPool
+
+Header = tuple[bytes, bytes]
+CacheKey = tuple[str, str]
+
+MAX_KEY_LENGTH = 255
+# Polling interval while another worker holds the key in the shared table.
+SHARED_POLL_SECONDS = 0.05
+# Stored with the response and echoed on every replay.
+REPLAY_HEADER = (b"idempotent-replayed", b"true")
+
+
+class StoredResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: list[Header], body: bytes) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def encode_headers(self) -> str:
+        return json.dumps([[name.decode("latin-1"), value.decode("latin-1")] for name, value in self.headers])
+
+    @classmethod
+    def decode(cls, status: int, headers: str, body: bytes) -> StoredResponse:
+        return cls(status, [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(headers)], bytes(body))
+
+
+class _Entry:
+    __slots__ = ("body_hash", "response", "expires_at")
+
+    def __init__(self, body_hash: str, response: StoredResponse, expires_at: float) -> None:
+        self.body_hash = body_hash
+        self.response = response
+        self.expires_at = expires_at
+
+
+class _InFlight:
+    # The first request for a key runs the handler; duplicates that arrive meanwhile wait
+    # on `done` and replay `response`, which stays None when the first attempt failed.
+    __slots__ = ("body_hash", "done", "response")
+
+    def __init__(self, body_hash: str) -> None:
+        self.body_hash = body_hash
+        self.done = anyio.Event()
+        self.response: StoredResponse | None = None
+
+
+class Rejection:
+    __slots__ = ("status", "detail", "retry_after")
+
+    def __init__(self, status: int, detail: str, retry_after: int | None = None) -> None:
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def response(self) -> StoredResponse:
+        headers = [(b"content-type", b"application/json")]
+        if self.retry_after is not None:
+            headers.append((b"retry-after", str(self.retry_after).encode("latin-1")))
+        return StoredResponse(self.status, headers, json.dumps({"detail": self.detail}).encode())
+
+
+KEY_REUSED = Rejection(422, "idempotency_key_reused")
+KEY_IN_FLIGHT = Rejection(409, "idempotency_key_in_flight", retry_after=1)
+KEY_INVALID = Rejection(400, "invalid_idempotency_key")
+BODY_TOO_LARGE = Rejection(413, "request_body_too_large")
+
+
+class Claim:
+    # What the shared table said about a key: "claimed" (run the handler), "done" (replay
+    # `response`), "in_flight" (another worker is running it) or "reused" (other body).
+    __slots__ = ("state", "response")
+
+    def __init__(self, state: str, response: StoredResponse | None = None) -> None:
+        self.state = state
+        self.response = response
+
+
+class IdempotencyTable(ABC):
+    # Shares keys between worker processes. A claim is an INSERT that only one worker can
+    # win; the row holds the response once the handler finished. A claim whose worker died
+    # lapses after lock_seconds, and finished rows after the cache TTL.
+
+    def claim(self, route: str, key: str, body_hash: str, lock_seconds: float) -> Claim:
+        while True:
+            now = time.time()
+            inserted, _rows = self._execute(
+                "INSERT INTO idempotency_keys (route, key, body_hash, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (route, key) DO NOTHING",
+                (route, key, body_hash, now + lock_seconds),
+            )
+            if inserted:
+                return Claim("claimed")
+            _count, rows = self._execute(
+                "SELECT body_hash, status, headers, body, expires_at FROM idempotency_keys WHERE route = ? AND key = ?",
+                (route, key),
+            )
+            if not rows:
+                continue
+            stored_hash, status, headers, body, expires_at = rows[0]
+            if expires_at <= now:
+                self._execute("DELETE FROM idempotency_keys WHERE route = ? AND key = ? AND expires_at <= ?", (route, key, now))
+                continue
+            if stored_hash != body_hash:
+                return Claim("reused")
+            if status is None:
+                return Claim("in_flight")
+            return Claim("done", StoredResponse.decode(status, headers, body))
+
+    def complete(self, route: str, key: str, response: StoredResponse, ttl_seconds: float) -> None:
+        now = time.time()
+        self._execute(
+            "UPDATE idempotency_keys SET status = ?, headers = ?, body = ?, expires_at = ? WHERE route = ? AND key = ?",
+            (response.status, response.encode_headers(), response.body, now + ttl_seconds, route, key),
+        )
+        self._execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,))
+
+    def release(self, route: str, key: str) -> None:
+        self._execute("DELETE FROM idempotency_keys WHERE route = ? AND key = ? AND status IS NULL", (route, key))
+
+    def close(self) -> None:
+        pass
+
+    @abstractmethod
+    def _execute(self, query: str, params: tuple[Any, ...]) -> tuple[int, list[tuple[Any, ...]]]: ...
+
+
+class PostgresIdempotencyTable(IdempotencyTable):
+    # Table from db/migrations/0021_idempotency_keys.sql.
+
+    def __init__(self, pool: ConnectionPool) -> None:
+        self.pool = pool
+
+    def _execute(self, query: str, params: tuple[Any, ...]) -> tuple[int, list[tuple[Any, ...]]]:
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query.replace("?", "%s"), params)
+                rows = cursor.fetchall() if cursor.description else []
+                return cursor.rowcount, [tuple(row.values()) for row in rows]
+
+
+class SQLiteIdempotencyTable(IdempotencyTable):
+    # Lives next to the conversations in the SQLite store's file.
+
+    def __init__(self, path: str | Path, busy_timeout: float = 5.0) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            "route TEXT NOT NULL, key TEXT NOT NULL, body_hash TEXT NOT NULL, status INTEGER, headers TEXT, body BLOB, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (route, key))"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _execute(self, query: str, params: tuple[Any, ...]) -> tuple[int, list[tuple[Any, ...]]]:
+        with self._lock:
+            cursor = self._db.execute(query, params)
+            return cursor.rowcount, cursor.fetchall()
+
+
+class Idempotency:
+    # Responses to POSTs sent with an Idempotency-Key, cached per (route, key) together
+    # with a hash of the request body, so a client retrying after a timeout gets the
+    # first attempt's bytes back instead of a second conversation or message. A key
+    # reused with a different body is rejected. Only responses below 500 are kept: a
+    # failed attempt releases the key and the retry runs the handler again.
+    #
+    # The in-process cache is an LRU bounded by max_entries and ttl_seconds. With a
+    # shared table, other workers see the key too; this process still answers its own
+    # repeats from memory. The body has to be buffered to hash and replay it, so bodies
+    # over max_body_bytes are refused with 413 before the handler runs.
+
+    def __init__(
+        self,
+        ttl_seconds: float = 86400.0,
+        max_entries: int = 10000,
+        wait_seconds: float = 30.0,
+        lock_seconds: float = 60.0,
+        max_body_bytes: int = 1_048_576,
+        table: IdempotencyTable | None = None,
+    ) -> None:
+        if ttl_seconds <= 0 or wait_seconds <= 0 or lock_seconds <= 0 or max_body_bytes <= 0:
+            raise ValueError(
+                "IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_WAIT_SECONDS, IDEMPOTENCY_LOCK_SECONDS and IDEMPOTENCY_MAX_BODY_BYTES must be positive"
+            )
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.wait_seconds = wait_seconds
+        self.lock_seconds = lock_seconds
+        self.max_body_bytes = max_body_bytes
+        self.table = table
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[CacheKey, _Entry] = OrderedDict()
+        self._flights: dict[CacheKey, _InFlight] = {}
+        self._counters = {"stored": 0, "replayed": 0, "waited": 0, "reused": 0, "in_flight_timeouts": 0, "released": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> Idempotency:
+        return cls(
+            ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400")),
+            max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")),
+            wait_seconds=float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30")),
+            lock_seconds=float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60")),
+            max_body_bytes=int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", "1048576")),
+        )
+
+    async def begin(self, route: str, key: str, body_hash: str) -> StoredResponse | Rejection | _InFlight:
+        # Returns the response to replay, a rejection, or the in-flight marker that makes
+        # the caller the one request that runs the handler; it must then call finish().
+        cache_key = (route, key)
+        while True:
+            entry = self._lookup(cache_key)
+            if entry is not None:
+                return self._replay(entry.body_hash, body_hash, entry.response)
+            flight = self._flights.get(cache_key)
+            if flight is None:
+                break
+            if flight.body_hash != body_hash:
+                self._counters["reused"] += 1
+                return KEY_REUSED
+            self._counters["waited"] += 1
+            with anyio.move_on_after(self.wait_seconds):
+                await flight.done.wait()
+            if not flight.done.is_set():
+                self._counters["in_flight_timeouts"] += 1
+                return KEY_IN_FLIGHT
+            if flight.response is not None:
+                return self._replay(body_hash, body_hash, flight.response)
+            # The first attempt failed and released the key; go again.
+
+        flight = _InFlight(body_hash)
+        self._flights[cache_key] = flight
+        if self.table is None:
+            return flight
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            try:
+                claim = await anyio.to_thread.run_sync(self.table.claim, route, key, body_hash, self.lock_seconds)
+            except BaseException:
+                self._land(cache_key, flight, None)
+                raise
+            if claim.state == "claimed":
+                return flight
+            if claim.state == "done" and claim.response is not None:
+                self._store(cache_key, body_hash, claim.response)
+                self._land(cache_key, flight, claim.response)
+                return self._replay(body_hash, body_hash, claim.response)
+            if claim.state == "reused":
+                self._counters["reused"] += 1
+                self._land(cache_key, flight, None)
+                return KEY_REUSED
+            if time.monotonic() >= deadline:
+                self._counters["in_flight_timeouts"] += 1
+                self._land(cache_key, flight, None)
+                return KEY_IN_FLIGHT
+            await anyio.sleep(SHARED_POLL_SECONDS)
+
+    async def finish(self, route: str, key: str, flight: _InFlight, response: StoredResponse | None) -> None:
+        cache_key = (route, key)
+        keep = response is not None and response.status < 500
+        try:
+            if keep:
+                self._store(cache_key, flight.body_hash, response)
+                if self.table is not None:
+                    await anyio.to_thread.run_sync(self.table.complete, route, key, response, self.ttl_seconds)
+            else:
+                self._counters["released"] += 1
+                if self.table is not None:
+                    await anyio.to_thread.run_sync(self.table.release, route, key)
+        finally:
+            self._land(cache_key, flight, response if keep else None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def close(self) -> None:
+        if self.table is not None:
+            self.table.close()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "in_flight": len(self._flights),
+            "shared": self.table is not None,
+            **self._counters,
+        }
+
+    def _lookup(self, cache_key: CacheKey) -> _Entry | None:
+        entry = self._entries.get(cache_key)
+        if entry is None or entry.expires_at > time.monotonic():
+            return entry
+        with self._lock:
+            if self._entries.get(cache_key) is entry:
+                del self._entries[cache_key]
+        return None
+
+    def _store(self, cache_key: CacheKey, body_hash: str, response: StoredResponse) -> None:
+        self._counters["stored"] += 1
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[cache_key] = _Entry(body_hash, response, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _land(self, cache_key: CacheKey, flight: _InFlight, response: StoredResponse | None) -> None:
+        flight.response = response
+        if self._flights.get(cache_key) is flight:
+            del self._flights[cache_key]
+        flight.done.set()
+
+    def _replay(self, stored_hash: str, body_hash: str, response: StoredResponse) -> StoredResponse | Rejection:
+        if stored_hash != body_hash:
+            self._counters["reused"] += 1
+            return KEY_REUSED
+        self._counters["replayed"] += 1
+        return StoredResponse(response.status, [*response.headers, REPLAY_HEADER], response.body)
+
+
+class IdempotencyMiddleware:
+    # Pure ASGI, innermost, so replays still get a request id and show up in the metrics.
+    # Only POSTs to `paths` that carry an Idempotency-Key header are affected.
+
+    def __init__(self, app: Any, idempotency: Idempotency, paths: re.Pattern[str]) -> None:
+        self.app = app
+        self.idempotency = idempotency
+        self.paths = paths
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or not self.paths.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        key = next((value for name, value in scope["headers"] if name == b"idempotency-key"), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            key_text = key.decode("ascii")
+        except UnicodeDecodeError:
+            key_text = ""
+        if not key_text or len(key_text) > MAX_KEY_LENGTH or not key_text.isprintable():
+            await respond(send, KEY_INVALID.response())
+            return
+
+        limit = self.idempotency.max_body_bytes
+        length = next((value for name, value in scope["headers"] if name == b"content-length"), b"")
+        if length.isdigit() and int(length) > limit:
+            await respond(send, BODY_TOO_LARGE.response())
+            return
+        chunks = []
+        size = 0
+        digest = hashlib.sha256()
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > limit:
+                # Chunked bodies carry no Content-Length; stop reading once over the cap.
+                await respond(send, BODY_TOO_LARGE.response())
+                return
+            digest.update(chunk)
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        outcome = await self.idempotency.begin(scope["path"], key_text, digest.hexdigest())
+        if isinstance(outcome, StoredResponse):
+            await respond(send, outcome)
+            return
+        if isinstance(outcome, Rejection):
+            await respond(send, outcome.response())
+            return
+
+        replayed = False
+
+        async def receive_buffered() -> dict[str, Any]:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = 0
+        headers: list[Header] = []
+        sent: list[bytes] = []
+        complete = False
+
+        async def send_captured(message: dict[str, Any]) -> None:
+            nonlocal status, headers, complete
+            if message["type"] == "http.response.start":
+                status, headers = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                sent.append(message.get("body", b""))
+                complete = not message.get("more_body", False)
+            await send(message)
+
+        response: StoredResponse | None = None
+        try:
+            await self.app(scope, receive_buffered, send_captured)
+            if complete:
+                response = StoredResponse(status, headers, b"".join(sent))
+        finally:
+            # Waiters are released even when this request was cancelled.
+            with anyio.CancelScope(shield=True):
+                await self.idempotency.finish(scope["path"], key_text, outcome, response)
+
+
+async def respond(send: Any, response: StoredResponse) -> None:
+    await send({"type": "http.response.start", "status": response.status, "headers": response.headers})
+    await send({"type": "http.response.body", "body": response.body})
@@ -1,22 +1,62 @@
 from __future__ import annotations
 
-import json
+import asyncio
+import functools
 import os
+import random
 import re
-import urllib.error
-import urllib.request
-from datetime import datetime, timedelta, timezone
-from threading import Lock
-from typing import Any, Literal
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Literal, TypeVar
 from uuid import UUID, uuid4
 
+import anyio.to_thread
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field
 
+from admission import Admission, AdmissionConfig, AdmissionMiddleware, RouteClass
+from audit import AuditEvent, AuditPipeline, audit_key
+from db import AsyncConnectionPool, ConnectionPool, PoolConfig
+from derived import DerivedViews, FieldViews
+from encoding import dumps
+from events import ConversationEvent, EventBroker, Subscription
+from idempotency import Idempotency, IdempotencyMiddleware, IdempotencyTable, PostgresIdempotencyTable, SQLiteIdempotencyTable
+from metrics import CONTENT_TYPE, REGISTRY, RequestMetrics
+from outbox import OutboxEntry, SlackOutbox
+from pg_store import PostgresStore
+from records import ConversationRecord, MessageRecord, from_epoch_us, to_epoch_us
+from response_cache import ResponseCache, etag_matches, version_etag
+from state_machine import DEFAULT_SPEC_PATH, StateMachine, clean_text
+from sqlite_store import SQLiteConfig, SQLiteStore
+from store import ConversationStore, SpillFile, Store, StoreLimits
+from tracing import TraceMiddleware, Tracer, span
+from uploads import LocalUploads, RangeFileResponse, UploadConfig, UploadError, UploadRecord
+from wal import WALConfig, WriteAheadLog
+
 UTC = timezone.utc
-EMAIL_RE = re.compile(r"^\S+@\S+\.\S+$")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
+SLACK_OUTBOX_WORKERS = int(os.getenv("SLACK_OUTBOX_WORKERS", "4"))
+SLACK_OUTBOX_MAX_ATTEMPTS = int(os.getenv("SLACK_OUTBOX_MAX_ATTEMPTS", "6"))
+SLACK_OUTBOX_POLL_SECONDS = float(os.getenv("SLACK_OUTBOX_POLL_SECONDS", "1"))
+STORE_BACKEND = os.getenv("STORE_BACKEND", "memory").lower()
+HANDLER_MODE = os.getenv("HANDLER_MODE", "thread").lower()
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_MAX_PENDING_EVENTS = int(os.getenv("SSE_MAX_PENDING_EVENTS", "256"))
+MAX_BATCH_STEPS = int(os.getenv("MAX_BATCH_STEPS", "20"))
+CAS_MAX_ATTEMPTS = int(os.getenv("CAS_MAX_ATTEMPTS", "16"))
+CAS_BACKOFF_SECONDS = float(os.getenv("CAS_BACKOFF_MS", "1")) / 1000
+STORE_SPILL_PATH = os.getenv("STORE_SPILL_PATH", ".data/conversation-spill.sqlite3")
+AUDIT_BUFFER_CAPACITY = int(os.getenv("AUDIT_BUFFER_CAPACITY", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_MS = float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "250"))
+AUDIT_BLOCK_TIMEOUT_MS = float(os.getenv("AUDIT_BLOCK_TIMEOUT_MS", "0"))
+AUDIT_LOCAL_MAX_EVENTS = int(os.getenv("AUDIT_LOCAL_MAX_EVENTS", "500"))
+AUDIT_PAGE_MAX = 500
 LOCAL_CORS_ORIGIN_REGEX = (
     r"^https?://("
     r"localhost|"
@@ -26,32 +66,61 @@ LOCAL_CORS_ORIGIN_REGEX = (
     r"192\.168(?:\.\d{1,3}){2}"
     r")(?::\d+)?$"
 )
+# POSTs a client may retry with an Idempotency-Key.
+IDEMPOTENT_PATHS = re.compile(r"^/api/conversations(?:/[^/]+/(?:message|steps|end-and-send))?$")
+# Route classes with their own ADMISSION_RATE_LIMITS entry; other /api paths are "default".
+ADMISSION_ROUTES = [
+    RouteClass("create", "POST", r"^/api/conversations$"),
+    RouteClass("message", "POST", r"^/api/conversations/[^/]+/(?:message|steps)$"),
+    RouteClass("end-and-send", "POST", r"^/api/conversations/[^/]+/end-and-send$"),
+    RouteClass("stream", "GET", r"^/api/conversations/[^/]+/events$", holds_slot=False),
+    RouteClass("upload", "PUT", r"^/api/uploads/local/[^/]+$", holds_slot=False),
+    RouteClass("upload", "GET", r"^/api/uploads/local/[^/]+/[^/]+$", holds_slot=False),
+]
+
+T = TypeVar("T")
+
+if STORE_BACKEND not in {"memory", "sqlite", "postgres"}:
+    raise ValueError(f"STORE_BACKEND must be 'memory', 'sqlite' or 'postgres', got {STORE_BACKEND!r}")
+if CAS_MAX_ATTEMPTS < 1:
+    raise ValueError("CAS_MAX_ATTEMPTS must be at least 1")
+if HANDLER_MODE not in {"thread", "async"}:
+    raise ValueError(f"HANDLER_MODE must be 'thread' or 'async', got {HANDLER_MODE!r}")
+
+STATE_MACHINE = StateMachine.from_file(os.getenv("STATE_MACHINE_PATH") or DEFAULT_SPEC_PATH)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    await _STORE.start()
+    await anyio.to_thread.run_sync(recover_slack_outbox)
+    _UPLOADS.start()
+    yield
+    SLACK_OUTBOX.stop()
+    # Buffered audit events are written before the store is stopped.
+    await anyio.to_thread.run_sync(AUDIT_PIPELINE.stop)
+    IDEMPOTENCY.close()
+    _UPLOADS.stop()
+    # Last: the Postgres store owns the pools the idempotency table also uses.
+    await _STORE.stop()
+    await anyio.to_thread.run_sync(TRACER.close)
 
-STATE_PROMPTS = {
-    "WELCOME": "Welcome to StorenTech AI. We can scope your intake in a few quick steps.",
-    "MODE_SELECT": "Are you a new prospect or an existing client?",
-    "IDENTITY": "Great. What is your full name, work email, and optional phone number?",
-    "BUSINESS_CONTEXT": "Tell me about your business so we can tailor the intake.",
-    "NEEDS": "What are you trying to accomplish with AI right now?",
-    "SCHEDULING": "Want to book time now or share a few windows that work for you?",
-    "SUMMARY": "Here is the current draft of your intake. Review it, edit anything needed, or send it now.",
-    "SUBMIT": "Your intake is queued. We will review it and follow up with next steps.",
-}
-
-STATE_FIELDS = {
-    "MODE_SELECT": ["mode"],
-    "IDENTITY": ["full_name", "email"],
-    "BUSINESS_CONTEXT": ["business_name"],
-    "NEEDS": ["needs_summary"],
-    "SUMMARY": ["summary"],
-}
 
 app = FastAPI(
     title="ONB1 API",
     version="0.1.0",
     description="Local-first intake API for ONB1.",
+    lifespan=lifespan,
 )
 
+TRACER = Tracer.from_env()
+IDEMPOTENCY = Idempotency.from_env()
+app.add_middleware(IdempotencyMiddleware, idempotency=IDEMPOTENCY, paths=IDEMPOTENT_PATHS)
+app.add_middleware(RequestMetrics)
+app.add_middleware(TraceMiddleware, tracer=TRACER)
+ADMISSION = Admission(AdmissionConfig.from_env(), ADMISSION_ROUTES)
+app.add_middleware(AdmissionMiddleware, admission=ADMISSION)
+# Outermost, so preflights are answered and rejections still carry CORS headers.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -66,15 +135,79 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-_STORE_LOCK = Lock()
-_CONVERSATIONS: dict[UUID, dict[str, Any]] = {}
 
 
+_DB_POOL = ConnectionPool(PoolConfig.from_env()) if STORE_BACKEND == "postgres" else None
+
+
+def build_store() -> Store:
+    # Postgres shares conversations between every worker, SQLite between the worker
+    # processes on one host; memory (optionally with the spill file and WAL) keeps them
+    # in this process.
+    if STORE_BACKEND == "postgres":
+        return PostgresStore(_DB_POOL, AsyncConnectionPool(PoolConfig.from_env()))
+    if STORE_BACKEND == "sqlite":
+        return SQLiteStore(SQLiteConfig.from_env())
+    wal_config = WALConfig.from_env()
+    return ConversationStore(
+        StoreLimits.from_env(),
+        SpillFile(STORE_SPILL_PATH) if STORE_SPILL_PATH else None,
+        WriteAheadLog(wal_config) if wal_config else None,
+    )
+
+
+_STORE = build_store()
+_EVENTS = EventBroker(max_pending=SSE_MAX_PENDING_EVENTS)
+_RESPONSES = ResponseCache.from_env()
+_DERIVED = DerivedViews.from_env()
+_UPLOADS = LocalUploads(UploadConfig.from_env())
+# Conversations the store drops for good release the blobs their attachments pinned at
+# once; upload GC releases those of conversations deleted any other way.
+_STORE.on_removed = _UPLOADS.detach
+_UPLOADS.existing_holders = lambda conversation_ids: _STORE.existing(conversation_ids)
+
+
+def build_idempotency_table() -> IdempotencyTable | None:
+    # Keys are shared wherever conversations are; memory keeps them in this process.
+    if STORE_BACKEND == "postgres":
+        return PostgresIdempotencyTable(_DB_POOL)
+    if STORE_BACKEND == "sqlite":
+        config = SQLiteConfig.from_env()
+        return SQLiteIdempotencyTable(config.path, config.busy_timeout)
+    return None
+
+
+IDEMPOTENCY.table = build_idempotency_table()
+
+STATE_TRANSITIONS = REGISTRY.counter("onb1_state_transitions_total", "Intake steps applied, by state edge.", ("from_state", "to_state"))
+CAS_CONFLICTS = REGISTRY.counter(
+    "onb1_conversation_conflicts_total", "Conversation writes that lost a version check, by outcome.", ("outcome",)
+)
+INVOICE_OPERATIONS = REGISTRY.counter("onb1_invoice_operations_total", "Invoice approvals and sends, by result.", ("operation", "result"))
+
+
+def store_samples() -> list[tuple[tuple[str, ...], float]]:
+    stats = _STORE.stats()
+    return [(("resident",), stats["resident"]), (("spilled",), stats["spilled"])]
+
+
+def slack_samples() -> list[tuple[tuple[str, ...], float]]:
+    stats = SLACK_OUTBOX.stats()
+    return [((outcome,), stats[outcome]) for outcome in ("enqueued", "delivered", "retried", "dead_lettered")]
+
+
+REGISTRY.callback("onb1_store_conversations", "Conversations held by the store.", "gauge", store_samples, ("location",))
+REGISTRY.callback("onb1_store_messages", "Messages in resident conversations.", "gauge", lambda: [((), _STORE.stats()["resident_messages"])])
+REGISTRY.callback("onb1_store_bytes", "Estimated footprint of resident conversations.", "gauge", lambda: [((), _STORE.stats()["resident_bytes"])])
+REGISTRY.callback("onb1_slack_outbox_total", "Slack outbox entries by outcome.", "counter", slack_samples, ("outcome",))
+REGISTRY.callback("onb1_slack_outbox_pending", "Slack deliveries queued or in flight.", "gauge", lambda: [((), sum(SLACK_OUTBOX.stats()[key] for key in ("pending", "in_flight")))])
+
 class Attachment(BaseModel):
     file_url: str
     file_name: str | None = None
     content_type: str | None = None
     size_bytes: int | None = Field(default=None, ge=0)
+    content_sha256: str | None = None
 
 
 class CreateConversationRequest(BaseModel):
@@ -90,6 +223,10 @@ class CreateMessageRequest(BaseModel):
     advance: bool = True
 
 
+class BatchStepRequest(BaseModel):
+    steps: list[CreateMessageRequest] = Field(min_length=1, max_length=MAX_BATCH_STEPS)
+
+
 class EndAndSendRequest(BaseModel):
     summary: str | None = None
     notes: str | None = None
@@ -115,7 +252,7 @@ class SendInvoiceResponse(BaseModel):
 class UploadPresignRequest(BaseModel):
     file_name: str
     content_type: str
-    content_length: int | None = None
+    content_length: int | None = Field(default=None, ge=0)
 
 
 class SlackHandoffRequest(BaseModel):
@@ -155,18 +292,6 @@ def utc_now() -> datetime:
     return datetime.now(tz=UTC)
 
 
-def clean_text(value: Any) -> str:
-    if value is None:
-        return ""
-    if isinstance(value, bool):
-        return "true" if value else "false"
-    return str(value).strip()
-
-
-def as_bool(value: Any) -> bool:
-    return clean_text(value).lower() in {"1", "true", "yes", "y", "on"}
-
-
 def normalize_fields(fields: dict[str, Any]) -> dict[str, str]:
     normalized: dict[str, str] = {}
     for key, value in fields.items():
@@ -181,18 +306,6 @@ def normalize_fields(fields: dict[str, Any]) -> dict[str, str]:
     return normalized
 
 
-def parse_normalized_fields(payload: Any) -> dict[str, str]:
-    if isinstance(payload, dict):
-        return {str(key): clean_text(value) for key, value in payload.items() if clean_text(value)}
-    if isinstance(payload, str) and payload.strip():
-        try:
-            data = json.loads(payload)
-        except json.JSONDecodeError:
-            return {}
-        return parse_normalized_fields(data)
-    return {}
-
-
 def build_summary(fields: dict[str, str]) -> str:
     lines: list[str] = []
     if fields.get("full_name"):
@@ -226,7 +339,15 @@ def build_summary(fields: dict[str, str]) -> str:
     return "\n".join(lines)
 
 
-def build_intake_brief(fields: dict[str, str], notes: str | None = None) -> dict[str, Any]:
+def summary_for(fields: dict[str, str], views: FieldViews | None = None) -> str:
+    if views is None:
+        return build_summary(fields)
+    return views.get("summary", lambda: build_summary(fields))
+
+
+def build_intake_brief(fields: dict[str, str], notes: str | None = None, views: FieldViews | None = None) -> dict[str, Any]:
+    if views is not None:
+        return views.get(("brief", notes, fields.get("summary")), lambda: build_intake_brief(fields, notes))
     summary = clean_text(fields.get("summary")) or build_summary(fields) or "Prospect requested a StorenTech AI intake."
     goals = [clean_text(fields.get("needs_summary"))] if fields.get("needs_summary") else ["Clarify fit and next steps."]
     constraints: list[str] = []
@@ -260,211 +381,288 @@ def build_intake_brief(fields: dict[str, str], notes: str | None = None) -> dict
     }
 
 
-def prompt_for_state(state: str, fields: dict[str, str]) -> str:
-    if state == "SUMMARY":
-        summary = build_summary(fields)
-        if summary:
-            return f"{STATE_PROMPTS[state]}\n\n{summary}"
-    if state == "SUBMIT" and fields.get("mode") == "client":
-        return "Existing-client intake is queued for the next build. Leave a note and we will follow up manually."
-    return STATE_PROMPTS[state]
-
-
-def summarize_step_response(state: str, fields: dict[str, str]) -> str:
-    if state == "WELCOME":
-        return "Ready to start."
-    if state == "MODE_SELECT":
-        return "Existing client" if fields.get("mode") == "client" else "New prospect"
-    if state == "IDENTITY":
-        pieces = [fields.get("full_name", "")]
-        if fields.get("email"):
-            pieces.append(fields["email"])
-        return " | ".join(piece for piece in pieces if piece)
-    if state == "BUSINESS_CONTEXT":
-        pieces = [fields.get("business_name", "")]
-        if fields.get("industry"):
-            pieces.append(fields["industry"])
-        return " | ".join(piece for piece in pieces if piece)
-    if state == "NEEDS":
-        return fields.get("needs_summary", "")
-    if state == "SCHEDULING":
-        if fields.get("preferred_times"):
-            return fields["preferred_times"]
-        return fields.get("scheduling_option", "Skipped scheduling")
-    if state == "SUMMARY":
-        return fields.get("summary", build_summary(fields))
-    return ""
+def prompt_for_state(state: str, fields: dict[str, str], views: FieldViews | None = None) -> str:
+    if views is None:
+        return STATE_MACHINE.prompt(state, fields, build_summary)
+    return views.get(
+        ("prompt", state, fields.get("summary")),
+        lambda: STATE_MACHINE.prompt(state, fields, lambda current: summary_for(current, views)),
+    )
+
+
+def summarize_step_response(state: str, fields: dict[str, str], views: FieldViews | None = None) -> str:
+    if views is None:
+        return STATE_MACHINE.step_response(state, fields, build_summary)
+    return views.get(
+        ("step", state, fields.get("summary")),
+        lambda: STATE_MACHINE.step_response(state, fields, lambda current: summary_for(current, views)),
+    )
 
 
 def next_state(current_state: str, fields: dict[str, str]) -> str:
-    if current_state == "WELCOME":
-        return "MODE_SELECT"
-    if current_state == "MODE_SELECT":
-        return "SUBMIT" if clean_text(fields.get("mode")).lower() == "client" else "IDENTITY"
-    if current_state == "IDENTITY":
-        return "BUSINESS_CONTEXT"
-    if current_state == "BUSINESS_CONTEXT":
-        return "NEEDS"
-    if current_state == "NEEDS":
-        return "SUMMARY" if as_bool(fields.get("skip_scheduling")) else "SCHEDULING"
-    if current_state == "SCHEDULING":
-        return "SUMMARY"
-    if current_state == "SUMMARY":
-        return "SUBMIT"
-    return "SUBMIT"
+    return STATE_MACHINE.next_state(current_state, fields)
 
 
 def validate_required_fields(state: str, fields: dict[str, str]) -> None:
-    if state == "SCHEDULING":
-        if clean_text(fields.get("scheduling_option")).lower() == "link":
-            return
-        required = [field for field in ["preferred_times", "timezone"] if not clean_text(fields.get(field))]
-        if required:
-            raise HTTPException(status_code=400, detail={"error": "missing_fields", "fields": required})
-        return
+    failure = STATE_MACHINE.validate(state, fields)
+    if failure:
+        raise HTTPException(status_code=400, detail=failure.detail())
 
-    required_fields = STATE_FIELDS.get(state, [])
-    missing = [field for field in required_fields if not clean_text(fields.get(field))]
-    if missing:
-        raise HTTPException(status_code=400, detail={"error": "missing_fields", "fields": missing})
 
-    if state == "IDENTITY" and not EMAIL_RE.match(clean_text(fields.get("email"))):
-        raise HTTPException(status_code=400, detail={"error": "invalid_email"})
+def new_message(
+    conversation_id: UUID,
+    role: str,
+    content: str,
+    attachments: list[Attachment] | None = None,
+    seq: int = 0,
+) -> MessageRecord:
+    return MessageRecord(
+        uuid4(),
+        role,
+        content,
+        attachments=[attachment.model_dump() for attachment in attachments] if attachments else None,
+        created_at=utc_now(),
+        seq=seq,
+    )
 
 
-def new_message(conversation_id: UUID, role: str, content: str, attachments: list[Attachment] | None = None) -> dict[str, Any]:
-    return {
-        "id": uuid4(),
-        "conversation_id": conversation_id,
-        "role": role,
-        "content": content,
-        "attachments": [attachment.model_dump() for attachment in attachments or []],
-        "created_at": utc_now(),
-    }
+def apply_step(
+    conversation_id: UUID,
+    current_state: str,
+    fields: dict[str, str],
+    payload: CreateMessageRequest,
+) -> tuple[str, dict[str, str], list[MessageRecord]]:
+    merged_fields = {**fields, **normalize_fields(payload.fields)}
+    validate_required_fields(current_state, merged_fields)
+    views = _DERIVED.for_fields(conversation_id, merged_fields)
+    if not merged_fields.get("summary"):
+        merged_fields["summary"] = summary_for(merged_fields, views)
 
+    user_content = clean_text(payload.content) or summarize_step_response(current_state, merged_fields, views)
+    next_step = next_state(current_state, merged_fields) if payload.advance else current_state
 
-def get_conn() -> LocalConnection:
-    return LocalConnection()
+    messages = []
+    if user_content:
+        messages.append(new_message(conversation_id, "user", user_content, payload.attachments))
+    messages.append(new_message(conversation_id, "assistant", prompt_for_state(next_step, merged_fields, views)))
+    return next_step, merged_fields, messages
 
 
-def fetch_conversation(conn: Any, conversation_id: UUID) -> dict[str, Any] | None:
-    if isinstance(conn, LocalConnection):
-        with _STORE_LOCK:
-            conversation = _CONVERSATIONS.get(conversation_id)
-            if not conversation:
-                return None
-            row = dict(conversation)
-            row["normalized_fields"] = json.dumps(conversation["normalized_fields"])
-            row["messages"] = list(conversation["messages"])
-            return row
+def get_conn() -> Any:
+    # Estimates and invoices only exist in Postgres; without it their lookups find nothing.
+    if _DB_POOL is None:
+        return LocalConnection()
+    return _DB_POOL.connection()
 
-    with conn.cursor() as cursor:
-        cursor.execute("SELECT * FROM conversations WHERE id = %s", (conversation_id,))
-        return cursor.fetchone()
 
+def runs_inline(uploads: bool = False) -> bool:
+    # Only a store that never blocks (memory, optionally with the WAL) lets handlers run
+    # on the event loop; the others keep their blocking drivers on worker threads. So do
+    # requests that name uploads: resolving one reads its metadata file and pins the
+    # blob in the uploads' SQLite index.
+    return HANDLER_MODE == "async" and not _STORE.blocking and not uploads
 
-def persist_intake_brief(conn: Any, conversation_id: UUID, brief: dict[str, Any]) -> UUID:
-    if isinstance(conn, LocalConnection):
-        with _STORE_LOCK:
-            conversation = _CONVERSATIONS[conversation_id]
-            conversation["intake_brief"] = brief
-            conversation["updated_at"] = utc_now()
-        return uuid4()
 
-    with conn.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO intake_briefs (conversation_id, payload) VALUES (%s, %s) RETURNING id",
-            (conversation_id, json.dumps(brief)),
-        )
-        row = cursor.fetchone()
-    return row["id"] if row else uuid4()
+class CASBackoff(Exception):
+    # Raised by conversation_attempts() on the event loop instead of sleeping there;
+    # call_handler() awaits the delay and runs the handler again from `attempt`.
+    def __init__(self, attempt: int, delay: float) -> None:
+        super().__init__(attempt, delay)
+        self.attempt = attempt
+        self.delay = delay
 
 
-def persist_attachments(conn: Any, conversation_id: UUID, attachments: list[Attachment]) -> None:
-    if isinstance(conn, LocalConnection):
-        with _STORE_LOCK:
-            conversation = _CONVERSATIONS[conversation_id]
-            conversation["attachments"] = [attachment.model_dump() for attachment in attachments]
-            conversation["updated_at"] = utc_now()
-        return
+# The attempt an inline handler starts (or resumes) at; None on worker threads.
+_LOOP_ATTEMPT: ContextVar[int | None] = ContextVar("loop_attempt", default=None)
 
-    with conn.cursor() as cursor:
-        for attachment in attachments:
-            cursor.execute(
-                "INSERT INTO attachments (conversation_id, payload) VALUES (%s, %s)",
-                (conversation_id, json.dumps(attachment.model_dump())),
-            )
 
+async def call_handler(handler: Callable[..., T], *args: Any, uploads: bool = False) -> T:
+    if not runs_inline(uploads):
+        # What FastAPI does for a plain `def` endpoint.
+        return await anyio.to_thread.run_sync(functools.partial(handler, *args))
+    # On the event loop: WAL durability is awaited once the handler has released its
+    # conversation locks instead of being waited for inside them.
+    attempt = 0
+    while True:
+        token = _LOOP_ATTEMPT.set(attempt)
+        try:
+            with _STORE.deferred_durability() as ticket:
+                result = handler(*args)
+        except CASBackoff as backoff:
+            attempt = backoff.attempt
+            await anyio.sleep(backoff.delay)
+            continue
+        finally:
+            _LOOP_ATTEMPT.reset(token)
+        await _STORE.durable(ticket)
+        return result
+
+
+def conversation_etag(version: int) -> str:
+    return version_etag(version, _STORE.epoch)
+
+
+def conversation_attempts(conversation_id: UUID, if_match: str | None, since: int = 0) -> Iterator[dict[str, Any]]:
+    # Optimistic concurrency: each attempt reads a fresh snapshot without holding the
+    # conversation, and the caller commits with expected_version=snapshot["version"],
+    # moving on to the next attempt when another writer got there first. With If-Match
+    # the client pinned a version, so a lost race surfaces as 412 instead of a retry.
+    resumed = _LOOP_ATTEMPT.get()
+    for attempt in range(resumed or 0, CAS_MAX_ATTEMPTS):
+        if attempt and attempt != resumed:
+            CAS_CONFLICTS.labels("retried").inc()
+            # Jittered exponential backoff, so writers that keep colliding on one hot
+            # conversation spread out instead of starving each other. On the event loop
+            # the handler gives up its turn for the delay instead of sleeping.
+            delay = random.uniform(0, min(CAS_BACKOFF_SECONDS * 2**attempt, 0.05))
+            if resumed is not None:
+                raise CASBackoff(attempt, delay)
+            time.sleep(delay)
+        with span("fetch"):
+            conversation = _STORE.snapshot(conversation_id, since=since)
+        if not conversation:
+            raise HTTPException(status_code=404, detail="conversation_not_found")
+        etag = conversation_etag(conversation["version"])
+        if if_match and not etag_matches(if_match, etag):
+            CAS_CONFLICTS.labels("precondition_failed").inc()
+            raise HTTPException(status_code=412, detail="version_mismatch", headers={"ETag": etag})
+        yield conversation
+    CAS_CONFLICTS.labels("exhausted").inc()
+    raise HTTPException(status_code=409, detail="conversation_conflict")
+
+
+def load_conversation(conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+    return _STORE.snapshot(conversation_id, since=since)
+
+
+def publish_update(conversation_id: UUID, fields: dict[str, str], state: str | None = None, status: str | None = None) -> None:
+    _DERIVED.retain(conversation_id, fields)
+    delta = {"state": state, "status": status, "normalized_fields": fields}
+    _EVENTS.publish(conversation_id, "conversation", {key: value for key, value in delta.items() if value is not None})
+
+
+def publish_messages(conversation_id: UUID, messages: list[MessageRecord]) -> None:
+    for message in messages:
+        _EVENTS.publish(conversation_id, "message", message.as_dict(conversation_id), event_id=message.seq)
+
+
+def resolve_attachment(attachment: Attachment) -> tuple[Attachment, UploadRecord | None]:
+    # A local upload's URL names its record, whose sha256 is the shared blob the file is
+    # served from; every attachment of the same bytes carries the same hash. Resolving
+    # only reads the record: pin_uploads() pins the blob once the commit naming it landed.
+    record = _UPLOADS.lookup(attachment.file_url)
+    if record is None:
+        return attachment, None
+    resolved = attachment.model_copy(
+        update={
+            "file_name": attachment.file_name or record.file_name,
+            "content_type": attachment.content_type or record.content_type,
+            "size_bytes": record.content_length,
+            "content_sha256": record.sha256,
+        }
+    )
+    return resolved, record
 
-def log_audit(conn: Any, conversation_id: UUID, event_type: str, payload: dict[str, Any] | None = None) -> None:
-    if isinstance(conn, LocalConnection):
-        with _STORE_LOCK:
-            conversation = _CONVERSATIONS[conversation_id]
-            conversation.setdefault("audit_log", []).append(
-                {
-                    "id": str(uuid4()),
-                    "event_type": event_type,
-                    "payload": payload or {},
-                    "created_at": utc_now().isoformat(),
-                }
-            )
-        return
 
-    with conn.cursor() as cursor:
-        cursor.execute(
-            "INSERT INTO audit_logs (conversation_id, event_type, payload) VALUES (%s, %s, %s)",
-            (conversation_id, event_type, json.dumps(payload or {})),
-        )
+def resolve_attachments(attachments: list[Attachment]) -> tuple[list[Attachment], list[UploadRecord]]:
+    resolved = [resolve_attachment(attachment) for attachment in attachments]
+    return [attachment for attachment, _record in resolved], [record for _attachment, record in resolved if record is not None]
 
 
-def send_slack_webhook(payload: dict[str, Any]) -> str | None:
-    if not SLACK_WEBHOOK_URL:
-        return f"local-{uuid4()}"
+def pin_uploads(conversation_id: UUID, records: list[UploadRecord]) -> None:
+    # Called after the commit that names the uploads, so a failed or lost commit pins
+    # nothing. The conversation holds one pin per blob however often it is named.
+    for record in records:
+        _UPLOADS.attach(record, conversation_id)
 
-    request = urllib.request.Request(
-        SLACK_WEBHOOK_URL,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+
+def write_audit_batch(events: list[AuditEvent]) -> None:
+    _STORE.append_audit(events, AUDIT_LOCAL_MAX_EVENTS)
+
+
+AUDIT_PIPELINE = AuditPipeline(
+    write_audit_batch,
+    capacity=AUDIT_BUFFER_CAPACITY,
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_INTERVAL_MS / 1000,
+    block_timeout=AUDIT_BLOCK_TIMEOUT_MS / 1000,
+)
+
+
+def log_audit(conversation_id: UUID, event_type: str, payload: dict[str, Any] | None = None) -> None:
+    # Only buffers the event; the audit flusher writes it with the next batch.
+    AUDIT_PIPELINE.submit(AuditEvent(conversation_id, event_type, payload))
+
+
+def audit_cursor(event: dict[str, Any]) -> str:
+    return f"{to_epoch_us(datetime.fromisoformat(event['created_at']))}:{event['id']}"
+
+
+def parse_audit_cursor(cursor: str | None) -> tuple[datetime, UUID]:
+    if not cursor:
+        return from_epoch_us(0), UUID(int=0)
     try:
-        with urllib.request.urlopen(request, timeout=5) as response:
-            if 200 <= response.status < 300:
-                return f"sent-{uuid4()}"
-    except urllib.error.URLError as exc:
-        raise HTTPException(status_code=502, detail=f"slack_webhook_failed: {exc.reason}") from exc
-    return None
+        created_us, event_id = cursor.split(":", 1)
+        return from_epoch_us(int(created_us)), UUID(event_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid_cursor") from None
 
 
-def maybe_post_slack(conn: Any, conversation_id: UUID, brief: dict[str, Any]) -> str | None:
-    payload = {"conversation_id": str(conversation_id), "brief": brief}
-
-    if isinstance(conn, LocalConnection):
-        with _STORE_LOCK:
-            conversation = _CONVERSATIONS[conversation_id]
-            if conversation.get("slack_post_id"):
-                return conversation["slack_post_id"]
-        slack_post_id = send_slack_webhook(payload)
-        with _STORE_LOCK:
-            _CONVERSATIONS[conversation_id]["slack_post_id"] = slack_post_id
-        return slack_post_id
-
-    with conn.cursor() as cursor:
-        slack_post_id = f"pending-{uuid4()}"
-        cursor.execute(
-            "UPDATE conversations SET slack_post_id = %s WHERE id = %s AND slack_post_id IS NULL",
-            (slack_post_id, conversation_id),
-        )
-        if cursor.rowcount != 1:
-            return None
+def record_slack_outcome(entry: OutboxEntry) -> None:
+    # Settles the handoff whose slack_post_id is entry.id; a conversation with another
+    # post id (or no stored handoff at all) is left alone.
+    conversation_id = _STORE.settle_handoff(
+        UUID(str(entry.payload["conversation_id"])), entry.id, entry.status, entry.attempts, entry.last_error
+    )
+    if conversation_id is not None:
+        _EVENTS.publish(conversation_id, "slack", {"slack_delivery": entry.status})
+
+
+def claim_slack_outbox(limit: int) -> list[tuple[str, dict[str, Any]]]:
+    return _STORE.claim_handoffs(limit, SLACK_OUTBOX.lease_seconds)
 
-    return send_slack_webhook(payload)
+
+SLACK_OUTBOX = SlackOutbox(
+    SLACK_WEBHOOK_URL,
+    workers=SLACK_OUTBOX_WORKERS,
+    max_attempts=SLACK_OUTBOX_MAX_ATTEMPTS,
+    on_settled=record_slack_outcome,
+    claim=claim_slack_outbox if _STORE.outbox_polling else None,
+    poll_interval=SLACK_OUTBOX_POLL_SECONDS,
+)
+
+
+def recover_slack_outbox() -> int:
+    if not SLACK_WEBHOOK_URL:
+        return 0
+    if _STORE.outbox_polling:
+        # The poller claims pending handoffs, and those whose lease ran out, from any worker.
+        SLACK_OUTBOX.start()
+        return 0
+    claimed = _STORE.claim_handoffs(None, SLACK_OUTBOX.lease_seconds)
+    for slack_post_id, payload in claimed:
+        SLACK_OUTBOX.enqueue(payload, slack_post_id, tracked=True)
+    return len(claimed)
+
+
+def slack_handoff(conversation_id: UUID, slack_post_id: str, brief: dict[str, Any]) -> dict[str, Any]:
+    # Recorded with the commit that ends the intake. Without a webhook the handoff is
+    # kept on the conversation but nothing is owed to Slack.
+    return {
+        "slack_post_id": slack_post_id,
+        "slack_payload": {"conversation_id": str(conversation_id), "brief": brief},
+        "slack_delivery": "pending" if SLACK_WEBHOOK_URL else "local",
+        "slack_lease_until": time.time() + SLACK_OUTBOX.lease_seconds if SLACK_WEBHOOK_URL else None,
+    }
 
 
 def to_conversation_model(row: dict[str, Any]) -> dict[str, Any]:
-    normalized_fields = parse_normalized_fields(row.get("normalized_fields"))
+    normalized_fields = row.get("normalized_fields") or {}
     created_at = row.get("created_at", utc_now())
     updated_at = row.get("updated_at", created_at)
+    messages = [
+        message.as_dict(row["id"]) if isinstance(message, MessageRecord) else message for message in row.get("messages", [])
+    ]
     return {
         "id": row["id"],
         "status": row.get("status", "active"),
@@ -472,38 +670,16 @@ def to_conversation_model(row: dict[str, Any]) -> dict[str, Any]:
         "participant_name": row.get("participant_name") or normalized_fields.get("full_name"),
         "participant_email": row.get("participant_email") or normalized_fields.get("email"),
         "normalized_fields": normalized_fields,
-        "messages": row.get("messages", []),
+        "messages": messages,
+        "message_seq": row.get("message_seq", len(messages)),
         "attachments": row.get("attachments", []),
         "intake_brief": row.get("intake_brief"),
         "created_at": created_at,
         "updated_at": updated_at,
+        "version": row.get("version", 0),
     }
 
 
-def update_local_conversation(
-    conversation_id: UUID,
-    fields: dict[str, str],
-    state: str | None = None,
-    status: str | None = None,
-    attachments: list[Attachment] | None = None,
-) -> dict[str, Any]:
-    with _STORE_LOCK:
-        conversation = _CONVERSATIONS[conversation_id]
-        conversation["normalized_fields"] = fields
-        if fields.get("full_name"):
-            conversation["participant_name"] = fields["full_name"]
-        if fields.get("email"):
-            conversation["participant_email"] = fields["email"]
-        if state:
-            conversation["state"] = state
-        if status:
-            conversation["status"] = status
-        if attachments is not None:
-            conversation["attachments"] = [attachment.model_dump() for attachment in attachments]
-        conversation["updated_at"] = utc_now()
-        return dict(conversation)
-
-
 def create_stripe_draft_invoice(estimate_row: dict[str, Any]) -> dict[str, str]:
     return {
         "provider": "stripe",
@@ -531,6 +707,7 @@ def approve_estimate(estimate_id: UUID) -> ApproveEstimateResponse:
             cursor.execute("SELECT * FROM invoices WHERE estimate_id = %s", (estimate_id,))
             existing_invoice = cursor.fetchone()
             if existing_invoice:
+                INVOICE_OPERATIONS.labels("approve", "existing").inc()
                 return ApproveEstimateResponse(
                     estimate_id=estimate_id,
                     invoice_id=existing_invoice["id"],
@@ -550,6 +727,7 @@ def approve_estimate(estimate_id: UUID) -> ApproveEstimateResponse:
                 ),
             )
             created_invoice = cursor.fetchone() or {"id": uuid4()}
+    INVOICE_OPERATIONS.labels("approve", "created").inc()
 
     return ApproveEstimateResponse(
         estimate_id=estimate_id,
@@ -569,6 +747,7 @@ def send_invoice(invoice_id: UUID) -> SendInvoiceResponse:
                 raise HTTPException(status_code=404, detail="invoice_not_found")
 
         if invoice_row.get("sent_at"):
+            INVOICE_OPERATIONS.labels("send", "already_sent").inc()
             return SendInvoiceResponse(
                 invoice_id=invoice_id,
                 provider_invoice_id=invoice_row["provider_invoice_id"],
@@ -585,6 +764,7 @@ def send_invoice(invoice_id: UUID) -> SendInvoiceResponse:
                 (invoice_id,),
             )
 
+    INVOICE_OPERATIONS.labels("send", "sent").inc()
     if invoice_row.get("slack_ts") and invoice_row.get("request_id"):
         post_request_update(invoice_row["request_id"], invoice_row["slack_ts"], "Invoice sent")
 
@@ -600,54 +780,54 @@ def end_and_send(
     conversation_id: UUID,
     payload: EndAndSendRequest | None = None,
     request: Request | None = None,
+    if_match: str | None = None,
 ) -> dict[str, Any]:
     payload = payload or EndAndSendRequest()
+    with span("resolve_attachments", count=len(payload.attachments)):
+        resolved, uploads = resolve_attachments(payload.attachments)
+    attachments = [attachment.model_dump() for attachment in resolved]
+    slack_post_id = f"{'queued' if SLACK_WEBHOOK_URL else 'local'}-{uuid4()}"
 
-    with get_conn() as conn:
-        conversation = fetch_conversation(conn, conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="conversation_not_found")
-
-        fields = parse_normalized_fields(conversation.get("normalized_fields"))
+    for conversation in conversation_attempts(conversation_id, if_match):
+        fields = conversation["normalized_fields"]
         if payload.summary:
             fields["summary"] = clean_text(payload.summary)
         if payload.notes:
             fields["notes"] = clean_text(payload.notes)
+        views = _DERIVED.for_fields(conversation_id, fields)
         if not fields.get("summary"):
-            fields["summary"] = build_summary(fields)
-
-        if isinstance(conn, LocalConnection):
-            update_local_conversation(
+            with span("build_summary"):
+                fields["summary"] = summary_for(fields, views)
+        with span("build_intake_brief"):
+            brief = build_intake_brief(fields, payload.notes, views)
+        handoff = slack_handoff(conversation_id, slack_post_id, brief)
+        # Fields, brief, attachments and the Slack handoff are committed together.
+        with span("end_conversation"):
+            updated_row = _STORE.end(
                 conversation_id,
-                fields=fields,
+                conversation["version"],
+                fields,
                 state="SUBMIT",
-                status="ended",
-                attachments=payload.attachments,
+                brief=brief,
+                attachments=attachments,
+                handoff=handoff,
             )
-        else:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "UPDATE conversations SET state = %s WHERE id = %s",
-                    ("SUBMIT", conversation_id),
-                )
-
-        updated_row = fetch_conversation(conn, conversation_id)
-        if not updated_row:
-            raise HTTPException(status_code=404, detail="conversation_not_found")
-
-        brief = build_intake_brief(fields, payload.notes)
-        persist_intake_brief(conn, conversation_id, brief)
-        persist_attachments(conn, conversation_id, payload.attachments)
-        log_audit(conn, conversation_id, "end_and_send", {"notes": payload.notes or "", "request_path": request.url.path if request else ""})
-        slack_post_id = maybe_post_slack(conn, conversation_id, brief)
-        if isinstance(conn, LocalConnection):
-            with _STORE_LOCK:
-                _CONVERSATIONS[conversation_id]["intake_brief"] = brief
-                _CONVERSATIONS[conversation_id]["slack_post_id"] = slack_post_id
-                updated_row = dict(_CONVERSATIONS[conversation_id])
-                updated_row["normalized_fields"] = json.dumps(_CONVERSATIONS[conversation_id]["normalized_fields"])
-
-        return to_conversation_model(updated_row)
+        if updated_row is not None:
+            break
+
+    pin_uploads(conversation_id, uploads)
+    publish_update(conversation_id, fields, "SUBMIT", "ended")
+    _EVENTS.publish(conversation_id, "intake_brief", {"intake_brief": brief})
+    with span("log_audit"):
+        log_audit(conversation_id, "end_and_send", {"notes": payload.notes or "", "request_path": request.url.path if request else ""})
+    if updated_row["slack_post_id"] == slack_post_id:
+        _EVENTS.publish(conversation_id, "slack", {"slack_post_id": slack_post_id, "slack_delivery": handoff["slack_delivery"]})
+        if SLACK_WEBHOOK_URL and _STORE.outbox_polling:
+            # Committed: the poller can now see and claim the outbox row.
+            SLACK_OUTBOX.wake()
+        elif SLACK_WEBHOOK_URL:
+            SLACK_OUTBOX.enqueue(handoff["slack_payload"], slack_post_id, tracked=True)
+    return to_conversation_model(updated_row)
 
 
 @app.get("/health")
@@ -655,7 +835,40 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
-@app.post("/api/conversations", status_code=201)
+@app.get("/metrics")
+def metrics() -> Response:
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/api/admin/stats")
+def admin_stats() -> dict[str, Any]:
+    stats: dict[str, Any] = {
+        "store": _STORE.stats(),
+        "slack_outbox": SLACK_OUTBOX.stats(),
+        "audit": AUDIT_PIPELINE.stats(),
+        "response_cache": _RESPONSES.stats(),
+        "derived_views": _DERIVED.stats(),
+        "tracing": TRACER.stats(),
+        "idempotency": IDEMPOTENCY.stats(),
+        "admission": ADMISSION.stats(),
+        "uploads": _UPLOADS.stats(),
+    }
+    return stats
+
+
+@app.get("/api/admin/traces")
+def list_traces(limit: int = 50, slow: bool = False) -> dict[str, Any]:
+    return {"traces": TRACER.recent(min(max(limit, 1), 500), slow_only=slow)}
+
+
+@app.get("/api/admin/traces/{request_id}")
+def get_trace(request_id: str) -> dict[str, Any]:
+    trace = TRACER.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="trace_not_found")
+    return trace
+
+
 def create_conversation(payload: CreateConversationRequest) -> dict[str, Any]:
     fields = normalize_fields(
         {
@@ -665,91 +878,347 @@ def create_conversation(payload: CreateConversationRequest) -> dict[str, Any]:
         }
     )
     conversation_id = uuid4()
-    now = utc_now()
-    conversation = {
-        "id": conversation_id,
-        "status": "active",
-        "state": "WELCOME",
-        "participant_name": fields.get("full_name"),
-        "participant_email": fields.get("email"),
-        "normalized_fields": fields,
-        "messages": [new_message(conversation_id, "assistant", prompt_for_state("WELCOME", fields))],
-        "attachments": [],
-        "intake_brief": None,
-        "audit_log": [],
-        "slack_post_id": None,
-        "created_at": now,
-        "updated_at": now,
-    }
-    with _STORE_LOCK:
-        _CONVERSATIONS[conversation_id] = conversation
-    return to_conversation_model(conversation)
+    conversation = ConversationRecord(
+        conversation_id,
+        fields,
+        participant_name=fields.get("full_name"),
+        participant_email=fields.get("email"),
+        messages=[new_message(conversation_id, "assistant", prompt_for_state("WELCOME", fields), seq=1)],
+        created_at=utc_now(),
+    )
+    _STORE.insert(conversation)
+    # Read after the insert, which sets the first version; nobody else knows the id yet.
+    return to_conversation_model(conversation.to_row())
+
+
+@app.post("/api/conversations", status_code=201)
+async def create_conversation_endpoint(payload: CreateConversationRequest, response: Response) -> dict[str, Any]:
+    body = await call_handler(create_conversation, payload)
+    set_etag(response, body, 0)
+    return body
+
+
+def json_response(body: bytes, etag: str | None = None) -> Response:
+    return Response(body, media_type="application/json", headers={"ETag": etag} if etag else None)
+
+
+def cached_response(conversation_id: UUID, version: int, if_none_match: str | None) -> Response | None:
+    etag = conversation_etag(version)
+    if etag_matches(if_none_match, etag):
+        _RESPONSES.not_modified()
+        return Response(status_code=304, headers={"ETag": etag})
+    body = _RESPONSES.get(conversation_id, version)
+    return json_response(body, etag) if body is not None else None
+
+
+def conversation_response(conversation: dict[str, Any] | None, if_none_match: str | None, since: int = 0) -> Response:
+    if not conversation:
+        raise HTTPException(status_code=404, detail="conversation_not_found")
+    # Incremental (since > 0) reads are neither cached nor tagged.
+    if since:
+        return json_response(dumps(to_conversation_model(conversation)))
+    cached = cached_response(conversation["id"], conversation["version"], if_none_match)
+    if cached is not None:
+        return cached
+    body = dumps(to_conversation_model(conversation))
+    _RESPONSES.put(conversation["id"], conversation["version"], body)
+    return json_response(body, conversation_etag(conversation["version"]))
+
+
+def get_conversation(conversation_id: UUID, if_none_match: str | None, since: int = 0) -> Response:
+    # The version is a cheap read (lock-free in memory, one column in SQL), so a
+    # revalidation or a cached body never loads the messages.
+    version = _STORE.version(conversation_id) if since == 0 else None
+    if version is not None:
+        cached = cached_response(conversation_id, version, if_none_match)
+        if cached is not None:
+            return cached
+    return conversation_response(_STORE.snapshot(conversation_id, since=since), if_none_match, since)
 
 
 @app.get("/api/conversations/{conversation_id}")
-def get_conversation(conversation_id: UUID) -> dict[str, Any]:
-    with _STORE_LOCK:
-        conversation = _CONVERSATIONS.get(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="conversation_not_found")
-        return to_conversation_model(conversation)
+async def get_conversation_endpoint(conversation_id: UUID, request: Request, since: int = 0) -> Response:
+    if_none_match = request.headers.get("if-none-match")
+    if HANDLER_MODE == "async" and not runs_inline():
+        conversation = await _STORE.snapshot_async(conversation_id, since=since)
+        return conversation_response(conversation, if_none_match, since)
+    return await call_handler(get_conversation, conversation_id, if_none_match, since)
+
+
+@app.get("/api/conversations/{conversation_id}/audit")
+def list_audit_events(conversation_id: UUID, limit: int = 50, cursor: str | None = None) -> dict[str, Any]:
+    after = parse_audit_cursor(cursor)
+    limit = min(max(limit, 1), AUDIT_PAGE_MAX)
+    # Pages reflect everything logged before the request, not just what the flusher
+    # reached: this conversation's unwritten events are merged in instead of waiting.
+    pending = [event.as_dict() for event in AUDIT_PIPELINE.pending(conversation_id)]
+    events = _STORE.audit_events(conversation_id, after, limit + 1)
+    if events is None:
+        raise HTTPException(status_code=404, detail="conversation_not_found")
+    if pending:
+        merged = {event["id"]: event for event in events}
+        merged.update((event["id"], event) for event in pending if audit_key(event) > after)
+        events = sorted(merged.values(), key=audit_key)[: limit + 1]
+    page = events[:limit]
+    return {"events": page, "next_cursor": audit_cursor(page[-1]) if len(events) > limit else None}
+
+
+async def conversation_event_stream(
+    subscription: Subscription,
+    snapshot: dict[str, Any],
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[bytes]:
+    last_seq = snapshot.get("message_seq", 0)
+    try:
+        yield ConversationEvent("snapshot", to_conversation_model(snapshot), event_id=last_seq).encode()
+        while not await is_disconnected():
+            try:
+                event = await subscription.get(SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                return
+            if event.event_type == "message":
+                if event.event_id <= last_seq:
+                    continue
+                last_seq = event.event_id
+            yield event.encode()
+    finally:
+        subscription.close()
+
+
+@app.get("/api/conversations/{conversation_id}/events")
+async def stream_conversation_events(conversation_id: UUID, request: Request, since: int | None = None) -> StreamingResponse:
+    if since is None:
+        last_event_id = request.headers.get("last-event-id", "")
+        since = int(last_event_id) if last_event_id.isdigit() else 0
+    # Subscribe before reading the snapshot so nothing published in between is lost.
+    subscription = _EVENTS.subscribe(conversation_id)
+    snapshot = await call_handler(load_conversation, conversation_id, since)
+    if not snapshot:
+        subscription.close()
+        raise HTTPException(status_code=404, detail="conversation_not_found")
+    return StreamingResponse(
+        conversation_event_stream(subscription, snapshot, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
-@app.post("/api/conversations/{conversation_id}/message", status_code=201)
-def create_conversation_message(conversation_id: UUID, payload: CreateMessageRequest) -> dict[str, Any]:
-    with _STORE_LOCK:
-        conversation = _CONVERSATIONS.get(conversation_id)
-        if not conversation:
-            raise HTTPException(status_code=404, detail="conversation_not_found")
+def commit_step(
+    conversation_id: UUID, expected_version: int | None, fields: dict[str, str], state: str, messages: list[MessageRecord]
+) -> bool:
+    # The version-checked update and the messages appended with it land together.
+    with span("commit", count=len(messages)):
+        if not _STORE.update(conversation_id, expected_version, fields, state=state, messages=messages):
+            return False
+    publish_update(conversation_id, fields, state)
+    publish_messages(conversation_id, messages)
+    return True
+
+
+def create_conversation_message(
+    conversation_id: UUID, payload: CreateMessageRequest, since: int = 0, if_match: str | None = None
+) -> dict[str, Any]:
+    attachments, uploads = resolve_attachments(payload.attachments)
+    if uploads:
+        payload = payload.model_copy(update={"attachments": attachments})
+    for conversation in conversation_attempts(conversation_id, if_match, since):
         current_state = conversation["state"]
-        existing_fields = dict(conversation["normalized_fields"])
+        if current_state == "SUBMIT":
+            return to_conversation_model(conversation)
+        with span("apply_step", state=current_state):
+            next_step, merged_fields, messages = apply_step(conversation_id, current_state, conversation["normalized_fields"], payload)
+        if commit_step(conversation_id, conversation["version"], merged_fields, next_step, messages):
+            break
+    pin_uploads(conversation_id, uploads)
+    STATE_TRANSITIONS.labels(current_state, next_step).inc()
+    with span("refetch"):
+        updated = _STORE.snapshot(conversation_id, since=since)
+    return to_conversation_model(updated)
 
-    incoming_fields = normalize_fields(payload.fields)
-    merged_fields = {**existing_fields, **incoming_fields}
-    if current_state == "SUBMIT":
-        return to_conversation_model(conversation)
 
-    validate_required_fields(current_state, merged_fields)
-    if not merged_fields.get("summary"):
-        merged_fields["summary"] = build_summary(merged_fields)
+def set_etag(response: Response, body: dict[str, Any], since: int) -> None:
+    # Same rule as GET: only a full representation is tagged.
+    if not since:
+        response.headers["ETag"] = conversation_etag(body["version"])
+
+
+@app.post("/api/conversations/{conversation_id}/message", status_code=201)
+async def create_conversation_message_endpoint(
+    conversation_id: UUID, payload: CreateMessageRequest, request: Request, response: Response, since: int = 0
+) -> dict[str, Any]:
+    body = await call_handler(
+        create_conversation_message, conversation_id, payload, since, request.headers.get("if-match"), uploads=bool(payload.attachments)
+    )
+    set_etag(response, body, since)
+    return body
+
+
+def create_conversation_steps(
+    conversation_id: UUID, payload: BatchStepRequest, since: int = 0, if_match: str | None = None
+) -> dict[str, Any]:
+    steps: list[CreateMessageRequest] = []
+    uploads: list[list[UploadRecord]] = []
+    for step in payload.steps:
+        attachments, records = resolve_attachments(step.attachments)
+        steps.append(step.model_copy(update={"attachments": attachments}) if records else step)
+        uploads.append(records)
+    for conversation in conversation_attempts(conversation_id, if_match, since):
+        state = conversation["state"]
+        fields = conversation["normalized_fields"]
+        messages: list[MessageRecord] = []
+        transitions: list[tuple[str, str]] = []
+        failed_step = skipped = None
+        for index, step in enumerate(steps):
+            if state == "SUBMIT":
+                # A submitted intake takes no more steps; the rest are reported, not dropped.
+                skipped = {"index": index, "count": len(steps) - index, "reason": "conversation_submitted"}
+                break
+            try:
+                with span("apply_step", state=state):
+                    next_step, fields, step_messages = apply_step(conversation_id, state, fields, step)
+            except HTTPException as exc:
+                failed_step = {"index": index, "state": state, **exc.detail}
+                break
+            transitions.append((state, next_step))
+            state = next_step
+            messages.extend(step_messages)
+
+        # Steps before a failure are kept, exactly as if they had been posted one by one.
+        if not transitions or commit_step(conversation_id, conversation["version"], fields, state, messages):
+            break
+    # Only the steps that were committed name their uploads.
+    pin_uploads(conversation_id, [record for records in uploads[: len(transitions)] for record in records])
+    for edge in transitions:
+        STATE_TRANSITIONS.labels(*edge).inc()
+    if transitions:
+        with span("refetch"):
+            conversation = _STORE.snapshot(conversation_id, since=since)
+    return {
+        "conversation": to_conversation_model(conversation),
+        "applied": len(transitions),
+        "failed_step": failed_step,
+        "skipped": skipped,
+    }
 
-    user_content = clean_text(payload.content) or summarize_step_response(current_state, merged_fields)
-    next_step = next_state(current_state, merged_fields) if payload.advance else current_state
 
-    updated = update_local_conversation(conversation_id, fields=merged_fields, state=next_step)
-    with _STORE_LOCK:
-        if user_content:
-            updated["messages"].append(new_message(conversation_id, "user", user_content, payload.attachments))
-        updated["messages"].append(new_message(conversation_id, "assistant", prompt_for_state(next_step, merged_fields)))
-        updated["updated_at"] = utc_now()
-        _CONVERSATIONS[conversation_id] = updated
-        return to_conversation_model(updated)
+@app.post("/api/conversations/{conversation_id}/steps", status_code=201)
+async def create_conversation_steps_endpoint(
+    conversation_id: UUID, payload: BatchStepRequest, request: Request, response: Response, since: int = 0
+) -> dict[str, Any]:
+    uploads = any(step.attachments for step in payload.steps)
+    body = await call_handler(create_conversation_steps, conversation_id, payload, since, request.headers.get("if-match"), uploads=uploads)
+    if not body["applied"]:
+        # Nothing was created; failed_step or skipped says why.
+        response.status_code = 200
+    set_etag(response, body["conversation"], since)
+    return body
 
 
 @app.post("/api/conversations/{conversation_id}/end-and-send")
-def end_and_send_endpoint(
+async def end_and_send_endpoint(
     conversation_id: UUID,
     payload: EndAndSendRequest,
     request: Request,
+    response: Response,
 ) -> dict[str, Any]:
-    conversation = end_and_send(conversation_id, payload=payload, request=request)
+    conversation = await call_handler(
+        end_and_send, conversation_id, payload, request, request.headers.get("if-match"), uploads=bool(payload.attachments)
+    )
+    set_etag(response, conversation, 0)
     return {"conversation": conversation, "handoffQueued": bool(conversation.get("slack_post_id") or conversation.get("intake_brief"))}
 
 
 @app.post("/api/uploads/presign", status_code=201)
 def create_upload_presign(payload: UploadPresignRequest) -> dict[str, Any]:
-    token = uuid4()
-    expires_at = utc_now() + timedelta(minutes=15)
+    try:
+        record, token = _UPLOADS.presign(payload.file_name, payload.content_type, payload.content_length)
+    except UploadError as exc:
+        raise upload_http_error(exc) from None
     return {
-        "upload_url": f"http://localhost:8000/api/uploads/local/{token}",
-        "file_url": f"http://localhost:8000/api/uploads/local/{token}/{payload.file_name}",
+        "upload_url": _UPLOADS.upload_url(token),
+        "file_url": _UPLOADS.file_url(record),
         "method": "PUT",
-        "expires_at": expires_at,
+        "expires_at": datetime.fromtimestamp(record.expires_at, UTC),
         "headers": {"Content-Type": payload.content_type},
     }
 
 
+def upload_http_error(exc: UploadError) -> HTTPException:
+    return HTTPException(status_code=exc.status, detail=exc.detail, headers=exc.headers)
+
+
+@app.put("/api/uploads/local/{token}")
+async def put_upload(token: str, request: Request, response: Response) -> dict[str, Any]:
+    try:
+        record = await anyio.to_thread.run_sync(_UPLOADS.verify, token)
+        content_type = request.headers.get("content-type")
+        if content_type and content_type.split(";")[0].strip().lower() != record.content_type.split(";")[0].strip().lower():
+            raise UploadError(415, "content_type_mismatch")
+        received = await _UPLOADS.receive(
+            record, request.stream(), request.headers.get("content-range"), request.headers.get("content-length")
+        )
+    except UploadError as exc:
+        raise upload_http_error(exc) from None
+    response.headers["Upload-Offset"] = str(received)
+    if not record.complete:
+        response.status_code = 202
+        return {"complete": False, "received_bytes": received}
+    response.status_code = 201
+    return {"complete": True, "size_bytes": received, "file_url": _UPLOADS.file_url(record)}
+
+
+@app.head("/api/uploads/local/{token}")
+def get_upload_offset(token: str) -> Response:
+    try:
+        record, received = _UPLOADS.progress(token)
+    except UploadError as exc:
+        raise upload_http_error(exc) from None
+    headers = {"Upload-Offset": str(received), "Upload-Complete": "1" if record.complete else "0", "Cache-Control": "no-store"}
+    if record.content_length is not None:
+        headers["Upload-Length"] = str(record.content_length)
+    return Response(headers=headers)
+
+
+@app.delete("/api/uploads/local/{token}", status_code=204)
+def delete_upload(token: str) -> Response:
+    try:
+        _UPLOADS.release(token)
+    except UploadError as exc:
+        raise upload_http_error(exc) from None
+    return Response(status_code=204)
+
+
+@app.get("/api/uploads/local/{token}/{file_name}")
+def get_upload(token: str, file_name: str, request: Request) -> Response:
+    try:
+        record = _UPLOADS.verify(token, for_upload=False)
+        return RangeFileResponse(
+            _UPLOADS.path(record),
+            record.content_type,
+            record.file_name,
+            request.headers.get("range"),
+            _UPLOADS.config.chunk_bytes,
+            on_sent=_UPLOADS.served,
+        )
+    except UploadError as exc:
+        raise upload_http_error(exc) from None
+
+
 @app.post("/api/handoff/slack", status_code=202)
 def send_slack_handoff(payload: SlackHandoffRequest) -> dict[str, Any]:
-    message_ts = send_slack_webhook(payload.model_dump())
-    return {"accepted": True, "message_ts": message_ts}
+    # The post is stored on its conversation before the 202, so a restart still delivers
+    # it. Its outcome drops the stored post and leaves the conversation's own handoff alone.
+    if not SLACK_WEBHOOK_URL:
+        return {"accepted": True, "message_ts": f"local-{uuid4()}"}
+    slack_post_id = f"queued-{uuid4()}"
+    body = payload.model_dump(mode="json")
+    if not _STORE.add_handoff(payload.conversation_id, slack_post_id, body, time.time() + SLACK_OUTBOX.lease_seconds):
+        raise HTTPException(status_code=404, detail="conversation_not_found")
+    if _STORE.outbox_polling:
+        SLACK_OUTBOX.wake()
+    else:
+        SLACK_OUTBOX.enqueue(body, slack_post_id, tracked=True)
+    return {"accepted": True, "message_ts": slack_post_id}
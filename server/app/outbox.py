@@ -0,0 +1,300 @@
+from __future__ import annotations
+
+import heapq
+import http.client
+import json
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Callable
+from threading import Condition, Event, Thread
+from typing import Any
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+WEBHOOK_SECONDS = REGISTRY.histogram(
+    "onb1_slack_webhook_duration_seconds", "Slack webhook round-trip time by attempt outcome.", ("outcome",)
+)
+
+
+class OutboxEntry:
+    # tracked entries belong to a stored handoff (a conversation's slack_post_id), and
+    # only those are reported to on_settled.
+    __slots__ = ("id", "payload", "tracked", "attempts", "next_attempt_at", "status", "last_error", "created_at")
+
+    def __init__(self, entry_id: str, payload: dict[str, Any], tracked: bool = False) -> None:
+        self.id = entry_id
+        self.payload = payload
+        self.tracked = tracked
+        self.attempts = 0
+        self.next_attempt_at = time.monotonic()
+        self.status = "pending"
+        self.last_error: str | None = None
+        self.created_at = time.time()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "payload": self.payload,
+            "attempts": self.attempts,
+            "status": self.status,
+            "last_error": self.last_error,
+            "created_at": self.created_at,
+        }
+
+
+class DeliveryError(Exception):
+    def __init__(self, message: str, retryable: bool = True, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class WebhookConnection:
+    # One keep-alive connection per worker; reopened transparently after any failure.
+
+    def __init__(self, url: str, timeout: float) -> None:
+        parts = urlsplit(url)
+        self._scheme = parts.scheme
+        self._host = parts.hostname or "localhost"
+        self._port = parts.port
+        self._path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._timeout = timeout
+        self._conn: http.client.HTTPConnection | None = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            factory = http.client.HTTPSConnection if self._scheme == "https" else http.client.HTTPConnection
+            self._conn = factory(self._host, self._port, timeout=self._timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def post(self, body: bytes) -> None:
+        conn = self._connect()
+        try:
+            conn.request("POST", self._path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            self.close()
+            raise DeliveryError(f"connection_error: {exc}") from exc
+        if response.will_close:
+            self.close()
+        if 200 <= response.status < 300:
+            return
+        retry_after = response.getheader("Retry-After")
+        raise DeliveryError(
+            f"http_{response.status}",
+            retryable=response.status in RETRYABLE_STATUSES,
+            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+        )
+
+
+class SlackOutbox:
+    # Entries reach the workers in two ways: enqueue() from the process that stored them,
+    # once that write has committed, or claim(limit), which a poller thread calls every
+    # poll_interval (and on wake()) to lease committed rows that any worker process may
+    # have written. A claimed entry must settle within lease_seconds, the longest its
+    # retries can take, or another dispatcher may claim it again.
+
+    def __init__(
+        self,
+        webhook_url: str | None,
+        workers: int = 4,
+        max_attempts: int = 6,
+        base_delay: float = 0.5,
+        max_delay: float = 60.0,
+        timeout: float = 5.0,
+        on_settled: Callable[[OutboxEntry], None] | None = None,
+        claim: Callable[[int], list[tuple[str, dict[str, Any]]]] | None = None,
+        poll_interval: float = 1.0,
+    ) -> None:
+        self.webhook_url = webhook_url
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.on_settled = on_settled
+        self.claim = claim
+        self.poll_interval = poll_interval
+        self._wake = Event()
+        self._poller: Thread | None = None
+        self._cond = Condition()
+        self._queue: list[tuple[float, int, OutboxEntry]] = []
+        self._sequence = 0
+        self._in_flight = 0
+        self._threads: list[Thread] = []
+        self._stopping = False
+        self._dead_letters: deque[OutboxEntry] = deque(maxlen=1000)
+        self._counters = {"enqueued": 0, "claimed": 0, "delivered": 0, "retried": 0, "dead_lettered": 0}
+
+    @property
+    def lease_seconds(self) -> float:
+        return self.max_attempts * (self.timeout + self.max_delay)
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads or not self.webhook_url:
+                return
+            self._stopping = False
+            for index in range(self.workers):
+                thread = Thread(target=self._run, name=f"slack-outbox-{index}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            if self.claim is not None:
+                self._wake.set()
+                self._poller = Thread(target=self._poll, name="slack-outbox-poller", daemon=True)
+                self._threads.append(self._poller)
+                self._poller.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self.drain(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+            self._poller = None
+        self._wake.set()
+        for thread in threads:
+            thread.join(timeout)
+
+    def wake(self) -> None:
+        # Called after a transaction that stored entries has committed, so they go out
+        # now rather than at the next poll.
+        self._wake.set()
+
+    def enqueue(self, payload: dict[str, Any], entry_id: str | None = None, tracked: bool = False) -> str:
+        entry = OutboxEntry(entry_id or f"queued-{uuid4()}", payload, tracked)
+        self.start()
+        with self._cond:
+            self._counters["enqueued"] += 1
+            self._push(entry)
+        return entry.id
+
+    def drain(self, timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def dead_letters(self) -> list[dict[str, Any]]:
+        with self._cond:
+            return [entry.as_dict() for entry in self._dead_letters]
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {**self._counters, "pending": len(self._queue), "in_flight": self._in_flight}
+
+    def _push(self, entry: OutboxEntry) -> None:
+        self._sequence += 1
+        heapq.heappush(self._queue, (entry.next_attempt_at, self._sequence, entry))
+        self._cond.notify()
+
+    def _next_entry(self) -> OutboxEntry | None:
+        with self._cond:
+            while not self._stopping:
+                if self._queue:
+                    due_at = self._queue[0][0]
+                    delay = due_at - time.monotonic()
+                    if delay <= 0:
+                        entry = heapq.heappop(self._queue)[2]
+                        self._in_flight += 1
+                        return entry
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _poll(self) -> None:
+        # Keeps at most two entries per worker leased, so a claimed row is not left
+        # waiting in this process while another dispatcher could be sending it.
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._cond:
+                if self._stopping:
+                    return
+                room = self.workers * 2 - len(self._queue) - self._in_flight
+            if room <= 0 or self.claim is None:
+                continue
+            try:
+                rows = self.claim(room)
+            except Exception:
+                logger.exception("slack outbox claim failed")
+                continue
+            for entry_id, payload in rows:
+                entry = OutboxEntry(entry_id, payload, tracked=True)
+                with self._cond:
+                    self._counters["claimed"] += 1
+                    self._push(entry)
+            if len(rows) == room:
+                self._wake.set()
+
+    def _backoff(self, attempts: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self) -> None:
+        connection = WebhookConnection(self.webhook_url or "", self.timeout)
+        try:
+            while True:
+                entry = self._next_entry()
+                if entry is None:
+                    return
+                self._attempt(connection, entry)
+        finally:
+            connection.close()
+
+    def _attempt(self, connection: WebhookConnection, entry: OutboxEntry) -> None:
+        entry.attempts += 1
+        settled = True
+        body = json.dumps(entry.payload, default=str).encode("utf-8")
+        started = time.perf_counter()
+        try:
+            connection.post(body)
+            entry.status = "delivered"
+            entry.last_error = None
+        except DeliveryError as exc:
+            entry.last_error = str(exc)
+            if exc.retryable and entry.attempts < self.max_attempts:
+                entry.next_attempt_at = time.monotonic() + self._backoff(entry.attempts, exc.retry_after)
+                settled = False
+            else:
+                entry.status = "dead"
+        outcome = entry.status if settled else "retry"
+        WEBHOOK_SECONDS.labels(outcome).observe(time.perf_counter() - started)
+
+        with self._cond:
+            self._in_flight -= 1
+            if not settled:
+                self._counters["retried"] += 1
+                self._push(entry)
+            elif entry.status == "delivered":
+                self._counters["delivered"] += 1
+            else:
+                self._counters["dead_lettered"] += 1
+                self._dead_letters.append(entry)
+            self._cond.notify_all()
+
+        if settled and entry.tracked and self.on_settled is not None:
+            try:
+                self.on_settled(entry)
+            except Exception:
+                logger.exception("slack outbox settle callback failed for %s", entry.id)
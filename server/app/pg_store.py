@@ -0,0 +1,392 @@
+from __future__ import annotations
+
+import json
+import mimetypes
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import PurePosixPath
+from typing import Any
+from urllib.parse import urlsplit
+from uuid import UUID, uuid4
+
+import anyio.to_thread
+
+from audit import AuditEvent
+from bulk import write_rows
+from db import AsyncConnectionPool, ConnectionPool
+from records import ConversationRecord, MessageRecord
+from state_machine import clean_text
+from store import Durability
+
+UTC = timezone.utc
+
+CONVERSATION_SELECT_SQL = (
+    "SELECT c.*, (SELECT b.payload FROM intake_briefs b WHERE b.conversation_id = c.id "
+    "ORDER BY b.created_at DESC LIMIT 1) AS intake_brief, "
+    "(SELECT COALESCE(jsonb_agg(jsonb_build_object('file_url', a.storage_url, 'file_name', a.file_name, "
+    "'content_type', a.content_type, 'size_bytes', a.size_bytes) ORDER BY a.created_at, a.id), '[]'::jsonb) "
+    "FROM attachments a WHERE a.conversation_id = c.id) AS attachments FROM conversations c WHERE c.id = %s"
+)
+MESSAGES_SELECT_SQL = (
+    "SELECT id, conversation_id, seq, sender_type AS role, body AS content, attachments, created_at "
+    "FROM messages WHERE conversation_id = %s AND seq > %s ORDER BY seq"
+)
+# Messages, briefs and attachments are only ever written in the same transaction as
+# this update, so its version bump covers them too.
+CONVERSATION_UPDATE_SQL = (
+    "UPDATE conversations SET normalized_fields = %s, summary = %s, "
+    "participant_name = COALESCE(%s, participant_name), participant_email = COALESCE(%s, participant_email), "
+    "state = COALESCE(%s, state), status = COALESCE(%s, status), "
+    "ended_at = CASE WHEN %s = 'ended' THEN now() ELSE ended_at END, message_seq = message_seq + %s, "
+    "updated_at = now(), version = version + 1 WHERE id = %s"
+)
+SLACK_CLAIM_SQL = (
+    "UPDATE slack_outbox SET status = 'sending', lease_until = now() + make_interval(secs => %s) "
+    "WHERE id IN (SELECT id FROM slack_outbox WHERE status = 'pending' OR (status = 'sending' AND lease_until < now()) "
+    "ORDER BY created_at LIMIT %s FOR UPDATE SKIP LOCKED) "
+    "RETURNING slack_post_id, payload"
+)
+MESSAGE_COLUMNS = ("id", "conversation_id", "seq", "sender_type", "body", "attachments", "created_at")
+ATTACHMENT_COLUMNS = (
+    "id",
+    "conversation_id",
+    "intake_brief_id",
+    "file_name",
+    "content_type",
+    "size_bytes",
+    "storage_key",
+    "storage_url",
+    "created_at",
+    "content_sha256",
+)
+AUDIT_COLUMNS = ("id", "conversation_id", "event_type", "payload", "created_at")
+
+
+def parse_normalized_fields(payload: Any) -> dict[str, str]:
+    # Decoder for normalized_fields arriving from outside the API (Postgres jsonb).
+    # Rows handed around inside the API already carry a clean dict.
+    if isinstance(payload, dict):
+        return {str(key): text for key, value in payload.items() if (text := clean_text(value))}
+    if isinstance(payload, str) and payload.strip():
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError:
+            return {}
+        return parse_normalized_fields(data)
+    return {}
+
+
+def parse_json_object(payload: Any) -> dict[str, Any]:
+    if isinstance(payload, dict):
+        return payload
+    if isinstance(payload, (str, bytes)) and payload:
+        try:
+            data = json.loads(payload)
+        except json.JSONDecodeError:
+            return {}
+        return data if isinstance(data, dict) else {}
+    return {}
+
+
+def attachment_row(conversation_id: UUID, intake_brief_id: UUID | None, attachment: dict[str, Any], now: datetime) -> tuple[Any, ...]:
+    # The attachments columns are NOT NULL, so metadata the client left out is derived from the URL.
+    file_url = attachment["file_url"]
+    path = urlsplit(file_url).path
+    sha256 = attachment.get("content_sha256")
+    file_name = attachment.get("file_name") or PurePosixPath(path).name or "attachment"
+    content_type = attachment.get("content_type") or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    return (
+        uuid4(),
+        conversation_id,
+        intake_brief_id,
+        file_name,
+        content_type,
+        attachment.get("size_bytes") or 0,
+        f"blobs/{sha256[:2]}/{sha256}" if sha256 else path.lstrip("/") or file_url,
+        file_url,
+        now,
+        sha256,
+    )
+
+
+class PostgresStore:
+    # Conversations are rows in the application database, shared by every worker on
+    # every host. Each operation is one pooled transaction. Conditional writes are an
+    # UPDATE ... AND version = %s, which also holds the row lock until commit, so the
+    # messages, brief, attachments and outbox row written with it land together.
+    # Durability is the database's; there is nothing to defer.
+
+    blocking = True
+    outbox_polling = True
+
+    def __init__(self, pool: ConnectionPool, async_pool: AsyncConnectionPool | None = None) -> None:
+        self.pool = pool
+        self.async_pool = async_pool
+        self.on_removed = None
+        # Versions live in the database, so every worker shares one epoch.
+        self.epoch = "pg"
+
+    async def start(self) -> None:
+        await anyio.to_thread.run_sync(self.pool.open)
+        if self.async_pool is not None:
+            await self.async_pool.open()
+
+    async def stop(self) -> None:
+        self.pool.close()
+        if self.async_pool is not None:
+            await self.async_pool.close()
+
+    def insert(self, conversation: ConversationRecord) -> None:
+        fields = conversation.normalized_fields
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO conversations (id, channel, mode, status, state, participant_name, participant_email, "
+                "normalized_fields, message_seq, created_at, updated_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                (
+                    conversation.id,
+                    "web",
+                    fields.get("mode", "prospect"),
+                    conversation.status,
+                    conversation.state,
+                    conversation.participant_name,
+                    conversation.participant_email,
+                    json.dumps(fields),
+                    len(conversation.messages),
+                    conversation.created_at,
+                    conversation.updated_at,
+                ),
+            )
+            _write_messages(cursor, conversation.id, conversation.messages, 1)
+
+    def snapshot(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            return _fetch(cursor, conversation_id, since)
+
+    async def snapshot_async(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+        if self.async_pool is None:
+            return await anyio.to_thread.run_sync(self.snapshot, conversation_id, since)
+        async with self.async_pool.connection() as conn, conn.cursor() as cursor:
+            await cursor.execute(CONVERSATION_SELECT_SQL, (conversation_id,))
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            row["normalized_fields"] = parse_normalized_fields(row["normalized_fields"])
+            await cursor.execute(MESSAGES_SELECT_SQL, (conversation_id, since))
+            row["messages"] = await cursor.fetchall()
+        return row
+
+    def version(self, conversation_id: UUID) -> int | None:
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT version FROM conversations WHERE id = %s", (conversation_id,))
+            row = cursor.fetchone()
+        return row["version"] if row else None
+
+    def existing(self, conversation_ids: list[UUID]) -> set[UUID]:
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM conversations WHERE id = ANY(%s)", (conversation_ids,))
+            return {row["id"] for row in cursor.fetchall()}
+
+    def update(
+        self,
+        conversation_id: UUID,
+        expected_version: int | None,
+        fields: dict[str, str],
+        *,
+        state: str | None = None,
+        messages: list[MessageRecord] | None = None,
+    ) -> bool:
+        messages = messages or []
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            message_seq = _update(cursor, conversation_id, fields, state, None, len(messages), expected_version)
+            if message_seq is None:
+                return False
+            _write_messages(cursor, conversation_id, messages, message_seq - len(messages) + 1)
+        return True
+
+    def end(
+        self,
+        conversation_id: UUID,
+        expected_version: int,
+        fields: dict[str, str],
+        *,
+        state: str,
+        brief: dict[str, Any],
+        attachments: list[dict[str, Any]],
+        handoff: dict[str, Any],
+    ) -> dict[str, Any] | None:
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            if _update(cursor, conversation_id, fields, state, "ended", 0, expected_version) is None:
+                return None
+            cursor.execute(
+                "INSERT INTO intake_briefs (conversation_id, payload) VALUES (%s, %s) RETURNING id",
+                (conversation_id, json.dumps(brief)),
+            )
+            row = cursor.fetchone()
+            if attachments:
+                now = datetime.now(tz=UTC)
+                brief_id = row["id"] if row else None
+                write_rows(
+                    cursor,
+                    "attachments",
+                    ATTACHMENT_COLUMNS,
+                    [attachment_row(conversation_id, brief_id, attachment, now) for attachment in attachments],
+                )
+            # The handoff is only recorded once: a conversation ended again keeps its first post.
+            slack_post_id = handoff["slack_post_id"]
+            cursor.execute(
+                "UPDATE conversations SET slack_post_id = %s WHERE id = %s AND slack_post_id IS NULL",
+                (slack_post_id, conversation_id),
+            )
+            if cursor.rowcount == 1 and handoff["slack_delivery"] == "pending":
+                # Only committed rows are visible to the poller, so a rolled-back end never posts.
+                cursor.execute(
+                    "INSERT INTO slack_outbox (conversation_id, slack_post_id, payload) VALUES (%s, %s, %s)",
+                    (conversation_id, slack_post_id, json.dumps(handoff["slack_payload"])),
+                )
+            return _fetch(cursor, conversation_id, 0)
+
+    def append_audit(self, events: list[AuditEvent], keep: int = 0) -> None:
+        # audit_logs keeps the full trail; `keep` only bounds what records hold in memory.
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            write_rows(
+                cursor,
+                "audit_logs",
+                AUDIT_COLUMNS,
+                [(event.id, event.conversation_id, event.event_type, json.dumps(event.payload), event.created_at) for event in events],
+            )
+
+    def audit_events(self, conversation_id: UUID, after: tuple[datetime, UUID], limit: int) -> list[dict[str, Any]] | None:
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM conversations WHERE id = %s", (conversation_id,))
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute(
+                "SELECT id, event_type, payload, created_at FROM audit_logs "
+                "WHERE conversation_id = %s AND (created_at, id) > (%s, %s) ORDER BY created_at, id LIMIT %s",
+                (conversation_id, *after, limit),
+            )
+            rows = cursor.fetchall()
+        return [
+            {
+                "id": str(row["id"]),
+                "event_type": row["event_type"],
+                "payload": parse_json_object(row["payload"]),
+                "created_at": row["created_at"].isoformat(),
+            }
+            for row in rows
+        ]
+
+    def add_handoff(self, conversation_id: UUID, slack_post_id: str, payload: dict[str, Any], lease_until: float | None) -> bool:
+        # The poller leases the row, so lease_until is not needed here.
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO slack_outbox (conversation_id, slack_post_id, payload) SELECT id, %s, %s FROM conversations WHERE id = %s",
+                (slack_post_id, json.dumps(payload), conversation_id),
+            )
+            return cursor.rowcount == 1
+
+    def claim_handoffs(self, limit: int | None, lease_seconds: float) -> list[tuple[str, dict[str, Any]]]:
+        # SKIP LOCKED and the lease keep two workers from claiming the same row.
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(SLACK_CLAIM_SQL, (lease_seconds, limit))
+            return [(row["slack_post_id"], parse_json_object(row["payload"])) for row in cursor.fetchall()]
+
+    def settle_handoff(
+        self, conversation_id: UUID, slack_post_id: str, status: str, attempts: int, last_error: str | None
+    ) -> UUID | None:
+        # The payload's conversation_id is not trusted; the conversation is the one whose
+        # handoff carries this post id.
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE slack_outbox SET status = %s, attempts = attempts + %s, last_error = %s, settled_at = now(), lease_until = NULL "
+                "WHERE slack_post_id = %s AND status = 'sending' RETURNING id",
+                (status, attempts, last_error, slack_post_id),
+            )
+            if cursor.fetchone() is None:
+                return None
+            # Posts from add_handoff() share the table but are not the conversation's handoff.
+            cursor.execute(
+                "UPDATE conversations SET slack_posted_at = CASE WHEN %s = 'delivered' THEN now() ELSE slack_posted_at END "
+                "WHERE slack_post_id = %s RETURNING id",
+                (status, slack_post_id),
+            )
+            row = cursor.fetchone()
+        return row["id"] if row else None
+
+    def stats(self) -> dict[str, Any]:
+        # Nothing is resident in this process; the pool is what there is to watch.
+        return {
+            "backend": "postgres",
+            "resident": 0,
+            "resident_bytes": 0,
+            "resident_messages": 0,
+            "spilled": 0,
+            "pool": self.pool.stats(),
+        }
+
+    @contextmanager
+    def deferred_durability(self) -> Iterator[Durability]:
+        # Commits are already durable when an operation returns; there is nothing to defer.
+        yield Durability()
+
+    async def durable(self, ticket: Durability) -> None:
+        return None
+
+
+def _fetch(cursor: Any, conversation_id: UUID, since: int) -> dict[str, Any] | None:
+    cursor.execute(CONVERSATION_SELECT_SQL, (conversation_id,))
+    row = cursor.fetchone()
+    if not row:
+        return None
+    row["normalized_fields"] = parse_normalized_fields(row["normalized_fields"])
+    cursor.execute(MESSAGES_SELECT_SQL, (conversation_id, since))
+    row["messages"] = cursor.fetchall()
+    return row
+
+
+def _update(
+    cursor: Any,
+    conversation_id: UUID,
+    fields: dict[str, str],
+    state: str | None,
+    status: str | None,
+    appended: int,
+    expected_version: int | None,
+) -> int | None:
+    # Returns the conversation's message_seq after the update, or None when the row is
+    # gone or another writer changed it since expected_version was read.
+    query = CONVERSATION_UPDATE_SQL
+    params: tuple[Any, ...] = (
+        json.dumps(fields),
+        fields.get("summary"),
+        fields.get("full_name"),
+        fields.get("email"),
+        state,
+        status,
+        status,
+        appended,
+        conversation_id,
+    )
+    if expected_version is not None:
+        query += " AND version = %s"
+        params += (expected_version,)
+    cursor.execute(query + " RETURNING message_seq", params)
+    row = cursor.fetchone()
+    return row["message_seq"] if row else None
+
+
+def _write_messages(cursor: Any, conversation_id: UUID, messages: list[MessageRecord], first_seq: int) -> None:
+    if not messages:
+        return
+    for offset, message in enumerate(messages):
+        message.seq = first_seq + offset
+    write_rows(
+        cursor,
+        "messages",
+        MESSAGE_COLUMNS,
+        [
+            (message.id, conversation_id, message.seq, message.role, message.content, json.dumps(message.attachments), message.created_at)
+            for message in messages
+        ],
+    )
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from sys import getsizeof, intern
+from typing import Any
+from uuid import UUID
+
+UTC = timezone.utc
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def to_epoch_us(value: datetime) -> int:
+    return (value - EPOCH) // MICROSECOND
+
+
+def from_epoch_us(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+
+class MessageRecord:
+    # Messages are the bulk of an intake's footprint, so the record keeps only what
+    # the API needs: the id as an int, an interned role, microsecond timestamps and
+    # no attachment list at all unless the message actually carried attachments.
+    __slots__ = ("id_int", "seq", "role", "content", "_attachments", "created_us")
+
+    def __init__(
+        self,
+        id: UUID,
+        role: str,
+        content: str,
+        attachments: list[dict[str, Any]] | None = None,
+        created_at: datetime | None = None,
+        seq: int = 0,
+    ) -> None:
+        self.id_int = id.int
+        self.seq = seq
+        self.role = intern(role)
+        self.content = content
+        self._attachments = tuple(attachments) if attachments else None
+        self.created_us = to_epoch_us(created_at or datetime.now(tz=UTC))
+
+    def __setstate__(self, state: tuple[None, dict[str, Any]]) -> None:
+        # Unpickling (spill file, WAL replay) would otherwise give every message its own role string.
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.role = intern(self.role)
+
+    @property
+    def id(self) -> UUID:
+        return UUID(int=self.id_int)
+
+    @property
+    def created_at(self) -> datetime:
+        return from_epoch_us(self.created_us)
+
+    @property
+    def attachments(self) -> list[dict[str, Any]]:
+        return [dict(attachment) for attachment in self._attachments] if self._attachments else []
+
+    def footprint(self) -> int:
+        # Approximate bytes held; attachment dicts are small and counted shallowly.
+        size = getsizeof(self) + getsizeof(self.content) + getsizeof(self.id_int) + getsizeof(self.created_us)
+        if self._attachments:
+            size += sum(getsizeof(attachment) for attachment in self._attachments)
+        return size
+
+    def as_dict(self, conversation_id: UUID) -> dict[str, Any]:
+        return {
+            "id": self.id,
+            "conversation_id": conversation_id,
+            "seq": self.seq,
+            "role": self.role,
+            "content": self.content,
+            "attachments": self.attachments,
+            "created_at": self.created_at,
+        }
+
+
+class ConversationRecord:
+    __slots__ = (
+        "id",
+        "status",
+        "state",
+        "participant_name",
+        "participant_email",
+        "normalized_fields",
+        "messages",
+        "attachments",
+        "intake_brief",
+        "audit_log",
+        "slack_post_id",
+        "slack_payload",
+        "slack_delivery",
+        "slack_lease_until",
+        "slack_posts",
+        "created_us",
+        "updated_us",
+        "lsn",
+        "version",
+    )
+
+    def __init__(
+        self,
+        id: UUID,
+        normalized_fields: dict[str, str],
+        state: str = "WELCOME",
+        status: str = "active",
+        participant_name: str | None = None,
+        participant_email: str | None = None,
+        messages: list[MessageRecord] | None = None,
+        created_at: datetime | None = None,
+    ) -> None:
+        self.id = id
+        self.status = intern(status)
+        self.state = intern(state)
+        self.participant_name = participant_name
+        self.participant_email = participant_email
+        self.normalized_fields = normalized_fields
+        self.messages: list[MessageRecord] = messages or []
+        self.attachments: tuple[dict[str, Any], ...] | None = None
+        self.intake_brief: dict[str, Any] | None = None
+        # Allocated on the first audit event rather than for every conversation.
+        self.audit_log: list[dict[str, Any]] | None = None
+        self.slack_post_id: str | None = None
+        self.slack_payload: dict[str, Any] | None = None
+        self.slack_delivery: str | None = None
+        # Wall-clock time until which one process owns delivering slack_payload.
+        self.slack_lease_until: float | None = None
+        # Posts requested through /api/handoff/slack and not settled yet, by post id:
+        # {"payload": ..., "lease_until": ...}. Settled posts are removed.
+        self.slack_posts: dict[str, dict[str, Any]] | None = None
+        self.created_us = to_epoch_us(created_at or datetime.now(tz=UTC))
+        self.updated_us = self.created_us
+        # Log sequence number of the last write-ahead log entry applied to this record.
+        self.lsn = 0
+        # Bumped by the store on every change to the API representation (ETags, response cache).
+        self.version = 0
+
+    def __setstate__(self, state: tuple[None, dict[str, Any]]) -> None:
+        self.version = 0
+        self.slack_lease_until = None
+        self.slack_posts = None
+        for name, value in state[1].items():
+            setattr(self, name, value)
+        self.state = intern(self.state)
+        self.status = intern(self.status)
+
+    @property
+    def created_at(self) -> datetime:
+        return from_epoch_us(self.created_us)
+
+    @property
+    def updated_at(self) -> datetime:
+        return from_epoch_us(self.updated_us)
+
+    def touch(self, now: datetime | None = None) -> None:
+        self.updated_us = to_epoch_us(now or datetime.now(tz=UTC))
+
+    def set_state(self, state: str) -> None:
+        self.state = intern(state)
+
+    def set_status(self, status: str) -> None:
+        self.status = intern(status)
+
+    def add_audit_events(self, events: list[dict[str, Any]], keep: int = 0) -> int:
+        # Only the newest `keep` events stay resident; the full trail lives in audit_logs.
+        if self.audit_log is None:
+            self.audit_log = []
+        self.audit_log.extend(events)
+        trimmed = len(self.audit_log) - keep if keep else 0
+        if trimmed > 0:
+            del self.audit_log[:trimmed]
+            return trimmed
+        return 0
+
+    def changes(self, *names: str) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in names}
+
+    def footprint(self) -> int:
+        fields = self.normalized_fields
+        size = getsizeof(self) + getsizeof(fields) + getsizeof(self.messages)
+        size += sum(getsizeof(key) + getsizeof(value) for key, value in fields.items())
+        size += sum(message.footprint() for message in self.messages)
+        if self.audit_log:
+            size += getsizeof(self.audit_log) + sum(getsizeof(event) for event in self.audit_log)
+        return size
+
+    def to_row(self, since: int = 0) -> dict[str, Any]:
+        # Row shape shared with the SQL backend. Messages stay records until
+        # to_conversation_model turns them into API dicts.
+        return {
+            "id": self.id,
+            "status": self.status,
+            "state": self.state,
+            "participant_name": self.participant_name,
+            "participant_email": self.participant_email,
+            "normalized_fields": dict(self.normalized_fields),
+            "messages": self.messages[max(since, 0):],
+            "message_seq": len(self.messages),
+            "attachments": [dict(attachment) for attachment in self.attachments] if self.attachments else [],
+            "intake_brief": self.intake_brief,
+            "audit_log": list(self.audit_log) if self.audit_log else [],
+            "slack_post_id": self.slack_post_id,
+            "slack_payload": self.slack_payload,
+            "slack_delivery": self.slack_delivery,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "version": self.version,
+        }
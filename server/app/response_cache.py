@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from collections.abc import Hashable
+from threading import Lock
+
+
+def version_etag(version: int, epoch: str) -> str:
+    # The epoch names the version sequence (a store instance, or Postgres), so a version
+    # number from another sequence, or from before the in-memory store restarted, never matches.
+    return f'"{epoch}-{version}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    # Holds the encoded body of the latest version of each resource. Lookups are a
+    # plain dict read; a body cached for an older version is simply never served and
+    # is overwritten by the next miss. The lock only orders inserts and evictions.
+
+    def __init__(self, max_entries: int = 2048) -> None:
+        self.max_entries = max_entries
+        self._lock = Lock()
+        self._entries: OrderedDict[Hashable, tuple[int, bytes]] = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "not_modified": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> ResponseCache:
+        return cls(max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "2048")))
+
+    def get(self, key: Hashable, version: int) -> bytes | None:
+        cached = self._entries.get(key)
+        if cached is not None and cached[0] == version:
+            self._counters["hits"] += 1
+            return cached[1]
+        self._counters["misses"] += 1
+        return None
+
+    def put(self, key: Hashable, version: int, body: bytes) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] > version:
+                # A slower reader must not replace a newer body.
+                return
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def not_modified(self) -> None:
+        self._counters["not_modified"] += 1
+
+    def discard(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries, **self._counters}
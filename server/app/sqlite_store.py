@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from uuid import UUID, uuid4
+
+from records import ConversationRecord, MessageRecord
+from store import LOCK_HOLD_SECONDS, LOCK_WAIT_SECONDS, Durability, RecordStore
+
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+class SQLiteConfig:
+    def __init__(self, path: str | Path, synchronous: str = "FULL", busy_timeout: float = 5.0) -> None:
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"STORE_SQLITE_SYNCHRONOUS must be one of {sorted(SYNCHRONOUS_MODES)}, got {synchronous!r}")
+        if busy_timeout <= 0:
+            raise ValueError("STORE_SQLITE_BUSY_TIMEOUT_SECONDS must be positive")
+        self.path = Path(path)
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+
+    @classmethod
+    def from_env(cls) -> SQLiteConfig:
+        return cls(
+            path=os.getenv("STORE_SQLITE_PATH") or ".data/conversations.sqlite3",
+            synchronous=os.getenv("STORE_SQLITE_SYNCHRONOUS", "FULL"),
+            busy_timeout=float(os.getenv("STORE_SQLITE_BUSY_TIMEOUT_SECONDS", "5")),
+        )
+
+
+class _Transaction:
+    # The records a thread has loaded inside its open write transaction. Nested
+    # locked() calls reuse them, and the outermost one writes the journaled ones back.
+    __slots__ = ("db", "records", "dirty")
+
+    def __init__(self, db: sqlite3.Connection) -> None:
+        self.db = db
+        self.records: dict[UUID, ConversationRecord | None] = {}
+        self.dirty: set[UUID] = set()
+
+
+class SQLiteStore(RecordStore):
+    # Conversations live as pickled records in one SQLite database in WAL mode, so every
+    # worker process on the host sees the same intakes and any of them can serve any
+    # request. locked() is a BEGIN IMMEDIATE transaction: SQLite allows one writer per
+    # file, which serialises mutations across processes, while snapshot() and version()
+    # read the last committed state without waiting for it. A handler that raises rolls
+    # its changes back instead of leaving them half-applied.
+    #
+    # Each thread gets its own connection. There is no WAL or spill file of ours on top;
+    # durability is SQLite's, at the configured synchronous level.
+
+    blocking = True
+
+    def __init__(self, config: SQLiteConfig) -> None:
+        self.config = config
+        self.on_removed: Callable[[UUID], None] | None = None
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writer = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "commits": 0, "rollbacks": 0}
+        config.path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._conn()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, version INTEGER NOT NULL, message_count INTEGER NOT NULL, payload BLOB NOT NULL)"
+        )
+        # Versions live in the file, so every worker (and every restart) shares one epoch.
+        db.execute("CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        db.execute("INSERT OR IGNORE INTO store_meta (key, value) VALUES ('epoch', ?)", (uuid4().hex[:12],))
+        self.epoch: str = db.execute("SELECT value FROM store_meta WHERE key = 'epoch'").fetchone()[0]
+
+    def _conn(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(
+                self.config.path, timeout=self.config.busy_timeout, isolation_level=None, check_same_thread=False
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={self.config.synchronous}")
+            self._local.db = db
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    @contextmanager
+    def _transaction(self) -> Iterator[_Transaction]:
+        tx: _Transaction | None = getattr(self._local, "tx", None)
+        if tx is not None:
+            yield tx
+            return
+        db = self._conn()
+        started = time.perf_counter()
+        # Threads of this process queue on a mutex; SQLite's own busy handler polls with
+        # sleeps of up to 100 ms, so it is left to arbitrate between processes only.
+        self._writer.acquire()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._writer.release()
+            raise
+        acquired = time.perf_counter()
+        LOCK_WAIT_SECONDS.observe(acquired - started)
+        tx = self._local.tx = _Transaction(db)
+        try:
+            yield tx
+            for conversation_id in tx.dirty:
+                record = tx.records[conversation_id]
+                db.execute(
+                    "UPDATE conversations SET version = ?, message_count = ?, payload = ? WHERE id = ?",
+                    (record.version, len(record.messages), _dump(record), str(conversation_id)),
+                )
+            db.execute("COMMIT")
+            self._count("commits")
+        except BaseException:
+            db.execute("ROLLBACK")
+            self._count("rollbacks")
+            raise
+        finally:
+            self._local.tx = None
+            self._writer.release()
+            LOCK_HOLD_SECONDS.observe(time.perf_counter() - acquired)
+
+    def _load(self, db: sqlite3.Connection, conversation_id: UUID) -> ConversationRecord | None:
+        row = db.execute("SELECT payload FROM conversations WHERE id = ?", (str(conversation_id),)).fetchone()
+        self._count("hits" if row else "misses")
+        return pickle.loads(row[0]) if row else None
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT count(*) FROM conversations").fetchone()[0]
+
+    def __contains__(self, conversation_id: object) -> bool:
+        if not isinstance(conversation_id, UUID):
+            return False
+        return self._conn().execute("SELECT 1 FROM conversations WHERE id = ?", (str(conversation_id),)).fetchone() is not None
+
+    def insert(self, conversation: ConversationRecord) -> None:
+        # Same starting version as an in-memory insert, which journals one change.
+        conversation.version += 1
+        with self._transaction() as tx:
+            tx.db.execute(
+                "INSERT INTO conversations (id, version, message_count, payload) VALUES (?, ?, ?, ?)",
+                (str(conversation.id), conversation.version, len(conversation.messages), _dump(conversation)),
+            )
+            tx.records[conversation.id] = conversation
+
+    def remove(self, conversation_id: UUID) -> ConversationRecord | None:
+        with self._transaction() as tx:
+            tx.dirty.discard(conversation_id)
+            tx.records.pop(conversation_id, None)
+            row = tx.db.execute("DELETE FROM conversations WHERE id = ? RETURNING payload", (str(conversation_id),)).fetchone()
+        if row is None:
+            return None
+        if self.on_removed is not None:
+            self.on_removed(conversation_id)
+        return pickle.loads(row[0])
+
+    def clear(self) -> None:
+        with self._transaction() as tx:
+            tx.records.clear()
+            tx.dirty.clear()
+            tx.db.execute("DELETE FROM conversations")
+
+    def ids(self) -> list[UUID]:
+        return [UUID(row[0]) for row in self._conn().execute("SELECT id FROM conversations")]
+
+    def stats(self) -> dict[str, Any]:
+        count, messages, size = (
+            self._conn()
+            .execute("SELECT count(*), COALESCE(sum(message_count), 0), COALESCE(sum(length(payload)), 0) FROM conversations")
+            .fetchone()
+        )
+        with self._lock:
+            counters = dict(self._counters)
+            connections = len(self._connections)
+        return {
+            "backend": "sqlite",
+            "path": str(self.config.path),
+            "resident": count,
+            "resident_bytes": size,
+            "resident_messages": messages,
+            "spilled": 0,
+            "connections": connections,
+            **counters,
+        }
+
+    @contextmanager
+    def locked(self, conversation_id: UUID, *, missing_ok: bool = False) -> Iterator[ConversationRecord | None]:
+        with self._transaction() as tx:
+            if conversation_id in tx.records:
+                conversation = tx.records[conversation_id]
+            else:
+                conversation = tx.records[conversation_id] = self._load(tx.db, conversation_id)
+            if conversation is None and not missing_ok:
+                raise KeyError(conversation_id)
+            yield conversation
+
+    def append_messages(self, conversation_id: UUID, messages: list[MessageRecord]) -> int:
+        with self.locked(conversation_id) as conversation:
+            log = conversation.messages
+            for message in messages:
+                message.seq = len(log) + 1
+                log.append(message)
+            self.journal(conversation, "append", messages)
+            return len(log)
+
+    def snapshot(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+        tx: _Transaction | None = getattr(self._local, "tx", None)
+        if tx is not None and conversation_id in tx.records:
+            # Inside a transaction the record may carry changes that are not committed yet.
+            conversation = tx.records[conversation_id]
+        else:
+            conversation = self._load(self._conn(), conversation_id)
+        return conversation.to_row(since) if conversation is not None else None
+
+    def version(self, conversation_id: UUID) -> int | None:
+        row = self._conn().execute("SELECT version FROM conversations WHERE id = ?", (str(conversation_id),)).fetchone()
+        return row[0] if row else None
+
+    def existing(self, conversation_ids: list[UUID]) -> set[UUID]:
+        found: set[UUID] = set()
+        # Pages of 500 stay under SQLite's bound-parameter limit.
+        for start in range(0, len(conversation_ids), 500):
+            page = [str(conversation_id) for conversation_id in conversation_ids[start : start + 500]]
+            query = f"SELECT id FROM conversations WHERE id IN ({', '.join('?' * len(page))})"
+            found.update(UUID(row[0]) for row in self._conn().execute(query, page).fetchall())
+        return found
+
+    def journal(self, conversation: ConversationRecord, op: str, payload: Any = None) -> None:
+        tx: _Transaction | None = getattr(self._local, "tx", None)
+        if tx is None or tx.records.get(conversation.id) is not conversation:
+            raise RuntimeError("journal() needs the record from the caller's locked() block")
+        if op != "audit":
+            conversation.version += 1
+        tx.dirty.add(conversation.id)
+
+    @contextmanager
+    def deferred_durability(self) -> Iterator[Durability]:
+        # Commits are already durable when locked() returns; there is nothing to defer.
+        yield Durability()
+
+    async def durable(self, ticket: Durability) -> None:
+        return None
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+
+def _dump(conversation: ConversationRecord) -> bytes:
+    return pickle.dumps(conversation, pickle.HIGHEST_PROTOCOL)
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import json
+import re
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+EMAIL_RE = re.compile(r"^\S+@\S+\.\S+$")
+FORMAT_PATTERNS = {"email": EMAIL_RE}
+DEFAULT_SPEC_PATH = Path(__file__).resolve().parents[2] / "docs" / "state-machine.json"
+
+Fields = dict[str, str]
+Predicate = Callable[[Fields], bool]
+
+
+def clean_text(value: Any) -> str:
+    if value.__class__ is str:
+        return value.strip()
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).strip()
+
+
+TRUTHY = frozenset({"1", "true", "yes", "y", "on"})
+
+# One predicate term as plain data: (field, values, negate, names). With names empty it
+# is "field=value" (true when the cleaned, lower-cased value is in values, flipped by
+# negate); otherwise it is an "a+b" test that every named field is filled in.
+Term = tuple[str, frozenset[str], bool, tuple[str, ...]]
+
+
+def as_bool(value: Any) -> bool:
+    return clean_text(value).lower() in TRUTHY
+
+
+def parse_term(term: str) -> Term:
+    if "==" in term:
+        name, expected = (part.strip() for part in term.split("==", 1))
+        if expected.lower() in {"true", "false"}:
+            return name, TRUTHY, expected.lower() == "false", ()
+        return name, frozenset({expected.lower()}), False, ()
+    if "=" in term:
+        name, expected = (part.strip() for part in term.split("=", 1))
+        return name, frozenset({expected.lower()}), False, ()
+    names = tuple(part.strip() for part in term.split("+") if part.strip())
+    if not names:
+        raise ValueError(f"empty predicate term: {term!r}")
+    return "", frozenset(), False, names
+
+
+def parse_expression(expression: str) -> tuple[Term, ...]:
+    return tuple(parse_term(term.strip()) for term in re.split(r"\s+OR\s+", expression.strip()))
+
+
+def term_holds(term: Term, fields: Fields) -> bool:
+    field, values, negate, names = term
+    if names:
+        for name in names:
+            if not clean_text(fields.get(name)):
+                return False
+        return True
+    return (clean_text(fields.get(field)).lower() in values) is not negate
+
+
+class Rule:
+    __slots__ = ("terms", "presence_groups")
+
+    def __init__(self, terms: tuple[Term, ...]) -> None:
+        self.terms = terms
+        self.presence_groups = [term[3] for term in terms if term[3]]
+
+    def check(self, fields: Fields) -> bool:
+        for term in self.terms:
+            if term_holds(term, fields):
+                return True
+        return False
+
+    def missing(self, fields: Fields) -> list[str]:
+        # A failed rule reports the fields of its last "a+b" alternative, which is the
+        # branch a user can always satisfy by filling fields in.
+        if not self.presence_groups:
+            return []
+        return [name for name in self.presence_groups[-1] if not clean_text(fields.get(name))]
+
+
+def compile_rule(expression: str) -> Rule:
+    return Rule(parse_expression(expression))
+
+
+def compile_predicate(expression: str) -> Predicate:
+    return compile_rule(expression).check
+
+
+def _compile_response(spec: dict[str, Any] | None) -> Callable[[Fields, Callable[[Fields], str]], str]:
+    if not spec:
+        return lambda fields, summarize: ""
+    cases = [(compile_predicate(case["when"]), case["text"]) for case in spec.get("cases", [])]
+    join = tuple(spec.get("join", ()))
+    first_of = tuple(spec.get("first_of", ()))
+    fallback = spec.get("text", "")
+    build_summary = bool(spec.get("build_summary"))
+
+    def respond(fields: Fields, summarize: Callable[[Fields], str]) -> str:
+        for check, text in cases:
+            if check(fields):
+                return text
+        if join:
+            return " | ".join(fields[name] for name in join if fields.get(name))
+        for name in first_of:
+            if fields.get(name):
+                return fields[name]
+        if build_summary:
+            return summarize(fields)
+        return fallback
+
+    return respond
+
+
+class CompiledState:
+    __slots__ = (
+        "name",
+        "required",
+        "rules",
+        "formats",
+        "transitions",
+        "prompt",
+        "prompt_variants",
+        "prompt_appends_summary",
+        "respond",
+    )
+
+    def __init__(self, spec: dict[str, Any]) -> None:
+        self.name: str = spec["name"]
+        self.required: tuple[str, ...] = tuple(spec.get("required_fields", ()))
+        self.rules: tuple[Rule, ...] = tuple(compile_rule(rule) for rule in spec.get("rules", ()))
+        self.formats = tuple((name, FORMAT_PATTERNS[kind]) for name, kind in spec.get("formats", {}).items())
+        self.transitions: tuple[tuple[Predicate | None, str], ...] = ()
+        self.prompt: str = spec.get("prompt", "")
+        self.prompt_variants = tuple(
+            (compile_predicate(variant["when"]), variant["prompt"]) for variant in spec.get("prompt_variants", ())
+        )
+        self.prompt_appends_summary = bool(spec.get("prompt_appends_summary"))
+        self.respond = _compile_response(spec.get("response"))
+
+
+# A transition guard as data: the terms of its expression, and whether the edge is
+# taken when they do not hold (skip_if). None is an unconditional edge.
+Guard = tuple[tuple[Term, ...], bool]
+
+
+def _parse_guard(transition: dict[str, Any]) -> Guard | None:
+    if "when" in transition:
+        return parse_expression(transition["when"]), False
+    if "when_skipped" in transition:
+        return parse_expression(transition["when_skipped"]), False
+    if "skip_if" in transition:
+        return parse_expression(transition["skip_if"]), True
+    return None
+
+
+def _guard_predicate(guard: Guard | None) -> Predicate | None:
+    if guard is None:
+        return None
+    rule, negated = Rule(guard[0]), guard[1]
+    return (lambda fields: not rule.check(fields)) if negated else rule.check
+
+
+def _transition_table(edges: list[tuple[Guard | None, str]]) -> tuple[str | None, dict[str, str], str] | None:
+    # A state whose guards are all unconditional or single "field=value" tests on one
+    # field becomes (field, cleaned value -> target, default target), so picking the next
+    # state is one dict lookup. The table is filled by running the guards in declaration
+    # order for every value they name; anything else resolves like the empty string.
+    field: str | None = None
+    tests: list[tuple[tuple[frozenset[str], bool] | None, str]] = []
+    for guard, target in edges:
+        if guard is None:
+            tests.append((None, target))
+            continue
+        terms, negated = guard
+        if len(terms) != 1 or terms[0][3] or field not in (None, terms[0][0]):
+            return None
+        field, values, negate, _names = terms[0]
+        tests.append(((values, negate is not negated), target))
+
+    def pick(value: str) -> str:
+        for test, target in tests:
+            if test is None or (value in test[0]) is not test[1]:
+                return target
+        # No guard matched (e.g. an unrecognised mode): take the first declared edge.
+        return tests[0][1]
+
+    default = pick("")
+    keys = set().union(*(test[0] for test, _target in tests if test is not None))
+    table = {key: target for key in keys if (target := pick(key)) != default}
+    return field, table, default
+
+
+class ValidationFailure:
+    __slots__ = ("missing", "invalid")
+
+    def __init__(self, missing: list[str], invalid: list[str]) -> None:
+        self.missing = missing
+        self.invalid = invalid
+
+    def detail(self) -> dict[str, Any]:
+        # The first error stays at the top level for clients that predate "errors".
+        errors: list[dict[str, Any]] = [{"error": "missing_fields", "fields": self.missing}] if self.missing else []
+        for name in self.invalid:
+            errors.append({"error": "invalid_" + name, "field": name})
+        detail = errors[0].copy()
+        detail["errors"] = errors
+        return detail
+
+
+class StateMachine:
+    def __init__(self, spec: dict[str, Any]) -> None:
+        self.states: dict[str, CompiledState] = {state["name"]: CompiledState(state) for state in spec["states"]}
+        self.terminal: str = spec.get("end_and_send", {}).get("to", "SUBMIT")
+        outgoing: dict[str, list[tuple[Guard | None, str]]] = {}
+        for transition in spec.get("transitions", []):
+            source, target = transition["from"], transition["to"]
+            if source not in self.states or target not in self.states:
+                raise ValueError(f"transition {source} -> {target} references an unknown state")
+            outgoing.setdefault(source, []).append((_parse_guard(transition), target))
+        # Next steps are precomputed per state: a fixed target, or (field, cleaned value
+        # -> target, default) for a branch on one field. Guards that cannot be tabled
+        # (OR, "a+b") keep their ordered predicate list in _guarded.
+        self._fixed: dict[str, str] = {}
+        self._branches: dict[str, tuple[str, dict[str, str], str]] = {}
+        self._guarded: dict[str, tuple[tuple[Predicate | None, str], ...]] = {}
+        for name, state in self.states.items():
+            edges = outgoing.get(name, [])
+            state.transitions = tuple((_guard_predicate(guard), target) for guard, target in edges)
+            table = _transition_table(edges) if edges else (None, {}, self.terminal)
+            if table is None:
+                self._guarded[name] = state.transitions
+            elif table[0] is None or not table[1]:
+                self._fixed[name] = table[2]
+            else:
+                self._branches[name] = table
+        # Only states that check something; each is (required, rules, formats).
+        self._checks = {
+            name: (state.required, state.rules, state.formats)
+            for name, state in self.states.items()
+            if state.required or state.rules or state.formats
+        }
+
+    @classmethod
+    def from_file(cls, path: str | Path = DEFAULT_SPEC_PATH) -> StateMachine:
+        with open(path, encoding="utf-8-sig") as handle:
+            return cls(json.load(handle))
+
+    def next_state(self, current_state: str, fields: Fields) -> str:
+        target = self._fixed.get(current_state)
+        if target is not None:
+            return target
+        branch = self._branches.get(current_state)
+        if branch is None:
+            return self._choose(current_state, fields)
+        field, table, target = branch
+        value = fields.get(field)
+        if value is None:
+            return target
+        return table.get(clean_text(value).lower(), target)
+
+    def _choose(self, current_state: str, fields: Fields) -> str:
+        transitions = self._guarded.get(current_state)
+        if transitions is None:
+            return self.terminal
+        for guard, target in transitions:
+            if guard is None or guard(fields):
+                return target
+        # No guard matched (e.g. an unrecognised mode): take the first declared edge.
+        return transitions[0][1]
+
+    def validate(self, state_name: str, fields: Fields) -> ValidationFailure | None:
+        # Runs on every step, so it walks the precomputed tuples with plain loops and
+        # only allocates a ValidationFailure when something is actually wrong.
+        checks = self._checks.get(state_name)
+        if checks is None:
+            return None
+        required, rules, formats = checks
+        missing: list[str] = []
+        for name in required:
+            value = fields.get(name)
+            if value is None or not clean_text(value):
+                missing.append(name)
+        for rule in rules:
+            for term in rule.terms:
+                if term_holds(term, fields):
+                    break
+            else:
+                for name in rule.missing(fields):
+                    if name not in missing:
+                        missing.append(name)
+        invalid: list[str] = []
+        for name, pattern in formats:
+            value = fields.get(name)
+            if value is not None and (value := clean_text(value)) and not pattern.match(value):
+                invalid.append(name)
+        if missing or invalid:
+            return ValidationFailure(missing, invalid)
+        return None
+
+    def prompt(self, state_name: str, fields: Fields, summarize: Callable[[Fields], str]) -> str:
+        state = self.states[state_name]
+        for check, prompt in state.prompt_variants:
+            if check(fields):
+                return prompt
+        if state.prompt_appends_summary:
+            summary = summarize(fields)
+            if summary:
+                return f"{state.prompt}\n\n{summary}"
+        return state.prompt
+
+    def step_response(self, state_name: str, fields: Fields, summarize: Callable[[Fields], str]) -> str:
+        state = self.states.get(state_name)
+        if state is None:
+            return ""
+        return state.respond(fields, summarize)
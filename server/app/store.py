@@ -0,0 +1,883 @@
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from threading import Event, Lock, RLock, Thread
+from typing import Any, Protocol
+from uuid import UUID, uuid4
+
+import anyio.to_thread
+
+from audit import AuditEvent, audit_key
+from metrics import LOCK_BUCKETS, REGISTRY
+from records import ConversationRecord, MessageRecord
+from wal import WriteAheadLog
+
+LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    "onb1_store_lock_wait_seconds", "Time spent waiting for a conversation lock.", buckets=LOCK_BUCKETS
+)
+LOCK_HOLD_SECONDS = REGISTRY.histogram(
+    "onb1_store_lock_hold_seconds", "Time a conversation lock was held.", buckets=LOCK_BUCKETS
+)
+
+
+class Durability:
+    # Highest log sequence number journaled while durability was deferred.
+    __slots__ = ("lsn",)
+
+    def __init__(self) -> None:
+        self.lsn = 0
+
+
+_DEFERRED: ContextVar[Durability | None] = ContextVar("onb1_deferred_durability", default=None)
+
+
+class Store(Protocol):
+    # Every conversation access the handlers make. ConversationStore keeps records in
+    # process memory, SQLiteStore shares them between the worker processes on one host,
+    # and PostgresStore keeps them as rows in the application database. Each operation
+    # is atomic on its own; the conditional ones take the version the caller read and
+    # write nothing when another writer got there first.
+
+    # Called with the id of each conversation removed or dropped for good (not spilled).
+    on_removed: Callable[[UUID], None] | None
+    # Names the store's version sequence in ETags; see response_cache.version_etag.
+    epoch: str
+    # True when an operation may wait on I/O (a database, the spill file), so handlers
+    # have to run on worker threads rather than on the event loop.
+    blocking: bool
+    # True when claim_handoffs() is an indexed queue cheap enough to poll, so any worker
+    # delivers recorded handoffs; otherwise the recording request queues its own.
+    outbox_polling: bool
+
+    async def start(self) -> None: ...
+
+    async def stop(self) -> None: ...
+
+    def insert(self, conversation: ConversationRecord) -> None: ...
+
+    def snapshot(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None: ...
+
+    async def snapshot_async(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None: ...
+
+    def version(self, conversation_id: UUID) -> int | None: ...
+
+    def existing(self, conversation_ids: list[UUID]) -> set[UUID]: ...
+
+    def update(
+        self,
+        conversation_id: UUID,
+        expected_version: int | None,
+        fields: dict[str, str],
+        *,
+        state: str | None = None,
+        messages: list[MessageRecord] | None = None,
+    ) -> bool: ...
+
+    def end(
+        self,
+        conversation_id: UUID,
+        expected_version: int,
+        fields: dict[str, str],
+        *,
+        state: str,
+        brief: dict[str, Any],
+        attachments: list[dict[str, Any]],
+        handoff: dict[str, Any],
+    ) -> dict[str, Any] | None: ...
+
+    def append_audit(self, events: list[AuditEvent], keep: int = 0) -> None: ...
+
+    def audit_events(self, conversation_id: UUID, after: tuple[datetime, UUID], limit: int) -> list[dict[str, Any]] | None: ...
+
+    def add_handoff(self, conversation_id: UUID, slack_post_id: str, payload: dict[str, Any], lease_until: float | None) -> bool: ...
+
+    def claim_handoffs(self, limit: int | None, lease_seconds: float) -> list[tuple[str, dict[str, Any]]]: ...
+
+    def settle_handoff(
+        self, conversation_id: UUID, slack_post_id: str, status: str, attempts: int, last_error: str | None
+    ) -> UUID | None: ...
+
+    def stats(self) -> dict[str, Any]: ...
+
+    def deferred_durability(self) -> AbstractContextManager[Durability]: ...
+
+    async def durable(self, ticket: Durability) -> None: ...
+
+
+# Record fields an update() or end() may change, journaled together as one "set".
+UPDATED_FIELDS = ("normalized_fields", "participant_name", "participant_email", "state", "status", "updated_us")
+
+
+class RecordStore(ABC):
+    # The Store operations for backends that keep whole ConversationRecords: each one is
+    # a locked() block that changes the record and journals the change, so the in-memory
+    # store and SQLite share them and only differ in locked(), journal() and ids().
+
+    outbox_polling = False
+
+    @abstractmethod
+    def locked(self, conversation_id: UUID, *, missing_ok: bool = False) -> AbstractContextManager[ConversationRecord | None]: ...
+
+    @abstractmethod
+    def journal(self, conversation: ConversationRecord, op: str, payload: Any = None) -> None: ...
+
+    @abstractmethod
+    def ids(self) -> list[UUID]: ...
+
+    @abstractmethod
+    def snapshot(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None: ...
+
+    @abstractmethod
+    def append_messages(self, conversation_id: UUID, messages: list[MessageRecord]) -> int: ...
+
+    @abstractmethod
+    def close(self) -> None: ...
+
+    async def start(self) -> None:
+        return None
+
+    async def stop(self) -> None:
+        self.close()
+
+    async def snapshot_async(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+        return await anyio.to_thread.run_sync(self.snapshot, conversation_id, since)
+
+    def update(
+        self,
+        conversation_id: UUID,
+        expected_version: int | None,
+        fields: dict[str, str],
+        *,
+        state: str | None = None,
+        messages: list[MessageRecord] | None = None,
+    ) -> bool:
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None or expected_version is not None and conversation.version != expected_version:
+                return False
+            _set_fields(conversation, fields, state, None)
+            self.journal(conversation, "set", conversation.changes(*UPDATED_FIELDS))
+            if messages:
+                self.append_messages(conversation_id, messages)
+        return True
+
+    def end(
+        self,
+        conversation_id: UUID,
+        expected_version: int,
+        fields: dict[str, str],
+        *,
+        state: str,
+        brief: dict[str, Any],
+        attachments: list[dict[str, Any]],
+        handoff: dict[str, Any],
+    ) -> dict[str, Any] | None:
+        # The handoff is only recorded once: a conversation ended again keeps its first post.
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None or conversation.version != expected_version:
+                return None
+            _set_fields(conversation, fields, state, "ended")
+            conversation.attachments = tuple(attachments) or None
+            conversation.intake_brief = brief
+            changed = [*UPDATED_FIELDS, "attachments", "intake_brief"]
+            if not conversation.slack_post_id:
+                for name, value in handoff.items():
+                    setattr(conversation, name, value)
+                changed.extend(handoff)
+            self.journal(conversation, "set", conversation.changes(*changed))
+            return conversation.to_row()
+
+    def append_audit(self, events: list[AuditEvent], keep: int = 0) -> None:
+        # Only the newest `keep` events stay on each record; events for a conversation
+        # that is gone are dropped.
+        grouped: dict[UUID, list[dict[str, Any]]] = {}
+        for event in events:
+            grouped.setdefault(event.conversation_id, []).append(event.as_dict())
+        for conversation_id, rows in grouped.items():
+            with self.locked(conversation_id, missing_ok=True) as conversation:
+                if conversation is None:
+                    continue
+                conversation.add_audit_events(rows, keep)
+                self.journal(conversation, "audit", (rows, keep))
+
+    def audit_events(self, conversation_id: UUID, after: tuple[datetime, UUID], limit: int) -> list[dict[str, Any]] | None:
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None:
+                return None
+            events = list(conversation.audit_log or ())
+        keyed = sorted((audit_key(event), event) for event in events)
+        return [event for key, event in keyed if key > after][:limit]
+
+    def add_handoff(self, conversation_id: UUID, slack_post_id: str, payload: dict[str, Any], lease_until: float | None) -> bool:
+        # A post beside the conversation's own handoff; it is journaled before the caller
+        # queues it, so a restart re-claims it once the lease runs out.
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None:
+                return False
+            conversation.slack_posts = {**(conversation.slack_posts or {}), slack_post_id: {"payload": payload, "lease_until": lease_until}}
+            self.journal(conversation, "set", {"slack_posts": conversation.slack_posts})
+        return True
+
+    def claim_handoffs(self, limit: int | None, lease_seconds: float) -> list[tuple[str, dict[str, Any]]]:
+        # The lease keeps other worker processes sharing a SQLite store from sending the
+        # same payload; a handoff whose lease ran out is claimed again.
+        now = time.time()
+        claimed: list[tuple[str, dict[str, Any]]] = []
+        for conversation_id in self.ids():
+            if limit is not None and len(claimed) >= limit:
+                break
+            with self.locked(conversation_id, missing_ok=True) as conversation:
+                if conversation is None:
+                    continue
+                changes: dict[str, Any] = {}
+                if conversation.slack_delivery == "pending" and conversation.slack_payload is not None:
+                    if conversation.slack_lease_until is None or conversation.slack_lease_until <= now:
+                        conversation.slack_lease_until = changes["slack_lease_until"] = now + lease_seconds
+                        claimed.append((conversation.slack_post_id, conversation.slack_payload))
+                if conversation.slack_posts:
+                    posts = dict(conversation.slack_posts)
+                    for slack_post_id, post in conversation.slack_posts.items():
+                        if post["lease_until"] is None or post["lease_until"] <= now:
+                            posts[slack_post_id] = {**post, "lease_until": now + lease_seconds}
+                            claimed.append((slack_post_id, post["payload"]))
+                    if posts != conversation.slack_posts:
+                        conversation.slack_posts = changes["slack_posts"] = posts
+                if changes:
+                    self.journal(conversation, "set", changes)
+        return claimed
+
+    def settle_handoff(
+        self, conversation_id: UUID, slack_post_id: str, status: str, attempts: int, last_error: str | None
+    ) -> UUID | None:
+        # A conversation with another post id (or no stored handoff at all) is left alone.
+        # Settling one of its slack_posts only drops the post: the conversation's own
+        # delivery status is unchanged, so None is returned.
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None:
+                return None
+            if conversation.slack_posts and slack_post_id in conversation.slack_posts:
+                posts = {key: post for key, post in conversation.slack_posts.items() if key != slack_post_id}
+                conversation.slack_posts = posts or None
+                self.journal(conversation, "set", {"slack_posts": conversation.slack_posts})
+                return None
+            if conversation.slack_post_id != slack_post_id:
+                return None
+            conversation.slack_delivery = status
+            conversation.slack_lease_until = None
+            self.journal(conversation, "set", conversation.changes("slack_delivery", "slack_lease_until"))
+        return conversation_id
+
+
+def _set_fields(conversation: ConversationRecord, fields: dict[str, str], state: str | None, status: str | None) -> None:
+    conversation.normalized_fields = fields
+    if fields.get("full_name"):
+        conversation.participant_name = fields["full_name"]
+    if fields.get("email"):
+        conversation.participant_email = fields["email"]
+    if state:
+        conversation.set_state(state)
+    if status:
+        conversation.set_status(status)
+    conversation.touch()
+
+
+class StoreLimits:
+    def __init__(
+        self,
+        max_entries: int = 0,
+        max_bytes: int = 0,
+        ended_ttl: float = 0.0,
+        idle_ttl: float = 0.0,
+        sweep_interval: float = 30.0,
+    ) -> None:
+        if max_entries < 0 or max_bytes < 0 or ended_ttl < 0 or idle_ttl < 0:
+            raise ValueError("store limits must be non-negative (0 disables a limit)")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ended_ttl = ended_ttl
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+
+    @classmethod
+    def from_env(cls) -> StoreLimits:
+        return cls(
+            max_entries=int(os.getenv("STORE_MAX_ENTRIES", "10000")),
+            max_bytes=int(os.getenv("STORE_MAX_BYTES", "0")),
+            ended_ttl=float(os.getenv("STORE_ENDED_TTL_SECONDS", "3600")),
+            idle_ttl=float(os.getenv("STORE_IDLE_TTL_SECONDS", "86400")),
+            sweep_interval=float(os.getenv("STORE_SWEEP_INTERVAL_SECONDS", "30")),
+        )
+
+
+class SpillFile:
+    # Cold conversations are pickled into one SQLite table. The file is only created
+    # on the first spill, and the connection is shared by every thread behind a lock.
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=FULL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS spilled (id TEXT PRIMARY KEY, payload BLOB NOT NULL)")
+        return self._db
+
+    def _exists(self) -> bool:
+        return self._db is not None or self.path.exists()
+
+    def put_many(self, records: list[ConversationRecord]) -> None:
+        rows = [(str(record.id), pickle.dumps(record, pickle.HIGHEST_PROTOCOL)) for record in records]
+        with self._lock:
+            db = self._conn()
+            db.execute("BEGIN")
+            db.executemany("INSERT OR REPLACE INTO spilled (id, payload) VALUES (?, ?)", rows)
+            db.execute("COMMIT")
+
+    def get(self, conversation_id: UUID) -> ConversationRecord | None:
+        # Rows stay after a fault-in: the copy remains a durable base for the record,
+        # and the next eviction simply replaces it.
+        with self._lock:
+            if not self._exists():
+                return None
+            row = self._conn().execute("SELECT payload FROM spilled WHERE id = ?", (str(conversation_id),)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def delete(self, conversation_id: UUID) -> ConversationRecord | None:
+        with self._lock:
+            if not self._exists():
+                return None
+            row = self._conn().execute("DELETE FROM spilled WHERE id = ? RETURNING payload", (str(conversation_id),)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def contains(self, conversation_id: UUID) -> bool:
+        with self._lock:
+            if not self._exists():
+                return False
+            return self._conn().execute("SELECT 1 FROM spilled WHERE id = ?", (str(conversation_id),)).fetchone() is not None
+
+    def count(self) -> int:
+        with self._lock:
+            if not self._exists():
+                return 0
+            return self._conn().execute("SELECT count(*) FROM spilled").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._exists():
+                self._conn().execute("DELETE FROM spilled")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class _Entry:
+    __slots__ = ("lock", "conversation", "size", "last_access", "evicted")
+
+    def __init__(self, conversation: ConversationRecord) -> None:
+        # Reentrant so a handler can hold a conversation across several store calls.
+        self.lock = RLock()
+        self.conversation = conversation
+        self.size = conversation.footprint()
+        self.last_access = time.monotonic()
+        self.evicted = False
+
+
+class _Loading:
+    # Marks a conversation being faulted in from the spill file, so concurrent lookups
+    # of the same id wait for that one read instead of repeating it. An insert, remove
+    # or clear in the meantime cancels the load, and the loader looks the id up again.
+    __slots__ = ("done", "cancelled")
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.cancelled = False
+
+
+class ConversationStore(RecordStore):
+    # The map lock only guards membership of the id -> entry map and is never held
+    # while a conversation is being read or mutated. Each conversation carries its
+    # own lock, so a slow handler on one intake cannot stall any other intake.
+    #
+    # Entries are kept in least-recently-used order. Over max_entries/max_bytes, or
+    # past their TTL, the coldest conversations move to the spill file and are faulted
+    # back in on their next lookup. Without a spill file only ended conversations are
+    # evicted for space, and only TTL expiry drops anything else. Eviction only ever
+    # try-locks a conversation, so one that a handler is using stays resident.
+    #
+    # Victims leave the map under the map lock but are written to the spill file after
+    # it is released, still holding their own locks: a lookup meanwhile finds them in
+    # _evicting, waits on that lock and then faults the fresh copy back in.
+
+    def __init__(
+        self,
+        limits: StoreLimits | None = None,
+        spill: SpillFile | None = None,
+        wal: WriteAheadLog | None = None,
+    ) -> None:
+        self.limits = limits or StoreLimits()
+        self.spill = spill
+        self.wal = wal
+        self.on_removed: Callable[[UUID], None] | None = None
+        self.epoch = uuid4().hex[:12]
+        self._checkpointing = Lock()
+        self._map_lock = Lock()
+        self._entries: OrderedDict[UUID, _Entry] = OrderedDict()
+        self._loading: dict[UUID, _Loading] = {}
+        self._evicting: dict[UUID, _Entry] = {}
+        # Ids whose spill row is being deleted, so a concurrent lookup cannot fault them back in.
+        self._removing: set[UUID] = set()
+        # id -> current version, written under the conversation's lock and read without
+        # any lock so conditional GETs never wait on a busy conversation.
+        self._versions: dict[UUID, int] = {}
+        self._bytes = 0
+        self._last_sweep = time.monotonic()
+        self._counters = {"hits": 0, "misses": 0, "faults": 0, "evictions": 0, "expirations": 0, "dropped": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def blocking(self) -> bool:
+        # The WAL never blocks a handler (see deferred_durability); spill reads and writes do.
+        return self.spill is not None
+
+    async def start(self) -> None:
+        if self.wal is not None:
+            await anyio.to_thread.run_sync(self.recover)
+
+    async def stop(self) -> None:
+        if self.wal is not None:
+            # A final snapshot keeps the next startup's replay short.
+            await anyio.to_thread.run_sync(self.checkpoint)
+        self.close()
+
+    def __contains__(self, conversation_id: object) -> bool:
+        if conversation_id in self._entries or conversation_id in self._evicting:
+            return True
+        if conversation_id in self._removing:
+            return False
+        return isinstance(conversation_id, UUID) and self.spill is not None and self.spill.contains(conversation_id)
+
+    def existing(self, conversation_ids: list[UUID]) -> set[UUID]:
+        return {conversation_id for conversation_id in conversation_ids if conversation_id in self}
+
+    def _entry(self, conversation_id: UUID) -> _Entry | None:
+        while True:
+            with self._map_lock:
+                entry = self._entries.get(conversation_id)
+                if entry is not None:
+                    self._counters["hits"] += 1
+                    self._entries.move_to_end(conversation_id)
+                    entry.last_access = time.monotonic()
+                    return entry
+                entry = self._evicting.get(conversation_id)
+                if entry is not None:
+                    return entry
+                if self.spill is None or conversation_id in self._removing:
+                    self._counters["misses"] += 1
+                    return None
+                loading = self._loading.get(conversation_id)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[conversation_id] = _Loading()
+            if not owner:
+                loading.done.wait()
+                continue
+            # The spill read and unpickle run without the map lock, so a cold lookup
+            # never stalls lookups of other conversations.
+            try:
+                record = self.spill.get(conversation_id)
+            except BaseException:
+                with self._map_lock:
+                    self._loading.pop(conversation_id, None)
+                loading.done.set()
+                raise
+            with self._map_lock:
+                if self._loading.get(conversation_id) is loading:
+                    del self._loading[conversation_id]
+                loading.done.set()
+                if loading.cancelled:
+                    continue
+                if record is None:
+                    self._counters["misses"] += 1
+                    return None
+                self._counters["faults"] += 1
+                entry = self._add(record)
+                victims = self._select_victims(keep=conversation_id)
+            self._evict(victims, "evictions")
+            return entry
+
+    def _cancel_load(self, conversation_id: UUID) -> None:
+        loading = self._loading.pop(conversation_id, None)
+        if loading is not None:
+            loading.cancelled = True
+
+    def _add(self, conversation: ConversationRecord) -> _Entry:
+        self._cancel_load(conversation.id)
+        entry = _Entry(conversation)
+        previous = self._entries.pop(conversation.id, None)
+        if previous is not None:
+            self._bytes -= previous.size
+            previous.evicted = True
+        self._entries[conversation.id] = entry
+        self._bytes += entry.size
+        return entry
+
+    def _over(self, count: int, size: int) -> bool:
+        limits = self.limits
+        return bool((limits.max_entries and count > limits.max_entries) or (limits.max_bytes and size > limits.max_bytes))
+
+    def _select_victims(self, keep: UUID | None = None) -> list[_Entry]:
+        # Runs with the map lock held. The victims leave the map with their locks held;
+        # the caller hands them to _evict once it has released the map lock.
+        count, size = len(self._entries), self._bytes
+        if not self._over(count, size):
+            return []
+        victims = []
+        for conversation_id, entry in self._entries.items():
+            if not self._over(count, size):
+                break
+            if conversation_id == keep:
+                continue
+            # Nothing to spill to: a live conversation stays resident rather than be lost.
+            if self.spill is None and entry.conversation.status != "ended":
+                continue
+            if not entry.lock.acquire(blocking=False):
+                continue
+            victims.append(entry)
+            count -= 1
+            size -= entry.size
+        self._take(victims)
+        return victims
+
+    def _take(self, victims: list[_Entry]) -> None:
+        for entry in victims:
+            del self._entries[entry.conversation.id]
+            self._bytes -= entry.size
+            if self.spill is not None:
+                self._evicting[entry.conversation.id] = entry
+
+    def _evict(self, victims: list[_Entry], counter: str) -> None:
+        # Runs without the map lock; every victim's lock is still held, so nobody can
+        # read or change a victim until the spill file has its current copy.
+        if not victims:
+            return
+        try:
+            if self.spill is not None:
+                self.spill.put_many([entry.conversation for entry in victims])
+        except BaseException:
+            # Not spilled: put them back rather than lose them.
+            with self._map_lock:
+                for entry in victims:
+                    conversation_id = entry.conversation.id
+                    if self._evicting.get(conversation_id) is entry:
+                        del self._evicting[conversation_id]
+                        self._entries[conversation_id] = entry
+                        self._entries.move_to_end(conversation_id, last=False)
+                        self._bytes += entry.size
+            for entry in victims:
+                entry.lock.release()
+            raise
+        with self._map_lock:
+            for entry in victims:
+                conversation_id = entry.conversation.id
+                entry.evicted = True
+                if self._evicting.get(conversation_id) is entry:
+                    del self._evicting[conversation_id]
+                if self.spill is None:
+                    self._versions.pop(conversation_id, None)
+            if self.spill is None:
+                self._counters["dropped"] += len(victims)
+            self._counters[counter] += len(victims)
+        for entry in victims:
+            entry.lock.release()
+        if self.spill is None and self.on_removed is not None:
+            for entry in victims:
+                self.on_removed(entry.conversation.id)
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.monotonic() if now is None else now
+        limits = self.limits
+        ttls = [ttl for ttl in (limits.ended_ttl, limits.idle_ttl) if ttl]
+        with self._map_lock:
+            self._last_sweep = now
+            if not ttls:
+                return 0
+            shortest = min(ttls)
+            expired = []
+            for entry in self._entries.values():
+                idle = now - entry.last_access
+                if idle < shortest:
+                    # LRU order: every later entry was touched more recently.
+                    break
+                ttl = limits.ended_ttl if entry.conversation.status == "ended" else limits.idle_ttl
+                if ttl and idle >= ttl and entry.lock.acquire(blocking=False):
+                    expired.append(entry)
+            self._take(expired)
+        self._evict(expired, "expirations")
+        return len(expired)
+
+    def _maybe_sweep(self) -> None:
+        interval = self.limits.sweep_interval
+        if interval and time.monotonic() - self._last_sweep >= interval:
+            self.sweep()
+
+    def insert(self, conversation: ConversationRecord) -> None:
+        # Logged before it becomes visible, so no later change can precede its insert.
+        self.journal(conversation, "insert", conversation)
+        with self._map_lock:
+            self._add(conversation)
+            victims = self._select_victims(keep=conversation.id)
+        self._evict(victims, "evictions")
+        self._maybe_sweep()
+
+    def remove(self, conversation_id: UUID) -> ConversationRecord | None:
+        if self.wal is not None:
+            self.wal.append("remove", conversation_id)
+        while True:
+            with self._map_lock:
+                evicting = self._evicting.get(conversation_id)
+                if evicting is None:
+                    self._cancel_load(conversation_id)
+                    self._versions.pop(conversation_id, None)
+                    entry = self._entries.pop(conversation_id, None)
+                    if entry is not None:
+                        self._bytes -= entry.size
+                        entry.evicted = True
+                    if self.spill is not None:
+                        self._removing.add(conversation_id)
+                    break
+            # Being written to the spill file: wait for that, then delete the row it wrote.
+            with evicting.lock:
+                pass
+        spilled = None
+        if self.spill is not None:
+            try:
+                spilled = self.spill.delete(conversation_id)
+            finally:
+                with self._map_lock:
+                    self._removing.discard(conversation_id)
+        removed = entry.conversation if entry is not None else spilled
+        if removed is not None and self.on_removed is not None:
+            self.on_removed(conversation_id)
+        return removed
+
+    def clear(self) -> None:
+        with self._map_lock:
+            for entry in self._entries.values():
+                entry.evicted = True
+            for conversation_id in list(self._loading):
+                self._cancel_load(conversation_id)
+            self._entries.clear()
+            self._versions.clear()
+            self._bytes = 0
+        if self.spill is not None:
+            self.spill.clear()
+
+    def ids(self) -> list[UUID]:
+        with self._map_lock:
+            return list(self._entries)
+
+    def stats(self) -> dict[str, Any]:
+        with self._map_lock:
+            stats = {
+                "resident": len(self._entries),
+                "resident_bytes": self._bytes,
+                "resident_messages": sum(len(entry.conversation.messages) for entry in self._entries.values()),
+                "max_entries": self.limits.max_entries,
+                "max_bytes": self.limits.max_bytes,
+                **self._counters,
+            }
+        stats["spilled"] = self.spill.count() if self.spill is not None else 0
+        if self.wal is not None:
+            stats["wal"] = self.wal.stats()
+        return stats
+
+    @contextmanager
+    def locked(self, conversation_id: UUID, *, missing_ok: bool = False) -> Iterator[ConversationRecord | None]:
+        while True:
+            entry = self._entry(conversation_id)
+            if entry is None:
+                if not missing_ok:
+                    raise KeyError(conversation_id)
+                yield None
+                return
+            # Every acquisition is timed, reentrant ones included.
+            started = time.perf_counter()
+            with entry.lock:
+                acquired = time.perf_counter()
+                LOCK_WAIT_SECONDS.observe(acquired - started)
+                # Evicted between lookup and lock: look it up again, which faults it back in.
+                if entry.evicted:
+                    continue
+                try:
+                    yield entry.conversation
+                finally:
+                    LOCK_HOLD_SECONDS.observe(time.perf_counter() - acquired)
+                return
+
+    def append_messages(self, conversation_id: UUID, messages: list[MessageRecord]) -> int:
+        # Messages are an append-only log: a message's seq is its 1-based position,
+        # so reading everything after a cursor is a slice rather than a scan.
+        with self.locked(conversation_id) as conversation:
+            log = conversation.messages
+            for message in messages:
+                message.seq = len(log) + 1
+                log.append(message)
+            grown = sum(message.footprint() for message in messages)
+            with self._map_lock:
+                entry = self._entries.get(conversation_id)
+                if entry is not None:
+                    entry.size += grown
+                    self._bytes += grown
+                victims = self._select_victims(keep=conversation_id)
+            self._evict(victims, "evictions")
+            self.journal(conversation, "append", messages)
+            return len(log)
+
+    def snapshot(self, conversation_id: UUID, since: int = 0) -> dict[str, Any] | None:
+        with self.locked(conversation_id, missing_ok=True) as conversation:
+            if conversation is None:
+                return None
+            # Recovered and faulted-in records are only published here, on first read.
+            self._versions.setdefault(conversation_id, conversation.version)
+            return conversation.to_row(since)
+
+    def version(self, conversation_id: UUID) -> int | None:
+        # None means "unknown" (never read since startup, or gone), not "missing".
+        return self._versions.get(conversation_id)
+
+    def journal(self, conversation: ConversationRecord, op: str, payload: Any = None) -> None:
+        # Callers hold the conversation's lock, so its log entries are in mutation order.
+        if op != "audit":
+            # Audit events are not part of the API representation, so they keep cached responses valid.
+            conversation.version += 1
+            self._versions[conversation.id] = conversation.version
+        if self.wal is None:
+            return
+        deferred = _DEFERRED.get()
+        conversation.lsn = self.wal.append(op, conversation.id, payload, wait=deferred is None)
+        if deferred is not None:
+            deferred.lsn = conversation.lsn
+        if self.wal.needs_snapshot() and self._checkpointing.acquire(blocking=False):
+            Thread(target=self._background_checkpoint, name="store-checkpoint", daemon=True).start()
+
+    @contextmanager
+    def deferred_durability(self) -> Iterator[Durability]:
+        # Inside the block journal() returns once a change is buffered rather than once it
+        # is fsynced, so no conversation lock is held across the flush; the caller awaits
+        # durable() afterwards, before acknowledging anything.
+        ticket = Durability()
+        token = _DEFERRED.set(ticket)
+        try:
+            yield ticket
+        finally:
+            _DEFERRED.reset(token)
+
+    async def durable(self, ticket: Durability) -> None:
+        if ticket.lsn and self.wal is not None:
+            await self.wal.wait_durable(ticket.lsn)
+
+    def close(self) -> None:
+        if self.wal is not None:
+            self.wal.close()
+        if self.spill is not None:
+            self.spill.close()
+
+    def _background_checkpoint(self) -> None:
+        try:
+            self._checkpoint()
+        finally:
+            self._checkpointing.release()
+
+    def checkpoint(self) -> int:
+        with self._checkpointing:
+            return self._checkpoint()
+
+    def _checkpoint(self) -> int:
+        # Rotate first: every change after the returned lsn is in the new segment, and a
+        # record pickled below that already includes some of them is skipped on replay by lsn.
+        lsn = self.wal.rotate()
+        with self._map_lock:
+            entries = list(self._entries.values())
+        records = []
+        for entry in entries:
+            with entry.lock:
+                if not entry.evicted:
+                    records.append(pickle.dumps(entry.conversation, pickle.HIGHEST_PROTOCOL))
+        self.wal.write_snapshot(lsn, records)
+        return len(records)
+
+    def recover(self) -> dict[str, int]:
+        # Load the newest snapshot, then replay the log tail. Spilled conversations are
+        # not in snapshots; replay faults them in and compares lsns like any other record.
+        snapshot_lsn, records = self.wal.load_snapshot()
+        for payload in records:
+            with self._map_lock:
+                self._add(pickle.loads(payload))
+                victims = self._select_victims()
+            self._evict(victims, "evictions")
+        last_lsn, replayed = snapshot_lsn, 0
+        for lsn, op, conversation_id, payload in self.wal.replay(snapshot_lsn):
+            last_lsn = lsn
+            replayed += 1
+            if op == "insert":
+                with self.locked(conversation_id, missing_ok=True) as existing:
+                    if existing is not None and existing.lsn >= lsn:
+                        continue
+                payload.lsn = lsn
+                with self._map_lock:
+                    self._add(payload)
+                    victims = self._select_victims(keep=conversation_id)
+                self._evict(victims, "evictions")
+                continue
+            if op == "remove":
+                with self._map_lock:
+                    entry = self._entries.pop(conversation_id, None)
+                    if entry is not None:
+                        self._bytes -= entry.size
+                        entry.evicted = True
+                if self.spill is not None:
+                    self.spill.delete(conversation_id)
+                continue
+            with self.locked(conversation_id, missing_ok=True) as conversation:
+                if conversation is not None and conversation.lsn < lsn:
+                    apply_change(conversation, op, payload)
+                    conversation.lsn = lsn
+        self.wal.open(last_lsn)
+        return {"snapshot_lsn": snapshot_lsn, "snapshot_records": len(records), "replayed": replayed, "last_lsn": last_lsn}
+
+
+def apply_change(conversation: ConversationRecord, op: str, payload: Any) -> None:
+    # Mirrors journal(): a replayed record ends up at the version it had before the restart.
+    if op != "audit":
+        conversation.version += 1
+    if op == "set":
+        for name, value in payload.items():
+            setattr(conversation, name, value)
+        conversation.set_state(conversation.state)
+        conversation.set_status(conversation.status)
+    elif op == "append":
+        conversation.messages.extend(payload)
+    elif op == "audit":
+        events, keep = payload
+        conversation.add_audit_events(events, keep)
+    else:
+        raise ValueError(f"unknown write-ahead log op: {op!r}")
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from pathlib import Path
+from threading import Condition, Lock, Thread
+from typing import IO, Any
+from uuid import uuid4
+
+from encoding import dumps
+
+logger = logging.getLogger(__name__)
+
+# The innermost open span of the current request. Sync handlers run in worker threads
+# with a copy of the request's context, so spans opened there still nest under it.
+_CURRENT: ContextVar[Span | None] = ContextVar("onb1_current_span", default=None)
+REQUEST_ID_MAX_LENGTH = 128
+
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "children", "_token")
+
+    def __init__(self, name: str, attrs: dict[str, Any] | None = None) -> None:
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+        self.end = 0.0
+        self.children: list[Span] = []
+
+    def __enter__(self) -> Span:
+        parent = _CURRENT.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = _CURRENT.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end = time.perf_counter()
+        _CURRENT.reset(self._token)
+        if exc_type is not None:
+            self.attrs = {**(self.attrs or {}), "error": exc_type.__name__}
+        return False
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs = {**(self.attrs or {}), **attrs}
+
+    def as_dict(self, origin: float) -> dict[str, Any]:
+        node: dict[str, Any] = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round((self.end - self.start) * 1000, 3),
+        }
+        if self.attrs:
+            node["attrs"] = self.attrs
+        if self.children:
+            node["children"] = [child.as_dict(origin) for child in self.children]
+        return node
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> _NoopSpan:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set(self, **attrs: Any) -> None:
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs: Any) -> Span | _NoopSpan:
+    # Outside a recorded request this is one context-variable read and a shared no-op.
+    if _CURRENT.get() is None:
+        return NOOP_SPAN
+    return Span(name, attrs or None)
+
+
+def tracing_active() -> bool:
+    return _CURRENT.get() is not None
+
+
+class Trace:
+    __slots__ = ("request_id", "root", "sampled", "started_at")
+
+    def __init__(self, request_id: str, name: str, sampled: bool) -> None:
+        self.request_id = request_id
+        self.root = Span(name)
+        self.sampled = sampled
+        self.started_at = time.time()
+
+
+class TraceExporter:
+    # Appends kept traces to a JSONL file from one daemon thread, so a request only
+    # pushes a line onto a bounded deque; opening, writing and flushing the file never
+    # happen on the event loop. A full buffer drops the line and counts it.
+
+    def __init__(self, path: str, capacity: int = 10_000) -> None:
+        self.path = path
+        self.capacity = max(capacity, 1)
+        self._cond = Condition()
+        self._buffer: deque[bytes] = deque()
+        self._writing = 0
+        self._file: IO[bytes] | None = None
+        self._thread: Thread | None = None
+        self._stopping = False
+        self._counters = {"exported": 0, "export_dropped": 0, "export_failed": 0}
+
+    def submit(self, line: bytes) -> bool:
+        with self._cond:
+            if len(self._buffer) >= self.capacity:
+                self._counters["export_dropped"] += 1
+                return False
+            self._buffer.append(line)
+            if self._thread is None:
+                self._stopping = False
+                self._thread = Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+            elif len(self._buffer) == 1:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._buffer or self._writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._thread is None:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout: float = 5.0) -> None:
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {**self._counters, "export_buffered": len(self._buffer)}
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._buffer and not self._stopping:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                lines = list(self._buffer)
+                self._buffer.clear()
+                self._writing = len(lines)
+            written = self._write(lines)
+            with self._cond:
+                self._writing = 0
+                self._counters["exported"] += written
+                self._counters["export_failed"] += len(lines) - written
+                self._cond.notify_all()
+
+    def _write(self, lines: list[bytes]) -> int:
+        try:
+            if self._file is None:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "ab")
+            self._file.write(b"".join(lines))
+            self._file.flush()
+        except OSError:
+            logger.exception("trace export to %s failed", self.path)
+            return 0
+        return len(lines)
+
+
+class Tracer:
+    # Sampled requests are always kept. With slow_ms set, every request records spans
+    # so that an unsampled request which turns out slow can still be dumped with its
+    # full tree; fast unsampled ones are discarded when they finish.
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        ring_size: int = 256,
+        export_path: str = "",
+        slow_ms: float = 0.0,
+        export_buffer: int = 10_000,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.export_path = export_path
+        self._ring: deque[dict[str, Any]] = deque(maxlen=max(ring_size, 1))
+        self._lock = Lock()
+        self._exporter = TraceExporter(export_path, export_buffer) if export_path else None
+        self._counters = {"started": 0, "kept": 0, "slow": 0}
+
+    @classmethod
+    def from_env(cls) -> Tracer:
+        return cls(
+            sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0")),
+            ring_size=int(os.getenv("TRACE_RING_SIZE", "256")),
+            export_path=os.getenv("TRACE_EXPORT_PATH", ""),
+            slow_ms=float(os.getenv("TRACE_SLOW_MS", "0")),
+            export_buffer=int(os.getenv("TRACE_EXPORT_BUFFER", "10000")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or self.slow_ms > 0
+
+    def begin(self, name: str, request_id: str) -> Trace | None:
+        sampled = self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        if not sampled and self.slow_ms <= 0:
+            return None
+        with self._lock:
+            self._counters["started"] += 1
+        return Trace(request_id, name, sampled)
+
+    def finish(self, trace: Trace) -> dict[str, Any] | None:
+        root = trace.root
+        duration_ms = (root.end - root.start) * 1000
+        slow = 0 < self.slow_ms <= duration_ms
+        if not (trace.sampled or slow):
+            return None
+        record = {
+            "request_id": trace.request_id,
+            "name": root.name,
+            "started_at": trace.started_at,
+            "duration_ms": round(duration_ms, 3),
+            "sampled": trace.sampled,
+            "slow": slow,
+            "spans": root.as_dict(root.start),
+        }
+        line = dumps(record) + b"\n"
+        with self._lock:
+            self._ring.append(record)
+            self._counters["kept"] += 1
+            if slow:
+                self._counters["slow"] += 1
+        if self._exporter is not None:
+            self._exporter.submit(line)
+        if slow:
+            logger.warning("slow request %s %s took %.1f ms: %s", trace.request_id, root.name, duration_ms, line.decode().rstrip())
+        return record
+
+    def recent(self, limit: int = 50, slow_only: bool = False) -> list[dict[str, Any]]:
+        with self._lock:
+            records = [record for record in reversed(self._ring) if record["slow"] or not slow_only]
+        return records[:limit]
+
+    def get(self, request_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            for record in reversed(self._ring):
+                if record["request_id"] == request_id:
+                    return record
+        return None
+
+    def close(self) -> None:
+        # Blocks until buffered lines are written; call it off the event loop.
+        if self._exporter is not None:
+            self._exporter.close()
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            stats = {**self._counters, "buffered": len(self._ring), "sample_rate": self.sample_rate, "slow_ms": self.slow_ms}
+        stats.update(self._exporter.stats() if self._exporter is not None else {"exported": 0})
+        return stats
+
+
+def request_id_from(headers: list[tuple[bytes, bytes]]) -> str:
+    for key, value in headers:
+        if key == b"x-request-id":
+            candidate = value.decode("latin-1").strip()
+            if 0 < len(candidate) <= REQUEST_ID_MAX_LENGTH and candidate.isprintable():
+                return candidate
+            break
+    return uuid4().hex
+
+
+class TraceMiddleware:
+    # Pure ASGI: assigns every request an id (echoed as X-Request-ID) and, when the
+    # tracer picks the request up, opens the root span the handlers' spans nest under.
+
+    def __init__(self, app: Any, tracer: Tracer) -> None:
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = request_id_from(scope["headers"])
+        scope.setdefault("state", {})["request_id"] = request_id
+        header = (b"x-request-id", request_id.encode("latin-1"))
+
+        async def send_with_id(message: dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), header]
+            await send(message)
+
+        trace = self.tracer.begin(f"{scope['method']} {scope['path']}", request_id) if self.tracer.enabled else None
+        if trace is None:
+            await self.app(scope, receive, send_with_id)
+            return
+        try:
+            with trace.root:
+                await self.app(scope, receive, send_with_id)
+        finally:
+            route = scope.get("route")
+            if route is not None:
+                trace.root.name = f"{scope['method']} {route.path}"
+            self.tracer.finish(trace)
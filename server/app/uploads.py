@@ -0,0 +1,698 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import Any, BinaryIO
+from urllib.parse import quote, urlsplit
+from uuid import UUID, uuid4
+
+import anyio
+import anyio.to_thread
+from starlette.responses import Response
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows: concurrent PUTs are only refused in-process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+FILE_PATH = re.compile(r"^/api/uploads/local/([^/]+)/[^/]+$")
+
+
+class UploadError(Exception):
+    def __init__(self, status: int, detail: str, headers: dict[str, str] | None = None) -> None:
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.headers = headers
+
+
+class UploadConfig:
+    def __init__(
+        self,
+        directory: str | Path,
+        secret: bytes | None = None,
+        token_ttl: float = 900.0,
+        max_bytes: int = 1 << 30,
+        chunk_bytes: int = 1 << 20,
+        public_url: str = "http://localhost:8000",
+        gc_interval: float = 300.0,
+        gc_grace: float = 3600.0,
+    ) -> None:
+        if token_ttl <= 0 or max_bytes <= 0 or chunk_bytes <= 0:
+            raise ValueError("UPLOAD_TOKEN_TTL_SECONDS, UPLOAD_MAX_BYTES and UPLOAD_CHUNK_BYTES must be positive")
+        if gc_interval <= 0 or gc_grace < 0:
+            raise ValueError("UPLOAD_GC_INTERVAL_SECONDS must be positive and UPLOAD_GC_GRACE_SECONDS non-negative")
+        self.directory = Path(directory)
+        self.secret = secret
+        self.token_ttl = token_ttl
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.public_url = public_url.rstrip("/")
+        self.gc_interval = gc_interval
+        self.gc_grace = gc_grace
+
+    @classmethod
+    def from_env(cls) -> UploadConfig:
+        secret = os.getenv("UPLOAD_SECRET")
+        return cls(
+            directory=os.getenv("UPLOAD_DIR") or ".data/uploads",
+            secret=secret.encode() if secret else None,
+            token_ttl=float(os.getenv("UPLOAD_TOKEN_TTL_SECONDS", "900")),
+            max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(1 << 30))),
+            chunk_bytes=int(os.getenv("UPLOAD_CHUNK_BYTES", str(1 << 20))),
+            public_url=os.getenv("UPLOAD_PUBLIC_URL", "http://localhost:8000"),
+            gc_interval=float(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", "300")),
+            gc_grace=float(os.getenv("UPLOAD_GC_GRACE_SECONDS", "3600")),
+        )
+
+
+class UploadRecord:
+    # The presign record, one JSON file per upload. The bytes received so far are the
+    # size of the .part file, so a chunk never has to rewrite the record. A finished
+    # upload names its content by sha256; uploads finished before content addressing
+    # have none and keep their own file.
+    __slots__ = ("id", "file_name", "content_type", "content_length", "expires_at", "complete", "sha256")
+
+    def __init__(
+        self,
+        id: UUID,
+        file_name: str,
+        content_type: str,
+        content_length: int | None,
+        expires_at: float,
+        complete: bool = False,
+        sha256: str | None = None,
+    ) -> None:
+        self.id = id
+        self.file_name = file_name
+        self.content_type = content_type
+        self.content_length = content_length
+        self.expires_at = expires_at
+        self.complete = complete
+        self.sha256 = sha256
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "id": str(self.id),
+                "file_name": self.file_name,
+                "content_type": self.content_type,
+                "content_length": self.content_length,
+                "expires_at": self.expires_at,
+                "complete": self.complete,
+                "sha256": self.sha256,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> UploadRecord:
+        data = json.loads(text)
+        return cls(
+            UUID(data["id"]),
+            data["file_name"],
+            data["content_type"],
+            data["content_length"],
+            data["expires_at"],
+            data["complete"],
+            data.get("sha256"),
+        )
+
+
+def safe_file_name(file_name: str) -> str:
+    name = PurePosixPath(file_name.replace("\\", "/")).name.strip()
+    return name if name not in {"", ".", ".."} else "upload"
+
+
+class BlobIndex:
+    # sha256 -> (size, refcount) for the content-addressed blobs, in a SQLite file beside
+    # them so every worker sharing the upload directory sees one index. Adding a
+    # reference and collecting a blob both run under BEGIN IMMEDIATE, so a blob is never
+    # deleted between an upload finding it and referencing it.
+    #
+    # A blob is referenced by every finished upload of its bytes and by every holder (a
+    # conversation) with an attachment naming it, one pin per holder however many of its
+    # attachments do. Deleting the upload therefore leaves attached blobs in place.
+
+    def __init__(self, path: Path) -> None:
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "sha256 TEXT PRIMARY KEY, size INTEGER NOT NULL, refcount INTEGER NOT NULL, unreferenced_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs (unreferenced_at) WHERE refcount = 0")
+        self._db.execute("CREATE TABLE IF NOT EXISTS pins (holder TEXT NOT NULL, sha256 TEXT NOT NULL, PRIMARY KEY (holder, sha256))")
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def add_reference(self, db: sqlite3.Connection, sha256: str, size: int) -> bool:
+        # True when the blob is new and the caller has to put the file in place.
+        updated = db.execute(
+            "UPDATE blobs SET refcount = refcount + 1, unreferenced_at = NULL WHERE sha256 = ?", (sha256,)
+        ).rowcount
+        if updated:
+            return False
+        db.execute("INSERT INTO blobs (sha256, size, refcount) VALUES (?, ?, 1)", (sha256, size))
+        return True
+
+    def release(self, sha256: str, now: float) -> None:
+        with self.transaction() as db:
+            drop_reference(db, sha256, now)
+
+    def pin(self, holder: str, sha256: str) -> bool:
+        # False when the blob is already gone, so there is nothing left to attach.
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM pins WHERE holder = ? AND sha256 = ?", (holder, sha256)).fetchone():
+                return True
+            if not db.execute(
+                "UPDATE blobs SET refcount = refcount + 1, unreferenced_at = NULL WHERE sha256 = ?", (sha256,)
+            ).rowcount:
+                return False
+            db.execute("INSERT INTO pins (holder, sha256) VALUES (?, ?)", (holder, sha256))
+            return True
+
+    def unpin(self, holder: str, now: float) -> int:
+        with self.transaction() as db:
+            pinned = db.execute("DELETE FROM pins WHERE holder = ? RETURNING sha256", (holder,)).fetchall()
+            for (sha256,) in pinned:
+                drop_reference(db, sha256, now)
+        return len(pinned)
+
+    def holders(self) -> list[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT DISTINCT holder FROM pins").fetchall()]
+
+    def unreferenced(self, before: float) -> list[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT sha256 FROM blobs WHERE refcount = 0 AND unreferenced_at <= ?", (before,)).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            blobs, stored, logical, references = self._db.execute(
+                "SELECT count(*), coalesce(sum(size), 0), coalesce(sum(size * refcount), 0), coalesce(sum(refcount), 0) FROM blobs"
+            ).fetchone()
+            pins = self._db.execute("SELECT count(*) FROM pins").fetchone()[0]
+        return {"blobs": blobs, "blob_bytes": stored, "referenced_bytes": logical, "references": references, "pins": pins}
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def drop_reference(db: sqlite3.Connection, sha256: str, now: float) -> None:
+    db.execute(
+        "UPDATE blobs SET refcount = refcount - 1, unreferenced_at = CASE WHEN refcount = 1 THEN ? END "
+        "WHERE sha256 = ? AND refcount > 0",
+        (now, sha256),
+    )
+
+
+class LocalUploads:
+    # Local-mode stand-in for object storage. Presigning writes a record and returns
+    # two tokens: the upload id and expiry, HMAC-signed, so any worker sharing the
+    # directory and secret can check them without a lookup table. The upload token
+    # authorises PUT, HEAD and DELETE; the read token in file_url only downloads, and
+    # one cannot be turned into the other. A PUT streams the body to
+    # <id>.part at the offset it claims, a chunk_bytes buffer at a time, and renames it
+    # into the blob store once content_length bytes have arrived. Clients resume an
+    # interrupted upload by asking HEAD for the offset and sending the rest with
+    # Content-Range.
+    #
+    # Blobs are content addressed: the body is hashed as it streams in, and a finished
+    # upload whose sha256 is already stored only adds a reference, dropping its .part
+    # file instead of keeping a second copy. Releasing an upload drops the reference,
+    # and attaching it to a conversation pins the blob until that conversation is gone;
+    # the collector thread deletes blobs that stayed unreferenced for gc_grace, along
+    # with the leftovers of uploads whose token expired before they finished. Each run
+    # first asks existing_holders which pinning conversations are still stored and
+    # unpins the rest, so a conversation deleted in any backend, even outside this
+    # process, releases its blobs.
+
+    def __init__(self, config: UploadConfig) -> None:
+        self.config = config
+        (config.directory / "blobs").mkdir(parents=True, exist_ok=True)
+        self.secret = config.secret or self._load_secret()
+        self.index = BlobIndex(config.directory / "blobs.sqlite3")
+        self._active: set[UUID] = set()
+        # Hash state of partial uploads received by this process, keyed by upload and
+        # valid at the stored offset; anything else re-reads the .part prefix once.
+        self._hashers: dict[UUID, tuple[int, Any]] = {}
+        self.existing_holders: Callable[[list[UUID]], set[UUID]] | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._counters = {
+            "presigned": 0,
+            "completed": 0,
+            "deduplicated": 0,
+            "released": 0,
+            "bytes_received": 0,
+            "bytes_served": 0,
+            "rejected": 0,
+            "collected_blobs": 0,
+            "collected_pins": 0,
+            "collected_uploads": 0,
+        }
+
+    def _load_secret(self) -> bytes:
+        # Without UPLOAD_SECRET the key lives beside the uploads, so every worker (and
+        # the next restart) signs and checks tokens with the same one.
+        path = self.config.directory / ".secret"
+        try:
+            # Owner-only from the moment it exists: anyone who can read it can sign tokens.
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(secrets.token_bytes(32))
+        return path.read_bytes()
+
+    def presign(self, file_name: str, content_type: str, content_length: int | None) -> tuple[UploadRecord, str]:
+        if content_length is not None and content_length > self.config.max_bytes:
+            raise UploadError(413, "upload_too_large")
+        record = UploadRecord(uuid4(), safe_file_name(file_name), content_type, content_length, time.time() + self.config.token_ttl)
+        self._write_record(record)
+        self._counters["presigned"] += 1
+        return record, self.sign(record.id, int(record.expires_at))
+
+    def sign(self, upload_id: UUID, expires_at: int, scope: str = "upload") -> str:
+        # Read tokens sign the bare payload, as every token did before scopes existed, so
+        # file_urls already stored keep resolving but no longer authorise writes.
+        payload = f"{upload_id.hex}.{expires_at}"
+        message = payload if scope == "read" else f"{scope}.{payload}"
+        digest = hmac.new(self.secret, message.encode(), hashlib.sha256).digest()[:18]
+        return f"{payload}.{base64.urlsafe_b64encode(digest).decode()}"
+
+    def verify(self, token: str, for_upload: bool = True) -> UploadRecord:
+        # Upload tokens expire; the read token keeps naming the finished file, which is
+        # how file_url stays valid after the upload window.
+        record, expires_at = self._load(token, "upload" if for_upload else "read")
+        if for_upload:
+            if record.complete:
+                raise UploadError(409, "upload_complete")
+            if expires_at < time.time():
+                raise UploadError(403, "upload_token_expired")
+        elif not record.complete:
+            raise UploadError(404, "upload_incomplete")
+        return record
+
+    def progress(self, token: str) -> tuple[UploadRecord, int]:
+        record, _expires_at = self._load(token, "upload")
+        return record, self.path(record).stat().st_size if record.complete else self.offset(record)
+
+    def _load(self, token: str, scope: str) -> tuple[UploadRecord, int]:
+        try:
+            upload_hex, expires_text, _signature = token.split(".")
+            upload_id, expires_at = UUID(hex=upload_hex), int(expires_text)
+        except ValueError:
+            raise UploadError(404, "upload_not_found") from None
+        if not hmac.compare_digest(self.sign(upload_id, expires_at, scope), token):
+            raise UploadError(403, "invalid_upload_token")
+        try:
+            record = UploadRecord.from_json(self._record_path(upload_id).read_text())
+        except FileNotFoundError:
+            raise UploadError(404, "upload_not_found") from None
+        return record, expires_at
+
+    def lookup(self, file_url: str) -> UploadRecord | None:
+        # The finished upload a file_url names, or None for any other URL.
+        match = FILE_PATH.match(urlsplit(file_url).path)
+        if match is None:
+            return None
+        try:
+            return self.verify(match.group(1), for_upload=False)
+        except UploadError:
+            return None
+
+    def file_url(self, record: UploadRecord) -> str:
+        token = self.sign(record.id, int(record.expires_at), "read")
+        return f"{self.config.public_url}/api/uploads/local/{token}/{quote(record.file_name)}"
+
+    def upload_url(self, token: str) -> str:
+        return f"{self.config.public_url}/api/uploads/local/{token}"
+
+    def offset(self, record: UploadRecord) -> int:
+        try:
+            return self._part_path(record.id).stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def path(self, record: UploadRecord) -> Path:
+        if record.sha256 is None:
+            return self.config.directory / record.id.hex
+        return self.blob_path(record.sha256)
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.config.directory / "blobs" / sha256[:2] / sha256
+
+    async def receive(
+        self, record: UploadRecord, chunks: AsyncIterator[bytes], content_range: str | None, content_length_header: str | None
+    ) -> int:
+        # Returns the bytes stored so far; the record is complete once that reaches the
+        # declared length. Without Content-Range the body is the whole file from byte 0.
+        content_length = None
+        if content_length_header is not None:
+            try:
+                content_length = int(content_length_header)
+            except ValueError:
+                raise UploadError(400, "invalid_content_length") from None
+            if content_length < 0:
+                raise UploadError(400, "invalid_content_length")
+        total = record.content_length
+        if content_range is None:
+            start = 0
+            if total is not None and content_length is not None and content_length != total:
+                raise UploadError(400, "content_length_mismatch")
+            end = (total if total is not None else self.config.max_bytes) - 1
+        else:
+            match = CONTENT_RANGE.match(content_range.strip())
+            if match is None:
+                raise UploadError(400, "invalid_content_range")
+            start, end, range_total = (int(value) for value in match.groups())
+            if end < start or end >= range_total or (total is not None and range_total != total) or range_total > self.config.max_bytes:
+                raise UploadError(400, "invalid_content_range")
+            if content_length is not None and content_length != end - start + 1:
+                raise UploadError(400, "content_length_mismatch")
+            if total is None:
+                # Presigned without a length: the first range fixes it for every later chunk.
+                record.content_length = range_total
+                await anyio.to_thread.run_sync(self._write_record, record)
+            total = range_total
+        if record.id in self._active:
+            raise UploadError(409, "upload_in_progress")
+        self._active.add(record.id)
+        try:
+            return await self._receive(record, chunks, start, end, total, content_range is not None)
+        finally:
+            self._active.discard(record.id)
+
+    async def _receive(
+        self, record: UploadRecord, chunks: AsyncIterator[bytes], start: int, end: int, total: int | None, ranged: bool
+    ) -> int:
+        part = self._part_path(record.id)
+        handle = await anyio.to_thread.run_sync(open_part, part)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError(409, "upload_in_progress") from None
+            received = os.fstat(handle.fileno()).st_size
+            if ranged and start != received:
+                # Only the next byte can be written; the client re-reads the offset.
+                raise UploadError(416, "upload_offset_mismatch", {"Upload-Offset": str(received)})
+            if not ranged and received:
+                await anyio.to_thread.run_sync(handle.truncate, 0)
+            hasher = await anyio.to_thread.run_sync(self._hasher, record.id, handle, start)
+            position, buffer, limit = start, bytearray(), end + 1
+            try:
+                async for chunk in chunks:
+                    if position + len(buffer) + len(chunk) > limit:
+                        raise UploadError(413, "upload_too_large")
+                    buffer += chunk
+                    if len(buffer) >= self.config.chunk_bytes:
+                        position += await anyio.to_thread.run_sync(write_chunk, handle, hasher, bytes(buffer), position)
+                        buffer.clear()
+                if buffer:
+                    position += await anyio.to_thread.run_sync(write_chunk, handle, hasher, bytes(buffer), position)
+            except UploadError:
+                # An oversized body leaves nothing behind; the client starts that range over.
+                await anyio.to_thread.run_sync(handle.truncate, start)
+                self._counters["rejected"] += 1
+                raise
+            except BaseException:
+                # A body cut off mid-chunk: the file holds what was written, the hash
+                # state may not, so the next PUT re-reads the prefix.
+                self._hashers.pop(record.id, None)
+                raise
+            self._hashers[record.id] = (position, hasher)
+            self._counters["bytes_received"] += position - start
+            if ranged and position != limit:
+                raise UploadError(400, "content_length_mismatch", {"Upload-Offset": str(position)})
+            if total is not None and position < total:
+                if not ranged and record.content_length is not None:
+                    raise UploadError(400, "content_length_mismatch", {"Upload-Offset": str(position)})
+                return position
+            del self._hashers[record.id]
+            await anyio.to_thread.run_sync(self._finish, record, handle, hasher)
+            return position
+        finally:
+            handle.close()
+
+    def _hasher(self, upload_id: UUID, handle: BinaryIO, offset: int) -> Any:
+        cached = self._hashers.pop(upload_id, None)
+        if cached is not None and cached[0] == offset:
+            return cached[1]
+        hasher = hashlib.sha256()
+        position = 0
+        while position < offset:
+            chunk = read_at(handle, min(self.config.chunk_bytes, offset - position), position)
+            if not chunk:
+                break
+            hasher.update(chunk)
+            position += len(chunk)
+        return hasher
+
+    def _finish(self, record: UploadRecord, handle: BinaryIO, hasher: Any) -> None:
+        sha256 = hasher.hexdigest()
+        size = os.fstat(handle.fileno()).st_size
+        part = self._part_path(record.id)
+        with self.index.transaction() as db:
+            if self.index.add_reference(db, sha256, size):
+                os.fsync(handle.fileno())
+                handle.close()
+                blob = self.blob_path(sha256)
+                blob.parent.mkdir(exist_ok=True)
+                os.replace(part, blob)
+            else:
+                # Same bytes are already stored: keep the reference, not the copy.
+                handle.close()
+                part.unlink()
+                self._counters["deduplicated"] += 1
+        record.content_length = size
+        record.sha256 = sha256
+        record.complete = True
+        self._write_record(record)
+        self._counters["completed"] += 1
+
+    def release(self, token: str) -> None:
+        # Deletes the upload; its blob goes once no other upload references it.
+        record, _expires_at = self._load(token, "upload")
+        if record.id in self._active:
+            raise UploadError(409, "upload_in_progress")
+        self._record_path(record.id).unlink(missing_ok=True)
+        self._hashers.pop(record.id, None)
+        if record.sha256 is not None:
+            self.index.release(record.sha256, time.time())
+        elif record.complete:
+            self.path(record).unlink(missing_ok=True)
+        self._part_path(record.id).unlink(missing_ok=True)
+        self._counters["released"] += 1
+
+    def attach(self, record: UploadRecord, holder: UUID) -> bool:
+        # Uploads from before content addressing have no blob to pin and keep their own file.
+        if record.sha256 is None:
+            return True
+        return self.index.pin(holder.hex, record.sha256)
+
+    def detach(self, holder: UUID) -> None:
+        self.index.unpin(holder.hex, time.time())
+
+    def collect(self, now: float | None = None) -> dict[str, int]:
+        # Deletes blobs unreferenced for longer than gc_grace and uploads whose token
+        # expired that long ago without finishing.
+        now = time.time() if now is None else now
+        before = now - self.config.gc_grace
+        blobs = uploads = pins = 0
+        if self.existing_holders is not None:
+            holders = {UUID(holder): holder for holder in self.index.holders()}
+            existing = self.existing_holders(list(holders)) if holders else set()
+            for holder_id, holder in holders.items():
+                if holder_id not in existing:
+                    pins += self.index.unpin(holder, now)
+        for sha256 in self.index.unreferenced(before):
+            with self.index.transaction() as db:
+                deleted = db.execute(
+                    "DELETE FROM blobs WHERE sha256 = ? AND refcount = 0 AND unreferenced_at <= ?", (sha256, before)
+                ).rowcount
+                if deleted:
+                    self.blob_path(sha256).unlink(missing_ok=True)
+                    blobs += 1
+        for entry in os.scandir(self.config.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                record = UploadRecord.from_json(Path(entry.path).read_text())
+            except (OSError, ValueError, KeyError):
+                continue
+            if record.complete or record.expires_at > before or record.id in self._active:
+                continue
+            self._part_path(record.id).unlink(missing_ok=True)
+            Path(entry.path).unlink(missing_ok=True)
+            self._hashers.pop(record.id, None)
+            uploads += 1
+        self._counters["collected_blobs"] += blobs
+        self._counters["collected_pins"] += pins
+        self._counters["collected_uploads"] += uploads
+        return {"blobs": blobs, "uploads": uploads, "pins": pins}
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="upload-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def close(self) -> None:
+        self.stop()
+        self.index.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.config.gc_interval):
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("upload garbage collection failed")
+
+    def served(self, count: int) -> None:
+        self._counters["bytes_served"] += count
+
+    def stats(self) -> dict[str, int]:
+        return {**self._counters, **self.index.stats()}
+
+    def _record_path(self, upload_id: UUID) -> Path:
+        return self.config.directory / f"{upload_id.hex}.json"
+
+    def _part_path(self, upload_id: UUID) -> Path:
+        return self.config.directory / f"{upload_id.hex}.part"
+
+    def _write_record(self, record: UploadRecord) -> None:
+        path = self._record_path(record.id)
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(record.to_json())
+        os.replace(tmp, path)
+
+
+def open_part(path: Path) -> BinaryIO:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+    return os.fdopen(fd, "r+b", buffering=0)
+
+
+def write_chunk(handle: BinaryIO, hasher: Any, data: bytes, position: int) -> int:
+    # On a worker thread: hashlib releases the GIL for large buffers, as does the write.
+    hasher.update(data)
+    handle.seek(position)
+    return handle.write(data)
+
+
+def read_at(handle: BinaryIO, size: int, position: int) -> bytes:
+    handle.seek(position)
+    return handle.read(size)
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    # One byte range, inclusive; None serves the whole file. Multiple ranges are
+    # answered with the whole file, which RFC 9110 allows.
+    if not header or "," in header:
+        return None
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise UploadError(416, "range_not_satisfiable", {"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class RangeFileResponse(Response):
+    # Serves a byte range of a file without reading it into memory. Servers that offer
+    # the ASGI zero-copy extension get the descriptor and send it with sendfile();
+    # others get chunk_bytes read from a worker thread at a time.
+
+    def __init__(
+        self,
+        path: Path,
+        content_type: str,
+        file_name: str,
+        range_header: str | None,
+        chunk_bytes: int = 1 << 20,
+        on_sent: Any = None,
+    ) -> None:
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.on_sent = on_sent
+        self.background = None
+        size = path.stat().st_size
+        selected = parse_range(range_header, size)
+        self.start, self.end = selected if selected is not None else (0, size - 1)
+        self.status_code = 206 if selected is not None else 200
+        headers = {
+            "accept-ranges": "bytes",
+            "content-length": str(self.end - self.start + 1),
+            "content-disposition": f"inline; filename*=utf-8''{quote(file_name)}",
+        }
+        if selected is not None:
+            headers["content-range"] = f"bytes {self.start}-{self.end}/{size}"
+        self.media_type = content_type
+        self.init_headers(headers)
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        count = self.end - self.start + 1
+        with open(self.path, "rb") as handle:
+            if count <= 0:
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopysend", "file": handle.fileno(), "offset": self.start, "count": count})
+            else:
+                position = self.start
+                while position <= self.end:
+                    size = min(self.chunk_bytes, self.end + 1 - position)
+                    chunk = await anyio.to_thread.run_sync(read_at, handle, size, position)
+                    if not chunk:
+                        break
+                    position += len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": position <= self.end})
+                if position <= self.end:
+                    await send({"type": "http.response.body", "body": b""})
+        if self.on_sent is not None:
+            self.on_sent(count)
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+from uuid import UUID
+
+logger = logging.getLogger(__name__)
+
+# Frame header: payload length, crc32 of lsn + payload, lsn.
+FRAME = struct.Struct("<IIQ")
+SEGMENT_PREFIX = "wal-"
+SNAPSHOT_PREFIX = "snapshot-"
+
+
+class WALConfig:
+    def __init__(
+        self,
+        directory: str | Path,
+        fsync: bool = True,
+        commit_interval: float = 0.002,
+        snapshot_every: int = 50_000,
+    ) -> None:
+        if commit_interval < 0 or snapshot_every < 0:
+            raise ValueError("commit_interval and snapshot_every must be non-negative")
+        self.directory = Path(directory)
+        self.fsync = fsync
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+
+    @classmethod
+    def from_env(cls) -> WALConfig | None:
+        directory = os.getenv("WAL_DIR", "")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            fsync=os.getenv("WAL_FSYNC", "true").lower() not in {"0", "false", "no", "off"},
+            commit_interval=float(os.getenv("WAL_COMMIT_INTERVAL_MS", "2")) / 1000,
+            snapshot_every=int(os.getenv("WAL_SNAPSHOT_EVERY", "50000")),
+        )
+
+
+def _segment_name(first_lsn: int) -> str:
+    return f"{SEGMENT_PREFIX}{first_lsn:020d}.log"
+
+
+def _snapshot_name(lsn: int) -> str:
+    return f"{SNAPSHOT_PREFIX}{lsn:020d}.pkl"
+
+
+def _lsn_of(path: Path, prefix: str) -> int:
+    return int(path.name[len(prefix):].split(".", 1)[0])
+
+
+def _fsync_dir(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _settle(future: asyncio.Future[None], error: BaseException | None) -> None:
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+class WriteAheadLog:
+    # Appends are framed into an in-memory buffer under a short lock and a single
+    # flusher thread writes and fsyncs whatever has accumulated, so concurrent
+    # writers share one fsync (group commit). append() returns once its frame is
+    # durable. The log is split into segments; a snapshot at lsn N lets every
+    # segment that ends at or before N be deleted.
+
+    def __init__(self, config: WALConfig) -> None:
+        self.config = config
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._pending = threading.Condition(self._lock)
+        self._buffer: list[bytes] = []
+        self._next_lsn = 1
+        self._durable_lsn = 0
+        self._since_snapshot = 0
+        self._fd: int | None = None
+        # The fd the flusher is writing to outside the lock; it is not closed until then.
+        self._writing: int | None = None
+        self._segment: Path | None = None
+        self._flusher: threading.Thread | None = None
+        self._closing = False
+        self._error: BaseException | None = None
+        # (lsn, future) pairs from wait_durable(), settled by the flusher thread.
+        self._waiters: list[tuple[int, asyncio.Future[None]]] = []
+        self._counters = {"appends": 0, "flushes": 0, "bytes": 0}
+
+    @property
+    def directory(self) -> Path:
+        return self.config.directory
+
+    def segments(self) -> list[Path]:
+        return sorted(self.directory.glob(f"{SEGMENT_PREFIX}*.log"))
+
+    def snapshots(self) -> list[Path]:
+        return sorted(self.directory.glob(f"{SNAPSHOT_PREFIX}*.pkl"))
+
+    def open(self, last_lsn: int | None = None) -> None:
+        # Recovery passes the last lsn it replayed; otherwise the log is scanned for it.
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if last_lsn is None:
+            last_lsn = self.last_lsn_on_disk()
+        segments = self.segments()
+        if segments:
+            last_lsn = max(last_lsn, _lsn_of(segments[-1], SEGMENT_PREFIX) - 1)
+        with self._lock:
+            self._next_lsn = last_lsn + 1
+            self._durable_lsn = last_lsn
+            self._closing = False
+            self._open_segment(self._next_lsn)
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closing = True
+            self._pending.notify_all()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+            self._flusher = None
+        with self._lock:
+            self._close_segment()
+
+    def _close_segment(self) -> None:
+        # Called with the lock held. The flusher writes and fsyncs without the lock, so
+        # the segment it is writing to is only closed once that flush has finished.
+        while self._writing is not None:
+            self._flushed.wait()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open_segment(self, first_lsn: int) -> None:
+        self._close_segment()
+        self._segment = self.directory / _segment_name(first_lsn)
+        self._fd = os.open(self._segment, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        _fsync_dir(self.directory)
+
+    def append(self, op: str, conversation_id: UUID, payload: Any = None, wait: bool = True) -> int:
+        # wait=False returns once the frame is buffered; the caller must then await
+        # wait_durable(lsn) before acknowledging the change.
+        data = pickle.dumps((op, conversation_id, payload), pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError("write-ahead log is unavailable") from self._error
+            if self._fd is None:
+                raise RuntimeError("write-ahead log is not open")
+            lsn = self._next_lsn
+            self._next_lsn += 1
+            lsn_bytes = lsn.to_bytes(8, "little")
+            self._buffer.append(FRAME.pack(len(data), zlib.crc32(data, zlib.crc32(lsn_bytes)), lsn) + data)
+            self._since_snapshot += 1
+            self._counters["appends"] += 1
+            self._pending.notify()
+            while wait and self._durable_lsn < lsn and self._error is None:
+                self._flushed.wait()
+            if self._error is not None:
+                raise RuntimeError("write-ahead log flush failed") from self._error
+        return lsn
+
+    async def wait_durable(self, lsn: int) -> None:
+        # The event-loop counterpart of append()'s blocking wait.
+        with self._lock:
+            if self._error is not None:
+                raise RuntimeError("write-ahead log flush failed") from self._error
+            if self._durable_lsn >= lsn:
+                return
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append((lsn, future))
+        await future
+
+    def _settle_waiters(self) -> None:
+        # Called with the lock held after a flush (or a failure).
+        if not self._waiters:
+            return
+        remaining = []
+        for lsn, future in self._waiters:
+            if self._error is not None:
+                future.get_loop().call_soon_threadsafe(_settle, future, RuntimeError("write-ahead log flush failed"))
+            elif lsn <= self._durable_lsn:
+                future.get_loop().call_soon_threadsafe(_settle, future, None)
+            else:
+                remaining.append((lsn, future))
+        self._waiters = remaining
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._lock:
+                while not self._buffer and not self._closing:
+                    self._pending.wait()
+                if not self._buffer and self._closing:
+                    return
+            if self.config.commit_interval:
+                # Give concurrent writers a moment to join this group.
+                time.sleep(self.config.commit_interval)
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                last_lsn = self._next_lsn - 1
+                fd = self._writing = self._fd
+            try:
+                data = b"".join(batch)
+                os.write(fd, data)
+                if self.config.fsync:
+                    os.fsync(fd)
+            except BaseException as exc:
+                logger.exception("write-ahead log flush failed")
+                with self._lock:
+                    self._writing = None
+                    self._error = exc
+                    self._flushed.notify_all()
+                    self._settle_waiters()
+                return
+            with self._lock:
+                self._writing = None
+                self._durable_lsn = last_lsn
+                self._counters["flushes"] += 1
+                self._counters["bytes"] += len(data)
+                self._flushed.notify_all()
+                self._settle_waiters()
+
+    def needs_snapshot(self) -> bool:
+        every = self.config.snapshot_every
+        return bool(every) and self._since_snapshot >= every
+
+    def rotate(self) -> int:
+        # Everything up to the returned lsn lives in closed segments; new appends go
+        # to a fresh segment so the closed ones can be dropped after a snapshot.
+        with self._lock:
+            last_lsn = self._next_lsn - 1
+            while self._durable_lsn < last_lsn and self._error is None:
+                self._pending.notify()
+                self._flushed.wait()
+            self._open_segment(self._next_lsn)
+            self._since_snapshot = 0
+            return last_lsn
+
+    def write_snapshot(self, lsn: int, records: list[bytes]) -> Path:
+        path = self.directory / _snapshot_name(lsn)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as handle:
+            pickle.dump((lsn, records), handle, pickle.HIGHEST_PROTOCOL)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(tmp, path)
+        _fsync_dir(self.directory)
+        self.prune(lsn)
+        return path
+
+    def prune(self, snapshot_lsn: int) -> None:
+        for snapshot in self.snapshots():
+            if _lsn_of(snapshot, SNAPSHOT_PREFIX) < snapshot_lsn:
+                snapshot.unlink(missing_ok=True)
+        segments = self.segments()
+        for segment, following in zip(segments, segments[1:]):
+            # A segment ends right before the next one starts.
+            if _lsn_of(following, SEGMENT_PREFIX) - 1 <= snapshot_lsn:
+                segment.unlink(missing_ok=True)
+
+    def load_snapshot(self) -> tuple[int, list[bytes]]:
+        snapshots = self.snapshots()
+        if not snapshots:
+            return 0, []
+        with open(snapshots[-1], "rb") as handle:
+            return pickle.load(handle)
+
+    def replay(self, after_lsn: int = 0) -> Iterator[tuple[int, str, UUID, Any]]:
+        segments = self.segments()
+        for index, segment in enumerate(segments):
+            if index + 1 < len(segments) and _lsn_of(segments[index + 1], SEGMENT_PREFIX) - 1 <= after_lsn:
+                continue
+            with open(segment, "rb") as handle:
+                data = handle.read()
+            offset = 0
+            while offset + FRAME.size <= len(data):
+                length, crc, lsn = FRAME.unpack_from(data, offset)
+                start = offset + FRAME.size
+                payload = data[start:start + length]
+                if len(payload) < length or zlib.crc32(payload, zlib.crc32(lsn.to_bytes(8, "little"))) != crc:
+                    break
+                offset = start + length
+                if lsn > after_lsn:
+                    op, conversation_id, body = pickle.loads(payload)
+                    yield lsn, op, conversation_id, body
+            if offset < len(data):
+                # A torn write from a crash: drop the partial frame so new appends follow valid data.
+                logger.warning("truncating %d trailing bytes from %s", len(data) - offset, segment.name)
+                with open(segment, "r+b") as handle:
+                    handle.truncate(offset)
+
+    def last_lsn_on_disk(self) -> int:
+        last = 0
+        for snapshot in self.snapshots()[-1:]:
+            last = _lsn_of(snapshot, SNAPSHOT_PREFIX)
+        for lsn, *_ in self.replay(last):
+            last = lsn
+        segments = self.segments()
+        if segments:
+            last = max(last, _lsn_of(segments[-1], SEGMENT_PREFIX) - 1)
+        return last
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "next_lsn": self._next_lsn,
+                "durable_lsn": self._durable_lsn,
+                "pending": len(self._buffer),
+                "since_snapshot": self._since_snapshot,
+                "segments": len(self.segments()),
+                **self._counters,
+            }
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+import httpx
+
+import main
+from admission import Admission, AdmissionConfig, AdmissionMiddleware, parse_rate_limits
+from benchmarks.load_test import run_level
+from store import ConversationStore
+
+# Per-IP limits for the flood runs: roomy enough for the legitimate client's flows.
+BENCH_LIMITS = "create=150/150,message=2000/2000,end-and-send=150/150,default=2000/2000"
+
+
+def decision_ns(clients: int, decisions: int) -> float:
+    # The per-request work of the limiter alone: classify the path, then take a token.
+    admission = Admission(AdmissionConfig(enabled=True, limits=parse_rate_limits("message=1e9/1e9")), main.ADMISSION_ROUTES)
+    scopes = [
+        {"client": (f"10.{i // 65536}.{i // 256 % 256}.{i % 256}", 1), "headers": [(b"origin", b"https://intake.example")]}
+        for i in range(clients)
+    ]
+    path = f"/api/conversations/{main.uuid4()}/message"
+    limit = admission.config.limits["message"]
+    started = time.perf_counter()
+    for index in range(decisions):
+        scope = scopes[index % clients]
+        route = admission.classify("POST", path)
+        admission.buckets.take(admission.bucket_keys(scope, route.name, limit), time.monotonic())
+    return (time.perf_counter() - started) / decisions * 1e9
+
+
+async def request_rate(enabled: bool, requests: int) -> float:
+    main._STORE = ConversationStore()
+    config = AdmissionConfig(enabled=enabled, limits=parse_rate_limits("default=1e9/1e9"))
+    app = AdmissionMiddleware(main.app, Admission(config, main.ADMISSION_ROUTES))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        url = f"/api/conversations/{(await client.post('/api/conversations', json={})).json()['id']}"
+        started = time.perf_counter()
+        for _ in range(requests):
+            await client.get(url)
+        return requests / (time.perf_counter() - started)
+
+
+async def flood(enabled: bool, concurrency: int, flows: int, attackers: int, flood_rate: float, max_concurrent: int) -> dict[str, Any]:
+    # One legitimate client runs intake flows while `attackers` tasks on another IP post
+    # creates at `flood_rate` per second in total until the flows are done. The offered
+    # rate is fixed, so the client side costs the same whether the server admits or not.
+    main._STORE = ConversationStore()
+    config = AdmissionConfig(enabled=enabled, limits=parse_rate_limits(BENCH_LIMITS), max_concurrent=max_concurrent)
+    admission = Admission(config, main.ADMISSION_ROUTES)
+    app = AdmissionMiddleware(main.app, admission)
+    legit = httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("10.0.0.1", 1)), base_url="http://bench", timeout=120)
+    abuser = httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=("10.6.6.6", 1)), base_url="http://bench", timeout=120)
+    done = asyncio.Event()
+    attempts = 0
+    interval = attackers / flood_rate
+
+    async def attack() -> None:
+        # A broken retry loop: Retry-After is ignored.
+        nonlocal attempts
+        next_at = time.perf_counter()
+        while not done.is_set():
+            attempts += 1
+            await abuser.post("/api/conversations", json={})
+            next_at += interval
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+    async with legit, abuser:
+        tasks = [asyncio.create_task(attack()) for _ in range(attackers)]
+        try:
+            result = await run_level(legit, concurrency, flows, client_share=0.2, seed=concurrency)
+        finally:
+            done.set()
+            await asyncio.gather(*tasks)
+    created = result["endpoints"]["POST /api/conversations"]
+    return {
+        "flows_per_second": result["flows_per_second"],
+        "create_p99_ms": created["p99_ms"],
+        "failed_flows": result["failed_flows"],
+        "flood_attempts": attempts,
+        "stored": main._STORE.stats()["resident"],
+        "rejected": admission.counters["rate_limited"] + admission.counters["queue_full"] + admission.counters["queue_timeout"],
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Admission-control overhead, and intake flows under a create flood with it off and on.")
+    parser.add_argument("--decisions", type=int, default=200_000)
+    parser.add_argument("--requests", type=int, default=2000, help="sequential GETs for the end-to-end overhead")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent legitimate flows")
+    parser.add_argument("--flows", type=int, default=200)
+    parser.add_argument("--attackers", type=int, default=32, help="concurrent flood tasks")
+    parser.add_argument("--flood-rate", type=float, default=600, help="create posts per second offered by the flood")
+    parser.add_argument("--max-concurrent", type=int, default=16)
+    args = parser.parse_args()
+
+    for clients in (1, 10_000):
+        print(f"limiter decision, {clients} clients: {decision_ns(clients, args.decisions):.0f} ns")
+    for enabled in (False, True, False, True):
+        print(f"GET /api/conversations/{{id}}, admission {'on ' if enabled else 'off'}: {asyncio.run(request_rate(enabled, args.requests)):.0f} req/s")
+    print(f"{'admission':>10}{'flows/s':>10}{'create p99':>12}{'failed':>8}{'flood posts':>13}{'rejected':>10}{'stored':>8}")
+    for enabled in (False, True):
+        result = asyncio.run(flood(enabled, args.concurrency, args.flows, args.attackers, args.flood_rate, args.max_concurrent))
+        print(
+            f"{'on' if enabled else 'off':>10}{result['flows_per_second']:>10.1f}{result['create_p99_ms']:>12.1f}"
+            f"{result['failed_flows']:>8}{result['flood_attempts']:>13}{result['rejected']:>10}{result['stored']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
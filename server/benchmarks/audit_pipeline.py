@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import argparse
+import threading
+import time
+from uuid import uuid4
+
+from audit import AuditEvent, AuditPipeline
+from records import ConversationRecord
+from store import ConversationStore
+
+
+def inline_append(store: ConversationStore, conversation: ConversationRecord, index: int) -> None:
+    # What log_audit did per event before the pipeline: lock, build the dict, append.
+    with store.locked(conversation.id) as record:
+        record.add_audit_events([AuditEvent(record.id, "step", {"index": index}).as_dict()])
+
+
+def per_call_us(calls: int, threads: int, call) -> float:
+    def worker(offset: int) -> None:
+        for index in range(calls):
+            call(offset + index)
+
+    workers = [threading.Thread(target=worker, args=(offset * calls,)) for offset in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return (time.perf_counter() - started) / (calls * threads) * 1e6
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Request-path cost of an audit write, inline versus buffered.")
+    parser.add_argument("--calls", type=int, default=50_000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--sink-ms", type=float, default=2.0, help="simulated latency of one batched database write")
+    args = parser.parse_args()
+
+    print(f"{'threads':>8}{'inline us/event':>17}{'buffered us/event':>19}{'batches':>9}{'dropped':>9}")
+    for threads in args.threads:
+        store = ConversationStore()
+        conversation = ConversationRecord(uuid4(), {})
+        store.insert(conversation)
+        inline = per_call_us(args.calls, threads, lambda index: inline_append(store, conversation, index))
+
+        pipeline = AuditPipeline(lambda _batch: time.sleep(args.sink_ms / 1000), capacity=args.calls * threads)
+        buffered = per_call_us(args.calls, threads, lambda index: pipeline.submit(AuditEvent(conversation.id, "step", {"index": index})))
+        pipeline.stop(timeout=60)
+        stats = pipeline.stats()
+        assert stats["written"] + stats["dropped"] == args.calls * threads
+        print(f"{threads:>8}{inline:>17.2f}{buffered:>19.2f}{stats['batches']:>9}{stats['dropped']:>9}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from uuid import UUID, uuid4
+
+import psycopg
+from psycopg.rows import dict_row
+
+import main
+from bulk import write_rows
+from pg_store import ATTACHMENT_COLUMNS, attachment_row
+
+
+def make_attachments(count: int) -> list[dict[str, object]]:
+    return [
+        main.Attachment(file_url=f"https://files.local/uploads/{uuid4()}/scan-{index}.pdf", size_bytes=48_000 + index).model_dump()
+        for index in range(count)
+    ]
+
+
+def per_row(cursor, conversation_id: UUID, attachments: list[dict[str, object]]) -> None:
+    # The statement-per-attachment shape attachments were written with before bulk writes.
+    now = main.utc_now()
+    placeholders = ", ".join(["%s"] * len(ATTACHMENT_COLUMNS))
+    for attachment in attachments:
+        cursor.execute(
+            f"INSERT INTO attachments ({', '.join(ATTACHMENT_COLUMNS)}) VALUES ({placeholders})",
+            attachment_row(conversation_id, None, attachment, now),
+        )
+
+
+def bulk(method: str):
+    def write(cursor, conversation_id: UUID, attachments: list[dict[str, object]]) -> None:
+        now = main.utc_now()
+        rows = [attachment_row(conversation_id, None, attachment, now) for attachment in attachments]
+        write_rows(cursor, "attachments", ATTACHMENT_COLUMNS, rows, method=method)
+
+    return write
+
+
+def measure(conn, conversation_id: UUID, write, count: int, requests: int) -> float:
+    # One transaction per simulated end-and-send request.
+    payloads = [make_attachments(count) for _ in range(requests)]
+    started = time.perf_counter()
+    for attachments in payloads:
+        with conn.cursor() as cursor:
+            write(cursor, conversation_id, attachments)
+        conn.commit()
+    return (time.perf_counter() - started) / requests * 1000
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Attachment persistence: a statement per row versus multi-row VALUES and COPY.")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("set DATABASE_URL or pass --dsn (migrations from db/migrations must be applied)")
+
+    strategies = [("per-row", per_row), ("values", bulk("values")), ("copy", bulk("copy"))]
+    with psycopg.connect(args.dsn, row_factory=dict_row) as conn:
+        conversation_id = uuid4()
+        with conn.cursor() as cursor:
+            cursor.execute("INSERT INTO conversations (id, channel, mode) VALUES (%s, 'web', 'prospect')", (conversation_id,))
+        conn.commit()
+        try:
+            print(f"{'attachments':>12}" + "".join(f"{label + ' ms/req':>16}" for label, _ in strategies))
+            for count in args.counts:
+                timings = [measure(conn, conversation_id, write, count, args.requests) for _, write in strategies]
+                print(f"{count:>12}" + "".join(f"{timing:>16.3f}" for timing in timings))
+        finally:
+            with conn.cursor() as cursor:
+                cursor.execute("DELETE FROM conversations WHERE id = %s", (conversation_id,))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from typing import Any, Iterator
+from uuid import UUID
+
+import anyio
+import anyio.to_thread
+from fastapi import HTTPException
+
+import main
+from store import ConversationStore
+
+
+@contextmanager
+def strategy(name: str, think_seconds: float) -> Iterator[Callable[[UUID, Any], bool]]:
+    # "unsafe" is the old read-release-write handler; "locked" holds the conversation
+    # for the whole handler; "cas" is the version-checked commit with retries.
+    original_apply, original_commit = main.apply_step, main.commit_step
+
+    def apply_step(*args: Any) -> Any:
+        # Stands in for work that releases the GIL between the read and the commit.
+        time.sleep(think_seconds)
+        return original_apply(*args)
+
+    def commit_ignoring_version(conversation_id: UUID, _expected_version: int, *args: Any) -> bool:
+        return original_commit(conversation_id, None, *args)
+
+    main.apply_step = apply_step
+    if name == "unsafe":
+        main.commit_step = commit_ignoring_version
+
+    def post(conversation_id: UUID, payload: Any) -> bool:
+        try:
+            if name == "locked":
+                with main._STORE.locked(conversation_id):
+                    main.create_conversation_message(conversation_id, payload)
+            else:
+                main.create_conversation_message(conversation_id, payload)
+        except HTTPException as exc:
+            if exc.status_code != 409:
+                raise
+            return False
+        return True
+
+    try:
+        yield post
+    finally:
+        main.apply_step, main.commit_step = original_apply, original_commit
+
+
+async def run(name: str, conversations: int, writers: int, posts: int, think_seconds: float) -> dict[str, float]:
+    main._STORE = ConversationStore()
+    ids = [main.create_conversation(main.CreateConversationRequest())["id"] for _ in range(conversations)]
+    retried = main.CAS_CONFLICTS.labels("retried").value
+    limiter = anyio.CapacityLimiter(writers)
+    accepted = 0
+
+    async def send(conversation_id: UUID, payload: Any) -> None:
+        nonlocal accepted
+        applied = await anyio.to_thread.run_sync(post, conversation_id, payload, limiter=limiter)
+        accepted += applied
+
+    with strategy(name, think_seconds) as post:
+        started = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for index in range(posts):
+                payload = main.CreateMessageRequest(fields={f"note_{index}": "x"}, advance=False)
+                tg.start_soon(send, ids[index % conversations], payload)
+        elapsed = time.perf_counter() - started
+    kept = sum(len([key for key in main.load_conversation(cid)["normalized_fields"] if key.startswith("note_")]) for cid in ids)
+    # A rejected post was answered 409 and never applied; a lost one was acknowledged and then overwritten.
+    return {
+        "posts_per_second": accepted / elapsed,
+        "lost": accepted - kept,
+        "rejected": posts - accepted,
+        "retries": main.CAS_CONFLICTS.labels("retried").value - retried,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent message posts: lost updates and throughput per write strategy.")
+    parser.add_argument("--conversations", type=int, nargs="+", default=[1, 4, 64], help="conversations the posts are spread over")
+    parser.add_argument("--writers", type=int, default=8, help="worker threads posting concurrently")
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--think-ms", type=float, default=1.0, help="GIL-releasing work between read and commit")
+    parser.add_argument("--repeat", type=int, default=3, help="interleaved rounds per strategy; the median round is reported")
+    args = parser.parse_args()
+
+    strategies = ("unsafe", "locked", "cas")
+    print(f"{'conversations':>14}{'strategy':>10}{'posts/s':>10}{'lost':>8}{'rejected':>10}{'retries':>9}")
+    for conversations in args.conversations:
+        rounds: dict[str, list[dict[str, float]]] = {name: [] for name in strategies}
+        for _ in range(args.repeat):
+            for name in strategies:
+                rounds[name].append(anyio.run(run, name, conversations, args.writers, args.posts, args.think_ms / 1000))
+        for name in strategies:
+            result = sorted(rounds[name], key=lambda round_: round_["posts_per_second"])[len(rounds[name]) // 2]
+            print(
+                f"{conversations:>14}{name:>10}{result['posts_per_second']:>10.0f}{result['lost']:>8.0f}"
+                f"{result['rejected']:>10.0f}{result['retries']:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+import main
+from records import ConversationRecord
+from store import ConversationStore
+
+# One prospect walking WELCOME -> SUMMARY: (state the step was sent from, submitted fields).
+INTAKE_STEPS = [
+    ("WELCOME", {}),
+    ("MODE_SELECT", {"mode": "prospect"}),
+    ("IDENTITY", {"full_name": "Ada Lovelace", "email": "ada@example.com"}),
+    ("BUSINESS_CONTEXT", {"business_name": "Analytical Engines"}),
+    ("NEEDS", {"needs_summary": "Automate intake", "skip_scheduling": "true"}),
+]
+
+
+def transcript(index: int) -> tuple[dict[str, str], list[tuple[str, str]]]:
+    fields = {"mode": "prospect"}
+    messages = [("assistant", main.prompt_for_state("WELCOME", fields))]
+    for state, submitted in INTAKE_STEPS:
+        fields = {**fields, **{key: f"{value} {index}" if key != "mode" else value for key, value in submitted.items()}}
+        response = main.summarize_step_response(state, fields)
+        if response:
+            messages.append(("user", response))
+        messages.append(("assistant", main.prompt_for_state(main.next_state(state, fields), fields)))
+    return fields, messages
+
+
+def legacy_conversation(conversation_id: UUID, fields: dict[str, str], messages: list[tuple[str, str]]) -> dict[str, Any]:
+    # The dict-per-conversation / dict-per-message shape the store held before records.
+    now = main.utc_now()
+    return {
+        "id": conversation_id,
+        "status": "active",
+        "state": "SUMMARY",
+        "participant_name": fields.get("full_name"),
+        "participant_email": fields.get("email"),
+        "normalized_fields": fields,
+        "messages": [
+            {
+                "id": uuid4(),
+                "conversation_id": conversation_id,
+                "seq": seq,
+                "role": role,
+                "content": content,
+                "attachments": [],
+                "created_at": main.utc_now(),
+            }
+            for seq, (role, content) in enumerate(messages, start=1)
+        ],
+        "attachments": [],
+        "intake_brief": None,
+        "audit_log": [],
+        "slack_post_id": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def record_conversation(conversation_id: UUID, fields: dict[str, str], messages: list[tuple[str, str]]) -> ConversationRecord:
+    conversation = ConversationRecord(
+        conversation_id,
+        fields,
+        state="SUMMARY",
+        participant_name=fields.get("full_name"),
+        participant_email=fields.get("email"),
+        created_at=main.utc_now(),
+    )
+    conversation.messages = [
+        main.new_message(conversation_id, role, content, seq=seq) for seq, (role, content) in enumerate(messages, start=1)
+    ]
+    return conversation
+
+
+def measure(build: Callable[[UUID, dict[str, str], list[tuple[str, str]]], Any], count: int) -> float:
+    # Transcript text is built up front so only the stored representation is counted.
+    inputs = [(uuid4(), *transcript(index)) for index in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [build(conversation_id, dict(fields), messages) for conversation_id, fields, messages in inputs]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del held
+    return used / count
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Bytes held per in-memory conversation, dicts versus slotted records.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[10_000, 100_000])
+    args = parser.parse_args()
+
+    messages = len(transcript(0)[1])
+    print(f"messages per conversation: {messages}")
+    print(f"{'conversations':>14}{'dict B/conv':>14}{'record B/conv':>16}{'saved':>8}")
+    for count in args.counts:
+        legacy = measure(legacy_conversation, count)
+        compact = measure(record_conversation, count)
+        print(f"{count:>14}{legacy:>14.0f}{compact:>16.0f}{1 - compact / legacy:>8.0%}")
+
+    # Sanity check that the compact form still serves the API shape.
+    store = ConversationStore()
+    conversation = record_conversation(uuid4(), *transcript(0))
+    store.insert(conversation)
+    assert len(main.to_conversation_model(store.snapshot(conversation.id))["messages"]) == messages
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import argparse
+import time
+from collections.abc import Callable
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import main
+from benchmarks.conversation_memory import transcript
+from response_cache import ResponseCache
+from store import ConversationStore
+
+
+def legacy_read(conversation_id: UUID) -> bytes:
+    # What GET /api/conversations/{id} did before the cache: snapshot under the lock,
+    # rebuild the model, jsonable_encoder walk, then JSONResponse's json.dumps.
+    row = main.load_conversation(conversation_id)
+    return JSONResponse(jsonable_encoder(main.to_conversation_model(row))).body
+
+
+def per_second(call: Callable[[], object], seconds: float) -> float:
+    done, started = 0, time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            call()
+        done += 100
+    return done / (time.perf_counter() - started)
+
+
+def seed() -> UUID:
+    main._STORE = ConversationStore()
+    _fields, messages = transcript(0)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    conversation_id = UUID(created["id"])
+    main._STORE.append_messages(conversation_id, [main.new_message(conversation_id, role, text) for role, text in messages])
+    return conversation_id
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Repeated conversation reads: legacy encode, fast encode, cached bytes and 304.")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    conversation_id = seed()
+    uncached = ResponseCache(max_entries=0)
+    cached = ResponseCache()
+    main._RESPONSES = cached
+    etag = main.get_conversation(conversation_id, None).headers["etag"]
+
+    def fast_uncached() -> object:
+        main._RESPONSES = uncached
+        return main.get_conversation(conversation_id, None)
+
+    def fast_cached() -> object:
+        main._RESPONSES = cached
+        return main.get_conversation(conversation_id, None)
+
+    def not_modified() -> object:
+        main._RESPONSES = cached
+        return main.get_conversation(conversation_id, etag)
+
+    print(f"messages per conversation: {len(main._STORE.snapshot(conversation_id)['messages'])}")
+    print(f"{'handler path':>24}{'reads/s':>12}")
+    for label, call in [
+        ("legacy jsonable_encoder", lambda: legacy_read(conversation_id)),
+        ("fast encode, no cache", fast_uncached),
+        ("cached bytes", fast_cached),
+        ("If-None-Match 304", not_modified),
+    ]:
+        print(f"{label:>24}{per_second(call, args.seconds):>12.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
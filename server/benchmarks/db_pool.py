@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import psycopg
+from psycopg.rows import dict_row
+
+import main
+from db import ConnectionPool, PoolConfig
+from pg_store import PostgresStore
+from records import ConversationRecord
+
+
+def make_conversation() -> ConversationRecord:
+    conversation_id = uuid4()
+    fields = {"mode": "prospect"}
+    return ConversationRecord(
+        conversation_id,
+        fields,
+        messages=[main.new_message(conversation_id, "assistant", main.prompt_for_state("WELCOME", fields))],
+        created_at=main.utc_now(),
+    )
+
+
+def intake_round_trip(store: PostgresStore) -> None:
+    conversation = make_conversation()
+    store.insert(conversation)
+    row = store.snapshot(conversation.id)
+    store.update(conversation.id, row["version"], row["normalized_fields"], messages=[main.new_message(conversation.id, "user", "hello")])
+
+
+class Unpooled:
+    # Connect-per-request baseline: what the store would do without a pool.
+
+    def __init__(self, dsn: str) -> None:
+        self._dsn = dsn
+
+    def connection(self) -> UnpooledConnection:
+        return UnpooledConnection(self._dsn)
+
+
+class UnpooledConnection:
+
+    def __init__(self, dsn: str) -> None:
+        self._dsn = dsn
+        self._conn = None
+
+    def __enter__(self) -> UnpooledConnection:
+        self._conn = psycopg.connect(self._dsn, row_factory=dict_row)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+        self._conn.close()
+        return False
+
+    def cursor(self):
+        return self._conn.cursor()
+
+
+def measure(label: str, store: PostgresStore, threads: int, iterations: int) -> None:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: intake_round_trip(store), range(iterations)))
+    elapsed = time.perf_counter() - started
+    print(f"{label:>10} threads={threads:<4} {iterations / elapsed:>9.0f} intakes/s")
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Compare pooled and connect-per-request Postgres throughput.")
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--pool-max", type=int, default=16)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("set DATABASE_URL or pass --dsn (migrations from db/migrations must be applied)")
+
+    pool = ConnectionPool(PoolConfig(dsn=args.dsn, min_size=4, max_size=args.pool_max))
+    pool.open()
+    try:
+        for threads in args.threads:
+            measure("unpooled", PostgresStore(Unpooled(args.dsn)), threads, args.iterations)
+            measure("pooled", PostgresStore(pool), threads, args.iterations)
+    finally:
+        print(pool.stats())
+        pool.close()
+
+
+if __name__ == "__main__":
+    main_cli()
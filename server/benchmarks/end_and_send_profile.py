@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import argparse
+import cProfile
+import pstats
+import time
+from uuid import UUID
+
+import main
+from benchmarks.conversation_memory import transcript
+from records import ConversationRecord
+from store import ConversationStore
+
+# Functions whose call counts show the normalized_fields encode/decode work.
+WATCHED = ("dumps", "loads", "clean_text", "parse_normalized_fields", "to_conversation_model")
+
+
+def seed(count: int) -> list[UUID]:
+    main._STORE = ConversationStore()
+    ids = []
+    for index in range(count):
+        fields, messages = transcript(index)
+        conversation = ConversationRecord(main.uuid4(), fields, state="SUMMARY", created_at=main.utc_now())
+        conversation.messages = [main.new_message(conversation.id, role, text, seq=seq) for seq, (role, text) in enumerate(messages, start=1)]
+        main._STORE.insert(conversation)
+        ids.append(conversation.id)
+    return ids
+
+
+def run(ids: list[UUID]) -> None:
+    payload = main.EndAndSendRequest(notes="Please call after 3pm")
+    for conversation_id in ids:
+        main.end_and_send(conversation_id, payload=payload)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Profile end_and_send in local mode.")
+    parser.add_argument("--conversations", type=int, default=2_000)
+    parser.add_argument("--top", type=int, default=12)
+    args = parser.parse_args()
+
+    ids = seed(args.conversations)
+    started = time.perf_counter()
+    run(ids)
+    elapsed = time.perf_counter() - started
+    print(f"end_and_send: {elapsed / len(ids) * 1e6:.1f} us/call over {len(ids)} conversations (unprofiled)")
+
+    ids = seed(args.conversations)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    run(ids)
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+    print(f"{'function':>28}{'calls/request':>15}{'cum us/request':>16}")
+    for (filename, _line, name), (_cc, calls, _tt, cumulative, _callers) in sorted(stats.stats.items(), key=lambda item: item[0][2]):
+        if name in WATCHED and ("json" in filename or "main.py" in filename or "pg_store" in filename or "state_machine" in filename):
+            print(f"{name:>28}{calls / len(ids):>15.1f}{cumulative / len(ids) * 1e6:>16.1f}")
+    print()
+    stats.sort_stats("cumulative").print_stats(args.top)
+    main.AUDIT_PIPELINE.stop()
+
+
+if __name__ == "__main__":
+    main_cli()
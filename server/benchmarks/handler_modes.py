@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+import main
+from benchmarks import APP_PATH
+from benchmarks.load_test import run_level
+from store import ConversationStore
+from wal import WALConfig, WriteAheadLog
+
+
+def fresh_store(wal_dir: Path | None, fsync: bool) -> ConversationStore:
+    if wal_dir is None:
+        return ConversationStore()
+    store = ConversationStore(wal=WriteAheadLog(WALConfig(wal_dir, fsync=fsync)))
+    store.recover()
+    return store
+
+
+async def measure(mode: str, concurrency: int, flows: int, wal_root: Path | None, fsync: bool) -> dict:
+    main.HANDLER_MODE = mode
+    main._STORE = fresh_store(wal_root / f"{mode}-{concurrency}" if wal_root else None, fsync)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=120) as client:
+            return await run_level(client, concurrency, flows, client_share=0.2, seed=concurrency)
+    finally:
+        if main._STORE.wal is not None:
+            main._STORE.wal.close()
+
+
+async def measure_uvicorn(mode: str, concurrency: int, flows: int, wal_dir: Path | None, fsync: bool, port: int) -> dict:
+    # A real server process per mode, so queueing inside its event loop shows up in the
+    # client-side latencies.
+    env = {**os.environ, "HANDLER_MODE": mode, "WAL_DIR": str(wal_dir or ""), "WAL_FSYNC": str(fsync).lower()}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--backlog", "4096"],
+        cwd=APP_PATH,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=None), timeout=120) as client:
+            while True:
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.1)
+            return await run_level(client, concurrency, flows, client_share=0.2, seed=concurrency)
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Thread-pool versus async handlers at increasing numbers of concurrent conversations.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--rounds", type=int, default=2, help="intake flows per concurrent conversation")
+    parser.add_argument("--wal", action="store_true", help="journal to a write-ahead log in a temporary directory")
+    parser.add_argument("--no-fsync", action="store_true", help="with --wal, skip fsync (group commit still applies)")
+    parser.add_argument("--uvicorn", action="store_true", help="serve each mode from a uvicorn subprocess instead of in-process ASGI")
+    parser.add_argument("--port", type=int, default=8971)
+    args = parser.parse_args()
+
+    target = "uvicorn" if args.uvicorn else "in-process ASGI"
+    print(f"{target}, store: {'memory + WAL' + (' (no fsync)' if args.no_fsync else '') if args.wal else 'memory'}")
+    print(f"{'conversations':>14}{'mode':>8}{'flows/s':>10}{'msg p50':>10}{'msg p99':>10}{'e&s p99':>10}{'failed':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        wal_root = Path(tmp) if args.wal else None
+        for concurrency in args.concurrency:
+            for mode in ("thread", "async"):
+                flows, fsync = concurrency * args.rounds, not args.no_fsync
+                if args.uvicorn:
+                    wal_dir = wal_root / f"{mode}-{concurrency}" if wal_root else None
+                    result = asyncio.run(measure_uvicorn(mode, concurrency, flows, wal_dir, fsync, args.port))
+                else:
+                    result = asyncio.run(measure(mode, concurrency, flows, wal_root, fsync))
+                message = result["endpoints"]["POST /api/conversations/{id}/message"]
+                send = result["endpoints"]["POST /api/conversations/{id}/end-and-send"]
+                print(
+                    f"{concurrency:>14}{mode:>8}{result['flows_per_second']:>10.1f}{message['p50_ms']:>10.1f}"
+                    f"{message['p99_ms']:>10.1f}{send['p99_ms']:>10.1f}{result['failed_flows']:>8}"
+                )
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from benchmarks.standins import SlackStandIn, StripeStandIn, install
+
+# Scripted intake flows: the fields posted at each state, in order, starting from WELCOME.
+PROSPECT_STEPS: list[dict[str, Any]] = [
+    {},
+    {"mode": "prospect"},
+    {"full_name": "Ada Lovelace", "email": "ada@example.com", "phone": "555-0100"},
+    {"business_name": "Analytical Engines", "industry": "Manufacturing"},
+    {"needs_summary": "Automate intake triage and quoting"},
+    {"scheduling_option": "link"},
+]
+CLIENT_STEPS: list[dict[str, Any]] = [{}, {"mode": "client"}]
+END_AND_SEND = {
+    "notes": "Sent from the load test",
+    "attachments": [{"file_url": "https://files.local/uploads/load/brief.pdf", "size_bytes": 48_000}],
+}
+PERCENTILES = (50, 95, 99)
+
+
+class Recorder:
+    __slots__ = ("latencies", "errors")
+
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+
+class FlowError(Exception):
+    pass
+
+
+async def call(client: httpx.AsyncClient, recorder: Recorder, endpoint: str, method: str, path: str, body: Any = None) -> dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, path, json=body)
+    except httpx.HTTPError as exc:
+        recorder.errors[endpoint] += 1
+        raise FlowError(f"{endpoint}: {exc!r}") from exc
+    recorder.latencies[endpoint].append(time.perf_counter() - started)
+    if response.status_code >= 400:
+        recorder.errors[endpoint] += 1
+        raise FlowError(f"{endpoint}: HTTP {response.status_code} {response.text[:200]}")
+    return response.json()
+
+
+async def run_flow(client: httpx.AsyncClient, recorder: Recorder, mode: str) -> None:
+    created = await call(client, recorder, "POST /api/conversations", "POST", "/api/conversations", {"mode": mode})
+    base = f"/api/conversations/{created['id']}"
+    for fields in PROSPECT_STEPS if mode == "prospect" else CLIENT_STEPS:
+        await call(client, recorder, "POST /api/conversations/{id}/message", "POST", f"{base}/message", {"fields": fields})
+    await call(client, recorder, "GET /api/conversations/{id}", "GET", base)
+    await call(client, recorder, "POST /api/conversations/{id}/end-and-send", "POST", f"{base}/end-and-send", END_AND_SEND)
+
+
+async def run_level(client: httpx.AsyncClient, concurrency: int, flows: int, client_share: float, seed: int) -> dict[str, Any]:
+    rng = random.Random(seed)
+    modes = ["client" if rng.random() < client_share else "prospect" for _ in range(flows)]
+    recorder = Recorder()
+    pending = iter(modes)
+    failures: list[str] = []
+
+    async def user() -> None:
+        for mode in pending:
+            try:
+                await run_flow(client, recorder, mode)
+            except FlowError as exc:
+                failures.append(str(exc))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = summarize(recorder, elapsed)
+    result.update({"concurrency": concurrency, "flows": flows, "failed_flows": len(failures)})
+    result["flows_per_second"] = round((flows - len(failures)) / elapsed, 2)
+    if failures:
+        result["first_failure"] = failures[0]
+    return result
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    # Nearest-rank on an already sorted sample.
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict[str, Any]:
+    endpoints: dict[str, Any] = {}
+    for endpoint in sorted(set(recorder.latencies) | set(recorder.errors)):
+        ordered = sorted(recorder.latencies[endpoint])
+        endpoints[endpoint] = {
+            "count": len(ordered),
+            "errors": recorder.errors[endpoint],
+            "requests_per_second": round(len(ordered) / elapsed, 2),
+            **{f"p{q}_ms": round(percentile(ordered, q) * 1000, 3) for q in PERCENTILES},
+        }
+    total = sum(entry["count"] for entry in endpoints.values())
+    return {"elapsed_seconds": round(elapsed, 3), "requests_per_second": round(total / elapsed, 2), "endpoints": endpoints}
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    # A regression is throughput falling, or an endpoint's p95/p99 rising, by more than
+    # `threshold` (a fraction) at a concurrency level present in both runs.
+    regressions = []
+    for level, base in baseline.get("levels", {}).items():
+        now = current.get("levels", {}).get(level)
+        if now is None:
+            continue
+        if now["flows_per_second"] < base["flows_per_second"] * (1 - threshold):
+            regressions.append(f"c={level} flows/s {base['flows_per_second']} -> {now['flows_per_second']}")
+        for endpoint, base_stats in base["endpoints"].items():
+            now_stats = now["endpoints"].get(endpoint)
+            if now_stats is None:
+                continue
+            for key in ("p95_ms", "p99_ms"):
+                if now_stats[key] > base_stats[key] * (1 + threshold):
+                    regressions.append(f"c={level} {endpoint} {key} {base_stats[key]} -> {now_stats[key]}")
+        if now["failed_flows"] > base.get("failed_flows", 0):
+            regressions.append(f"c={level} failed flows {base.get('failed_flows', 0)} -> {now['failed_flows']}")
+    return regressions
+
+
+def format_level(result: dict[str, Any]) -> str:
+    lines = [
+        f"concurrency {result['concurrency']}: {result['flows_per_second']} flows/s, "
+        f"{result['requests_per_second']} req/s, {result['failed_flows']} failed flows"
+    ]
+    lines.append(f"  {'endpoint':<44}{'count':>7}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for endpoint, stats in result["endpoints"].items():
+        lines.append(
+            f"  {endpoint:<44}{stats['count']:>7}{stats['requests_per_second']:>10.1f}"
+            f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['errors']:>8}"
+        )
+    if "first_failure" in result:
+        lines.append(f"  first failure: {result['first_failure']}")
+    return "\n".join(lines)
+
+
+async def run(args: argparse.Namespace) -> dict[str, Any]:
+    async with AsyncExitStack() as stack:
+        slack = None
+        if args.slack_latency_ms is not None or args.serve_slack is not None:
+            slack = SlackStandIn((args.slack_latency_ms or 0) / 1000, port=args.serve_slack or 0).start()
+            stack.callback(slack.stop)
+            print(f"slack stand-in listening on {slack.url}")
+
+        if args.url:
+            # The server must already be running; start it with SLACK_WEBHOOK_URL set to the
+            # stand-in URL printed above (--serve-slack pins the port).
+            limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+            client = await stack.enter_async_context(httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout))
+        else:
+            import main
+
+            stripe = StripeStandIn((args.stripe_latency_ms or 0) / 1000)
+            stack.callback(install(main, slack, stripe))
+            await stack.enter_async_context(main.app.router.lifespan_context(main.app))
+            transport = httpx.ASGITransport(app=main.app)
+            client = await stack.enter_async_context(httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=args.timeout))
+
+        if args.warmup:
+            await run_level(client, min(args.warmup, max(args.concurrency)), args.warmup, args.client_share, args.seed)
+        levels = {}
+        for concurrency in args.concurrency:
+            result = await run_level(client, concurrency, args.flows, args.client_share, args.seed)
+            print(format_level(result))
+            levels[str(concurrency)] = result
+    return {
+        "target": args.url or "asgi",
+        "flows_per_level": args.flows,
+        "client_share": args.client_share,
+        "slack_latency_ms": args.slack_latency_ms,
+        "stripe_latency_ms": args.stripe_latency_ms,
+        "levels": levels,
+    }
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Scripted prospect/client intake flows at fixed concurrency, with per-endpoint latency percentiles.")
+    parser.add_argument("--url", help="base URL of a running server (default: in-process ASGI transport)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--flows", type=int, default=200, help="complete intake flows per concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="flows run and discarded before measuring")
+    parser.add_argument("--client-share", type=float, default=0.2, help="fraction of flows that take the existing-client branch")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--slack-latency-ms", type=float, help="answer Slack webhooks from a local stand-in after this delay")
+    parser.add_argument("--serve-slack", type=int, metavar="PORT", help="port for the Slack stand-in (use with --url)")
+    parser.add_argument("--stripe-latency-ms", type=float, help="delay for the in-process Stripe stand-in")
+    parser.add_argument("--save-baseline", type=Path, help="write the results as a baseline JSON file")
+    parser.add_argument("--baseline", type=Path, help="compare against this baseline and exit non-zero on regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        print(f"baseline written to {args.save_baseline}")
+    if args.baseline:
+        regressions = compare(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.threshold)
+        if regressions:
+            print(f"regressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print(f"no regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from types import ModuleType, SimpleNamespace
+from typing import Any
+
+
+class SlackStandIn:
+    # A local incoming-webhook endpoint: every POST is read, held for `latency`
+    # seconds and answered 200, so the outbox sees realistic round trips without
+    # leaving the machine.
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.latency = latency
+        self.received = 0
+        self._lock = Lock()
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if standin.latency:
+                    time.sleep(standin.latency)
+                with standin._lock:
+                    standin.received += 1
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *_args: Any) -> None:
+                return None
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread: Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/services/standin"
+
+    def start(self) -> SlackStandIn:
+        self._thread = Thread(target=self._server.serve_forever, name="slack-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+class StripeStandIn:
+    # Replaces the Stripe seams in main (draft invoice creation and the client used by
+    # send_invoice) with calls that only sleep for `latency` seconds.
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = 0
+        self._lock = Lock()
+        self.Invoice = SimpleNamespace(send_invoice=self.send_invoice)
+
+    def _call(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+
+    def create_draft_invoice(self, estimate_row: dict[str, Any]) -> dict[str, str]:
+        self._call()
+        return {
+            "provider": "stripe",
+            "provider_invoice_id": f"standin-invoice-{estimate_row['id']}",
+            "provider_invoice_url": "https://payments.local/standin",
+        }
+
+    def send_invoice(self, provider_invoice_id: str) -> dict[str, str]:
+        self._call()
+        return {"id": provider_invoice_id, "status": "open"}
+
+
+def install(main: ModuleType, slack: SlackStandIn | None, stripe: StripeStandIn | None) -> Callable[[], None]:
+    # Points an in-process app at the stand-ins and returns a callable that undoes it.
+    saved = (main.SLACK_WEBHOOK_URL, main.SLACK_OUTBOX.webhook_url, main.create_stripe_draft_invoice, main.get_stripe_client)
+    if slack is not None:
+        main.SLACK_WEBHOOK_URL = main.SLACK_OUTBOX.webhook_url = slack.url
+    if stripe is not None:
+        main.create_stripe_draft_invoice = stripe.create_draft_invoice
+        main.get_stripe_client = lambda: stripe
+
+    def restore() -> None:
+        main.SLACK_OUTBOX.stop()
+        main.SLACK_WEBHOOK_URL, main.SLACK_OUTBOX.webhook_url, main.create_stripe_draft_invoice, main.get_stripe_client = saved
+
+    return restore
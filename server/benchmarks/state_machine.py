@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import argparse
+import timeit
+
+from fastapi import HTTPException
+
+import main
+
+# The hand-written if-chains the spec replaced measured about 30 ns per next_state call
+# faster on the reference host (1 vCPU, CPython 3.11): the price of one method call and
+# a dict lookup. It is kept as a note, not as a second engine; two copies of the flow
+# drifted apart once already.
+
+PATHS = [
+    ("WELCOME", {}),
+    ("MODE_SELECT", {"mode": "prospect"}),
+    ("MODE_SELECT", {"mode": "client"}),
+    ("IDENTITY", {"full_name": "Ada Lovelace", "email": "ada@example.com"}),
+    ("IDENTITY", {"full_name": "Ada Lovelace", "email": "not-an-email"}),
+    ("IDENTITY", {}),
+    ("BUSINESS_CONTEXT", {"business_name": "Analytical Engines"}),
+    ("NEEDS", {"needs_summary": "Automate intake", "skip_scheduling": "true"}),
+    ("NEEDS", {"needs_summary": "Automate intake"}),
+    ("SCHEDULING", {"scheduling_option": "link"}),
+    ("SCHEDULING", {"preferred_times": "Tue 10am", "timezone": "America/Los_Angeles"}),
+    ("SCHEDULING", {"preferred_times": "Tue 10am"}),
+    ("SUMMARY", {"summary": "Name: Ada"}),
+    ("SUBMIT", {}),
+]
+
+
+def per_path_ns(fn, paths, number: int, repeat: int) -> float:
+    def run() -> None:
+        for state, fields in paths:
+            try:
+                fn(state, fields)
+            except HTTPException:
+                pass
+
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / (number * len(paths)) * 1e9
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Per-step cost of the compiled state machine's transitions and validation.")
+    parser.add_argument("--number", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    valid = [path for path in PATHS if main.STATE_MACHINE.validate(*path) is None]
+    invalid = [path for path in PATHS if path not in valid]
+    cases = [
+        ("next_state", PATHS, main.next_state),
+        ("validate ok", valid, main.validate_required_fields),
+        ("validate 400", invalid, main.validate_required_fields),
+    ]
+    print(f"{'case':<14}{'paths':>6}{'ns/step':>10}")
+    for label, paths, fn in cases:
+        print(f"{label:<14}{len(paths):>6}{per_path_ns(fn, paths, args.number, args.repeat):>10.0f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+import main
+from benchmarks import APP_PATH
+from benchmarks.load_test import run_level
+from sqlite_store import SQLiteConfig, SQLiteStore
+from store import ConversationStore, Store
+
+
+def fresh_store(backend: str, directory: Path, synchronous: str) -> Store:
+    if backend == "memory":
+        return ConversationStore()
+    return SQLiteStore(SQLiteConfig(directory / "store.db", synchronous=synchronous))
+
+
+async def measure(backend: str, concurrency: int, flows: int, directory: Path, synchronous: str) -> dict:
+    main._STORE = fresh_store(backend, directory, synchronous)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            return await run_level(client, concurrency, flows, client_share=0.2, seed=concurrency)
+    finally:
+        # Queued audit events go to this store, not to the next run's.
+        main.AUDIT_PIPELINE.flush()
+        main._STORE.close()
+
+
+async def measure_uvicorn(
+    backend: str, workers: int, concurrency: int, flows: int, directory: Path, synchronous: str, port: int
+) -> dict:
+    # With several workers, consecutive requests of one flow land on different processes,
+    # which only works when they share the store: memory with more than one worker shows
+    # up as failed flows.
+    env = {
+        **os.environ,
+        "STORE_BACKEND": backend,
+        "STORE_SQLITE_PATH": str(directory / "store.db"),
+        "STORE_SQLITE_SYNCHRONOUS": synchronous,
+        "WAL_DIR": "",
+    }
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning", "--workers", str(workers)]
+    server = subprocess.Popen(command, cwd=APP_PATH, env=env)
+    try:
+        deadline = time.monotonic() + 60
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120) as client:
+            while True:
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+            return await run_level(client, concurrency, flows, client_share=0.2, seed=concurrency)
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Intake-flow throughput of the memory and SQLite store backends.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[20, 100])
+    parser.add_argument("--rounds", type=int, default=2, help="intake flows per concurrent conversation")
+    parser.add_argument("--synchronous", default="FULL", help="SQLite synchronous pragma for the sqlite runs")
+    parser.add_argument("--workers", type=int, nargs="+", default=[], help="also serve both backends from uvicorn with these worker counts")
+    parser.add_argument("--port", type=int, default=8972)
+    args = parser.parse_args()
+
+    print(f"{cpu_count()} CPUs, sqlite synchronous={args.synchronous}")
+    print(f"{'conversations':>14}{'backend':>22}{'flows/s':>10}{'msg p50':>10}{'msg p99':>10}{'e&s p99':>10}{'failed':>8}")
+    for concurrency in args.concurrency:
+        flows = concurrency * args.rounds
+        runs = [("memory", None), ("sqlite", None)]
+        runs += [(backend, workers) for workers in args.workers for backend in ("memory", "sqlite")]
+        for backend, workers in runs:
+            with tempfile.TemporaryDirectory() as tmp:
+                if workers is None:
+                    label = f"{backend} (in-process)"
+                    result = asyncio.run(measure(backend, concurrency, flows, Path(tmp), args.synchronous))
+                else:
+                    label = f"{backend} x{workers} workers"
+                    result = asyncio.run(measure_uvicorn(backend, workers, concurrency, flows, Path(tmp), args.synchronous, args.port))
+            message = result["endpoints"]["POST /api/conversations/{id}/message"]
+            send = result["endpoints"]["POST /api/conversations/{id}/end-and-send"]
+            print(
+                f"{concurrency:>14}{label:>22}{result['flows_per_second']:>10.1f}{message['p50_ms']:>10.1f}"
+                f"{message['p99_ms']:>10.1f}{send['p99_ms']:>10.1f}{result['failed_flows']:>8}"
+            )
+
+
+def cpu_count() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import argparse
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from threading import Lock
+from uuid import UUID, uuid4
+
+import anyio
+import anyio.to_thread
+
+from records import ConversationRecord, MessageRecord
+from store import ConversationStore
+
+
+class GlobalLockStore(ConversationStore):
+    # Reproduces the old single `_STORE_LOCK` behaviour for comparison.
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._global_lock = Lock()
+
+    @contextmanager
+    def locked(self, conversation_id: UUID, *, missing_ok: bool = False) -> Iterator[ConversationRecord | None]:
+        with self._global_lock:
+            entry = self._entries.get(conversation_id)
+            if entry is None and not missing_ok:
+                raise KeyError(conversation_id)
+            yield entry.conversation if entry else None
+
+
+def seed(store: ConversationStore, conversations: int) -> list[UUID]:
+    ids = []
+    for _ in range(conversations):
+        conversation_id = uuid4()
+        store.insert(ConversationRecord(conversation_id, {}))
+        ids.append(conversation_id)
+    return ids
+
+
+def operation(store: ConversationStore, conversation_id: UUID, hold_seconds: float) -> None:
+    with store.locked(conversation_id) as conversation:
+        conversation.messages.append(MessageRecord(uuid4(), "user", "ping"))
+        time.sleep(hold_seconds)
+    store.snapshot(conversation_id)
+
+
+async def run(store: ConversationStore, ids: list[UUID], threads: int, operations: int, hold_seconds: float) -> float:
+    limiter = anyio.CapacityLimiter(threads)
+    started = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for index in range(operations):
+            conversation_id = ids[index % len(ids)]
+            tg.start_soon(lambda cid=conversation_id: anyio.to_thread.run_sync(operation, store, cid, hold_seconds, limiter=limiter))
+    return operations / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure conversation store throughput against worker-thread count.")
+    parser.add_argument("--conversations", type=int, default=256)
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--hold-ms", type=float, default=0.5, help="simulated work while holding a conversation lock")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 40])
+    args = parser.parse_args()
+
+    hold_seconds = args.hold_ms / 1000
+    print(f"{'threads':>8} {'global ops/s':>14} {'per-conv ops/s':>16} {'speedup':>8}")
+    for threads in args.threads:
+        results = []
+        for store in (GlobalLockStore(), ConversationStore()):
+            ids = seed(store, args.conversations)
+            results.append(anyio.run(run, store, ids, threads, args.operations, hold_seconds))
+        print(f"{threads:>8} {results[0]:>14.0f} {results[1]:>16.0f} {results[1] / results[0]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
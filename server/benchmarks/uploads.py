@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+import httpx
+
+from benchmarks import APP_PATH
+
+CHUNK = 1 << 20
+
+
+def peak_rss_mb(pid: int) -> tuple[float, float]:
+    # (current, peak) resident set of the server process, from /proc (Linux only).
+    values = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        name, _, value = line.partition(":")
+        if name in {"VmRSS", "VmHWM"}:
+            values[name] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+async def body(size_mb: int) -> AsyncIterator[bytes]:
+    # The same bytes for a given size, so the second upload of each size is a duplicate.
+    block = size_mb.to_bytes(4, "big") * (CHUNK // 4)
+    for _ in range(size_mb):
+        yield block
+
+
+async def upload(client: httpx.AsyncClient, size_mb: int) -> tuple[dict, float]:
+    size = size_mb * CHUNK
+    links = (
+        await client.post("/api/uploads/presign", json={"file_name": "big.bin", "content_type": "application/octet-stream", "content_length": size})
+    ).json()
+    started = time.perf_counter()
+    response = await client.put(links["upload_url"], content=body(size_mb), headers={"Content-Type": "application/octet-stream", "Content-Length": str(size)})
+    if response.status_code != 201:
+        raise RuntimeError(f"upload failed: {response.status_code} {response.text}")
+    return links, time.perf_counter() - started
+
+
+async def measure(client: httpx.AsyncClient, pid: int, size_mb: int, ranged_mb: int) -> dict[str, float]:
+    size = size_mb * CHUNK
+    links, upload_seconds = await upload(client, size_mb)
+    after_upload = peak_rss_mb(pid)
+    _duplicate, duplicate_seconds = await upload(client, size_mb)
+
+    started = time.perf_counter()
+    received = 0
+    async with client.stream("GET", links["file_url"]) as download:
+        async for chunk in download.aiter_raw():
+            received += len(chunk)
+    download_seconds = time.perf_counter() - started
+    if received != size:
+        raise RuntimeError(f"downloaded {received} of {size} bytes")
+    # A tail range, as a resumed download or a video seek would ask for.
+    tail = await client.get(links["file_url"], headers={"Range": f"bytes=-{ranged_mb * CHUNK}"})
+    if tail.status_code != 206 or len(tail.content) != ranged_mb * CHUNK:
+        raise RuntimeError("range request failed")
+    return {
+        "upload_mb_s": size_mb / upload_seconds,
+        "download_mb_s": size_mb / download_seconds,
+        "duplicate_mb_s": size_mb / duplicate_seconds,
+        "rss_after_upload": after_upload[0],
+        "peak_rss": peak_rss_mb(pid)[1],
+    }
+
+
+async def run(sizes: list[int], port: int, directory: Path) -> None:
+    env = {**os.environ, "UPLOAD_DIR": str(directory), "UPLOAD_PUBLIC_URL": f"http://127.0.0.1:{port}", "WAL_DIR": ""}
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=APP_PATH, env=env)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=600) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    await client.get("/health")
+                    break
+                except httpx.TransportError:
+                    if time.monotonic() > deadline:
+                        raise
+                    await asyncio.sleep(0.2)
+            idle = peak_rss_mb(server.pid)
+            print(f"server idle: rss {idle[0]:.1f} MB, peak {idle[1]:.1f} MB")
+            print(f"{'size MB':>8}{'up MB/s':>10}{'dup MB/s':>10}{'down MB/s':>11}{'rss MB':>9}{'peak rss MB':>13}")
+            for size_mb in sizes:
+                result = await measure(client, server.pid, size_mb, min(size_mb, 16))
+                print(
+                    f"{size_mb:>8}{result['upload_mb_s']:>10.1f}{result['duplicate_mb_s']:>10.1f}{result['download_mb_s']:>11.1f}"
+                    f"{result['rss_after_upload']:>9.1f}{result['peak_rss']:>13.1f}"
+                )
+            stats = (await client.get("/api/admin/stats")).json()["uploads"]
+            print(
+                f"blobs: {stats['blobs']} holding {stats['blob_bytes'] / CHUNK:.0f} MB for {stats['references']} uploads "
+                f"of {stats['referenced_bytes'] / CHUNK:.0f} MB ({stats['deduplicated']} deduplicated)"
+            )
+    finally:
+        server.terminate()
+        server.wait(30)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(
+        description="Streams large files, each twice, through the local upload endpoints and reports the server's memory and blob usage."
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 300, 600], help="file sizes in MB")
+    parser.add_argument("--port", type=int, default=8973)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args.sizes, args.port, Path(tmp)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from records import ConversationRecord, MessageRecord
+from store import ConversationStore
+from wal import WALConfig, WriteAheadLog
+
+STEPS = ["MODE_SELECT", "IDENTITY", "BUSINESS_CONTEXT", "NEEDS", "SUMMARY"]
+
+
+def open_store(directory: Path) -> ConversationStore:
+    # fsync is off while seeding; recovery cost is what is measured here.
+    return ConversationStore(wal=WriteAheadLog(WALConfig(directory, fsync=False, commit_interval=0, snapshot_every=0)))
+
+
+def seed(directory: Path, conversations: int) -> int:
+    store = open_store(directory)
+    store.recover()
+    for index in range(conversations):
+        conversation = ConversationRecord(uuid4(), {"mode": "prospect"})
+        store.insert(conversation)
+        for state in STEPS:
+            store.append_messages(
+                conversation.id,
+                [MessageRecord(uuid4(), "user", f"{state} answer {index}"), MessageRecord(uuid4(), "assistant", f"{state} prompt")],
+            )
+            with store.locked(conversation.id) as record:
+                record.set_state(state)
+                record.normalized_fields = {**record.normalized_fields, state.lower(): f"value {index}"}
+                store.journal(record, "set", record.changes("state", "normalized_fields"))
+    ops = store.wal.stats()["appends"]
+    store.wal.close()
+    return ops
+
+
+def timed_recovery(directory: Path) -> tuple[float, dict[str, int]]:
+    store = open_store(directory)
+    started = time.perf_counter()
+    report = store.recover()
+    elapsed = time.perf_counter() - started
+    store.wal.close()
+    return elapsed, report
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description="Store recovery time from the WAL alone versus from a snapshot.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    args = parser.parse_args()
+
+    print(f"{'conversations':>14}{'wal ops':>10}{'wal replay s':>14}{'snapshot s':>12}{'wal MB':>9}{'snapshot MB':>13}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            directory = Path(tmp)
+            ops = seed(directory, size)
+            wal_bytes = sum(path.stat().st_size for path in directory.glob("wal-*.log"))
+            replay_seconds, report = timed_recovery(directory)
+            assert report["replayed"] == ops
+
+            store = open_store(directory)
+            store.recover()
+            store.checkpoint()
+            store.wal.close()
+            snapshot_bytes = sum(path.stat().st_size for path in directory.glob("snapshot-*.pkl"))
+            snapshot_seconds, report = timed_recovery(directory)
+            assert report["snapshot_records"] == size and report["replayed"] == 0
+        print(
+            f"{size:>14}{ops:>10}{replay_seconds:>14.2f}{snapshot_seconds:>12.2f}"
+            f"{wal_bytes / 1e6:>9.1f}{snapshot_bytes / 1e6:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main_cli()
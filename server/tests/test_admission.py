@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import main
+from admission import Admission, AdmissionConfig, AdmissionMiddleware, TokenBuckets, parse_rate_limits
+from store import ConversationStore
+
+
+def limited_app(**config):
+    admission = Admission(AdmissionConfig(enabled=True, **config), main.ADMISSION_ROUTES)
+    return admission, AdmissionMiddleware(main.app, admission)
+
+
+def client_for(app, ip):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app, client=(ip, 1234)), base_url="http://test")
+
+
+def test_buckets_are_per_client_and_per_route(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    admission, app = limited_app(limits=parse_rate_limits("create=0.5/2,message=0"), origin_multiplier=1)
+
+    async def scenario():
+        async with client_for(app, "10.0.0.1") as abuser, client_for(app, "10.0.0.2") as other:
+            created = [await abuser.post("/api/conversations", json={}) for _ in range(3)]
+            url = f"/api/conversations/{created[0].json()['id']}/message"
+            message = await abuser.post(url, json={"fields": {}})
+            health = [await abuser.get("/health") for _ in range(5)]
+            fresh = await other.post("/api/conversations", json={})
+            # Two clients on one origin share that origin's bucket as well.
+            site = {"Origin": "https://intake.example"}
+            shared = [await client.post("/api/conversations", json={}, headers=site) for client in (other, abuser)]
+            return created, message, health, fresh, shared
+
+    created, message, health, fresh, shared = asyncio.run(scenario())
+    assert [response.status_code for response in created] == [201, 201, 429]
+    assert created[2].json()["detail"] == "rate_limited" and created[2].headers["retry-after"] == "2"
+    assert message.status_code == 201 and {response.status_code for response in health} == {200}
+    assert fresh.status_code == 201
+    assert [response.status_code for response in shared] == [201, 429]
+    assert admission.stats()["rate_limited"] == 2
+    assert main._STORE.stats()["resident"] == 4
+
+
+def test_a_full_server_queues_briefly_then_sheds(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    original = main.create_conversation
+
+    def slow_create(payload):
+        time.sleep(0.2)
+        return original(payload)
+
+    monkeypatch.setattr(main, "create_conversation", slow_create)
+    limits = parse_rate_limits("default=0")
+    admission, app = limited_app(limits=limits, max_concurrent=1, queue_size=1, queue_timeout=2.0)
+
+    async def scenario():
+        async with client_for(app, "10.0.0.1") as client:
+            first = asyncio.create_task(client.post("/api/conversations", json={}))
+            await asyncio.sleep(0.05)
+            queued = asyncio.create_task(client.post("/api/conversations", json={}))
+            await asyncio.sleep(0.05)
+            shed = await client.post("/api/conversations", json={})
+            # end-and-send does not queue: rejected at once rather than half-processed.
+            busy = await client.post(f"/api/conversations/{main.uuid4()}/end-and-send", json={})
+            return await first, await queued, shed, busy
+
+    first, queued, shed, busy = asyncio.run(scenario())
+    assert first.status_code == queued.status_code == 201
+    assert shed.status_code == busy.status_code == 503
+    assert shed.json()["detail"] == "server_busy" and shed.headers["retry-after"] == "1"
+    stats = admission.stats()
+    assert (stats["queue_full"], stats["busy"], stats["active"], stats["queued"]) == (1, 1, 0, 0)
+
+
+def test_token_buckets_refill_and_stay_bounded():
+    buckets = TokenBuckets(max_clients=2)
+    key = [(("create", "ip", "a"), 2.0, 2.0)]
+    assert buckets.take(key, 0.0) == buckets.take(key, 0.0) == 0.0
+    assert buckets.take(key, 0.0) == pytest.approx(0.5)
+    assert buckets.take(key, 0.5) == 0.0
+    for ip in "bcd":
+        buckets.take([(("create", "ip", ip), 2.0, 2.0)], 1.0)
+    assert len(buckets) == 2
+    with pytest.raises(ValueError):
+        parse_rate_limits("create=fast")
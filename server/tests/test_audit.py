@@ -0,0 +1,193 @@
+import threading
+import time
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+import main
+from audit import AuditEvent, AuditPipeline
+from pg_store import PostgresStore
+from records import ConversationRecord
+from store import ConversationStore
+
+
+def test_events_are_written_in_batches():
+    batches = []
+    pipeline = AuditPipeline(batches.append, batch_size=10, flush_interval=5)
+    conversation_id = uuid4()
+    for index in range(25):
+        assert pipeline.submit(AuditEvent(conversation_id, "step", {"index": index}))
+    assert pipeline.flush()
+    pipeline.stop()
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert [event.payload["index"] for batch in batches for event in batch] == list(range(25))
+    assert pipeline.stats()["written"] == 25
+
+
+def wait_in_flight(pipeline):
+    deadline = time.monotonic() + 5
+    while pipeline.stats()["in_flight"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_full_buffer_drops_and_counts():
+    release = threading.Event()
+    pipeline = AuditPipeline(lambda _batch: release.wait(5), capacity=2, batch_size=1, flush_interval=0)
+    conversation_id = uuid4()
+    pipeline.submit(AuditEvent(conversation_id, "first"))
+    wait_in_flight(pipeline)
+    accepted = [pipeline.submit(AuditEvent(conversation_id, "more")) for _ in range(4)]
+    release.set()
+    pipeline.stop()
+    stats = pipeline.stats()
+    assert accepted == [True, True, False, False]
+    assert (stats["dropped"], stats["written"]) == (2, 3)
+
+
+def test_backpressure_waits_for_room():
+    gate = threading.Event()
+    pipeline = AuditPipeline(lambda _batch: gate.wait(5), capacity=1, batch_size=1, flush_interval=0, block_timeout=5)
+    conversation_id = uuid4()
+    pipeline.submit(AuditEvent(conversation_id, "first"))
+    wait_in_flight(pipeline)
+    pipeline.submit(AuditEvent(conversation_id, "second"))
+    threading.Timer(0.05, gate.set).start()
+    assert pipeline.submit(AuditEvent(conversation_id, "third"))
+    pipeline.stop()
+    stats = pipeline.stats()
+    assert stats["waits"] == 1 and stats["dropped"] == 0 and stats["written"] == 3
+
+
+def test_failed_batches_are_retried_then_dropped():
+    attempts = []
+
+    def flaky(batch):
+        attempts.append(len(batch))
+        if len(attempts) < 3:
+            raise RuntimeError("database unavailable")
+
+    pipeline = AuditPipeline(flaky, retry_delay=0)
+    pipeline.submit(AuditEvent(uuid4(), "kept"))
+    pipeline.stop()
+    assert attempts == [1, 1, 1] and pipeline.stats()["written"] == 1
+
+    failing = AuditPipeline(lambda _batch: 1 / 0, max_attempts=2, retry_delay=0)
+    failing.submit(AuditEvent(uuid4(), "lost"))
+    failing.stop()
+    assert failing.stats()["failed_batches"] == 1 and failing.stats()["dropped"] == 1
+
+
+def test_local_sink_caps_resident_events(monkeypatch):
+    store = ConversationStore()
+    conversation = ConversationRecord(uuid4(), {})
+    store.insert(conversation)
+    monkeypatch.setattr(main, "_STORE", store)
+    monkeypatch.setattr(main, "AUDIT_LOCAL_MAX_EVENTS", 3)
+    main.write_audit_batch([AuditEvent(conversation.id, "step", {"index": index}) for index in range(5)])
+    main.write_audit_batch([AuditEvent(uuid4(), "orphan")])
+    assert [event["payload"]["index"] for event in conversation.audit_log] == [2, 3, 4]
+
+
+class FakeCopy:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def write_row(self, row):
+        self.rows.append(row)
+
+
+class FakeCursor:
+    def __init__(self, statements, rows):
+        self.statements = statements
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def copy(self, statement):
+        self.statements.append(statement)
+        return FakeCopy(self.rows)
+
+
+class FakeConn:
+    def __init__(self):
+        self.statements = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def connection(self):
+        return self
+
+    def cursor(self):
+        return FakeCursor(self.statements, self.rows)
+
+
+def test_sql_sink_copies_one_batch_per_statement(monkeypatch):
+    conn = FakeConn()
+    monkeypatch.setattr(main, "_STORE", PostgresStore(conn))
+    conversation_id = uuid4()
+    main.write_audit_batch([AuditEvent(conversation_id, "step", {"index": index}) for index in range(3)])
+    assert len(conn.statements) == 1 and conn.statements[0].startswith("COPY audit_logs")
+    assert [row[1] for row in conn.rows] == [conversation_id] * 3
+    assert conn.rows[0][3] == '{"index": 0}'
+
+
+def test_audit_api_pages_through_events(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    for index in range(5):
+        main.log_audit(main.UUID(created["id"]), "step", {"index": index})
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get(f"/api/conversations/{created['id']}/audit", params=params).json()
+        seen.extend(event["payload"]["index"] for event in page["events"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [0, 1, 2, 3, 4]
+    assert client.get(f"/api/conversations/{created['id']}/audit", params={"cursor": "nope"}).status_code == 400
+    assert client.get(f"/api/conversations/{uuid4()}/audit").status_code == 404
+    assert client.get("/api/admin/stats").json()["audit"]["submitted"] >= 5
+
+
+def test_audit_reads_include_unwritten_events_without_waiting(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    gate = threading.Event()
+    pipeline = AuditPipeline(lambda batch: gate.wait(5) and main.write_audit_batch(batch), batch_size=1, flush_interval=0)
+    monkeypatch.setattr(main, "AUDIT_PIPELINE", pipeline)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    conversation_id = main.UUID(created["id"])
+    for index in range(3):
+        main.log_audit(conversation_id, "step", {"index": index})
+        main.log_audit(uuid4(), "elsewhere")
+    wait_in_flight(pipeline)
+
+    # The sink is stalled with the first event in flight; the page is still complete.
+    started = time.monotonic()
+    page = client.get(f"/api/conversations/{created['id']}/audit", params={"limit": 2}).json()
+    assert time.monotonic() - started < 1
+    assert [event["payload"]["index"] for event in page["events"]] == [0, 1]
+    rest = client.get(f"/api/conversations/{created['id']}/audit", params={"cursor": page["next_cursor"]}).json()
+    assert [event["payload"]["index"] for event in rest["events"]] == [2] and rest["next_cursor"] is None
+    gate.set()
+    pipeline.stop()
+    written = client.get(f"/api/conversations/{created['id']}/audit").json()["events"]
+    assert [event["payload"]["index"] for event in written] == [0, 1, 2]
@@ -0,0 +1,115 @@
+from uuid import uuid4
+
+import bulk
+from pg_store import ATTACHMENT_COLUMNS, PostgresStore
+
+
+class Copy:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def write_row(self, row):
+        self.rows.append(tuple(row))
+
+
+class Cursor:
+    def __init__(self):
+        self.statements = []
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.statements.append((sql, list(params or [])))
+
+    def copy(self, sql):
+        self.statements.append((sql, None))
+        return Copy(self.rows)
+
+
+class EndingCursor(Cursor):
+    # Answers the statements PostgresStore.end() reads back.
+    rowcount = 1
+
+    def __init__(self, brief_id):
+        super().__init__()
+        self.brief_id = brief_id
+
+    def fetchone(self):
+        sql = self.statements[-1][0]
+        if "RETURNING message_seq" in sql:
+            return {"message_seq": 1}
+        if "RETURNING id" in sql:
+            return {"id": self.brief_id}
+        return {"id": uuid4(), "normalized_fields": {}, "slack_post_id": "queued-1", "version": 2}
+
+    def fetchall(self):
+        return []
+
+
+class Conn:
+    def __init__(self, cursor):
+        self.cursor_ = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        return False
+
+    def connection(self):
+        return self
+
+    def cursor(self):
+        return self.cursor_
+
+
+def test_copy_writes_every_row_in_one_statement():
+    cursor = Cursor()
+    assert bulk.write_rows(cursor, "t", ("a", "b"), [(1, "x"), (2, "y")], method="copy") == 2
+    assert cursor.statements == [("COPY t (a, b) FROM STDIN", None)]
+    assert cursor.rows == [(1, "x"), (2, "y")]
+
+
+def test_values_pages_stay_under_the_parameter_limit(monkeypatch):
+    monkeypatch.setattr(bulk, "MAX_PARAMS", 6)
+    cursor = Cursor()
+    assert bulk.write_rows(cursor, "t", ("a", "b"), [(index, index) for index in range(7)], method="values") == 7
+    assert [sql.count("(%s, %s)") for sql, _ in cursor.statements] == [3, 3, 1]
+    assert cursor.statements[0][1] == [0, 0, 1, 1, 2, 2]
+    assert bulk.write_rows(cursor, "t", ("a",), []) == 0 and len(cursor.statements) == 3
+
+
+def test_attachments_are_bulk_written_as_typed_columns():
+    conversation_id, brief_id = uuid4(), uuid4()
+    cursor = EndingCursor(brief_id)
+    store = PostgresStore(Conn(cursor))
+    attachments = [
+        {"file_url": "https://files.local/uploads/brief.pdf"},
+        {"file_url": "https://files.local/uploads/x", "file_name": "logo.png", "content_type": "image/png", "size_bytes": 42},
+    ]
+    handoff = {"slack_post_id": "queued-1", "slack_payload": {}, "slack_delivery": "pending", "slack_lease_until": None}
+    store.end(conversation_id, 1, {}, state="SUBMIT", brief={}, attachments=attachments, handoff=handoff)
+    copies = [sql for sql, params in cursor.statements if params is None]
+    assert copies == [f"COPY attachments ({', '.join(ATTACHMENT_COLUMNS)}) FROM STDIN"]
+    rows = [dict(zip(ATTACHMENT_COLUMNS, row)) for row in cursor.rows]
+    assert [(row["file_name"], row["content_type"], row["size_bytes"]) for row in rows] == [
+        ("brief.pdf", "application/pdf", 0),
+        ("logo.png", "image/png", 42),
+    ]
+    assert rows[0]["storage_key"] == "uploads/brief.pdf" and rows[0]["storage_url"] == attachments[0]["file_url"]
+    assert {row["intake_brief_id"] for row in rows} == {brief_id}
+
+    cursor = EndingCursor(brief_id)
+    PostgresStore(Conn(cursor)).end(conversation_id, 1, {}, state="SUBMIT", brief={}, attachments=[], handoff=handoff)
+    assert not any(params is None for _sql, params in cursor.statements)
@@ -0,0 +1,192 @@
+import asyncio
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from db import AsyncConnectionPool, ConnectionPool, PoolConfig, PoolTimeout
+from pg_store import PostgresStore
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.commits = 0
+        self.rollbacks = 0
+        self.health_checks = 0
+
+    def execute(self, sql):
+        if self.broken:
+            raise RuntimeError("server closed the connection")
+        self.health_checks += 1
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncFakeConn(FakeConn):
+    async def execute(self, sql):
+        FakeConn.execute(self, sql)
+
+    async def commit(self):
+        FakeConn.commit(self)
+
+    async def rollback(self):
+        FakeConn.rollback(self)
+
+    async def close(self):
+        FakeConn.close(self)
+
+
+def make_pool(**overrides):
+    created = []
+
+    def connect():
+        conn = FakeConn()
+        created.append(conn)
+        return conn
+
+    config = PoolConfig(dsn="postgresql://fake", **{"min_size": 1, "max_size": 2, "timeout": 0.2, **overrides})
+    return ConnectionPool(config, connect=connect), created
+
+
+def test_pool_prewarms_and_reuses_connections():
+    pool, created = make_pool()
+    pool.open()
+    assert len(created) == 1
+    for _ in range(5):
+        with pool.connection() as conn:
+            assert conn.raw is created[0]
+    assert created[0].commits == 5
+    assert pool.stats()["size"] == 1
+
+
+def test_pool_rolls_back_on_error_and_enforces_max_size():
+    pool, created = make_pool()
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError("boom")
+    assert created[0].rollbacks == 1
+
+    first, second = pool.connection(), pool.connection()
+    first_conn = first.__enter__().raw
+    second.__enter__()
+    with pytest.raises(PoolTimeout):
+        with pool.connection():
+            pass
+
+    threading.Timer(0.05, lambda: first.__exit__(None, None, None)).start()
+    with pool.connection() as conn:
+        assert conn.raw is first_conn
+    second.__exit__(None, None, None)
+    assert len(created) == 2
+    assert pool.stats()["timeouts"] == 1
+    assert pool.stats()["waited"] >= 1
+
+
+def test_pool_health_check_replaces_dead_connections():
+    pool, created = make_pool(health_check_interval=0)
+    pool.open()
+    created[0].broken = True
+    with pool.connection() as conn:
+        assert conn.raw is created[1]
+    assert created[0].closed
+    assert pool.stats()["discarded"] == 1
+
+
+def test_async_pool_round_trip():
+    created = []
+
+    async def connect():
+        conn = AsyncFakeConn()
+        created.append(conn)
+        return conn
+
+    async def scenario():
+        pool = AsyncConnectionPool(PoolConfig(dsn="postgresql://fake", min_size=1, max_size=1, timeout=0.2), connect=connect)
+        await pool.open()
+
+        async def use():
+            async with pool.connection() as conn:
+                await asyncio.sleep(0.01)
+                return conn.raw
+
+        results = await asyncio.gather(*(use() for _ in range(4)))
+        await pool.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(conn is created[0] for conn in results)
+    assert created[0].commits == 4 and created[0].closed
+
+
+class RecordingCopy:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def write_row(self, row):
+        pass
+
+
+class RecordingCursor:
+    def __init__(self, statements):
+        self.statements = statements
+        self.rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def executemany(self, sql, rows):
+        self.statements.extend(sql for _ in rows)
+
+    def copy(self, sql):
+        self.statements.append(sql)
+        return RecordingCopy()
+
+    def fetchone(self):
+        return None
+
+
+class RecordingConn:
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def connection(self):
+        return self
+
+    def cursor(self):
+        return RecordingCursor(self.statements)
+
+
+def test_create_conversation_writes_conversation_and_message_rows(monkeypatch):
+    conn = RecordingConn()
+    monkeypatch.setattr(main, "_STORE", PostgresStore(conn))
+    response = TestClient(main.app).post("/api/conversations", json={"mode": "prospect"})
+    assert response.status_code == 201
+    # The row starts at the welcome message's seq, so no separate message_seq bump.
+    assert conn.statements[0].startswith("INSERT INTO conversations")
+    assert conn.statements[1].startswith("COPY messages")
+    assert len(conn.statements) == 2
@@ -0,0 +1,88 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+import main
+from derived import DerivedViews
+from store import ConversationStore
+
+
+def counting_summary(monkeypatch):
+    calls = []
+    original = main.build_summary
+
+    def build(fields):
+        calls.append(dict(fields))
+        return original(fields)
+
+    monkeypatch.setattr(main, "build_summary", build)
+    return calls
+
+
+def test_views_are_reused_until_the_fields_change(monkeypatch):
+    derived = DerivedViews(max_entries=64)
+    calls = counting_summary(monkeypatch)
+    conversation_id = uuid4()
+    fields = {"full_name": "Ada", "email": "ada@example.com"}
+
+    views = derived.for_fields(conversation_id, fields)
+    assert main.prompt_for_state("SUMMARY", fields, views).endswith("Name: Ada\nEmail: ada@example.com")
+    with_summary = {**fields, "summary": "stored"}
+    assert derived.for_fields(conversation_id, with_summary) is views
+    assert main.summary_for(with_summary, views) == "Name: Ada\nEmail: ada@example.com"
+    assert len(calls) == 1
+
+    changed = {**fields, "full_name": "Grace"}
+    assert main.prompt_for_state("SUMMARY", changed, derived.for_fields(conversation_id, changed)).endswith("Name: Grace\nEmail: ada@example.com")
+    assert len(calls) == 2
+    stats = derived.stats()
+    assert (stats["hits"], stats["invalidations"], stats["entries"]) == (1, 1, 1)
+
+
+def test_stored_summary_is_part_of_the_view_key():
+    views = DerivedViews(max_entries=64).for_fields(uuid4(), {"full_name": "Ada"})
+    assert main.summarize_step_response("SUMMARY", {"full_name": "Ada", "summary": "first"}, views) == "first"
+    assert main.summarize_step_response("SUMMARY", {"full_name": "Ada", "summary": "second"}, views) == "second"
+    fields = {"full_name": "Ada", "summary": "second"}
+    brief = main.build_intake_brief(fields, "note", views)
+    assert brief["summary"] == "second" and main.build_intake_brief(fields, "note", views) is brief
+
+
+def test_intake_builds_each_summary_once_and_invalidates_on_change(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    monkeypatch.setattr(main, "_DERIVED", DerivedViews(max_entries=64))
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    url = f"/api/conversations/{created['id']}"
+    client.post(f"{url}/message", json={"fields": {}})
+    client.post(f"{url}/message", json={"fields": {"mode": "prospect"}})
+    calls = counting_summary(monkeypatch)
+
+    client.post(f"{url}/message", json={"fields": {"full_name": "Ada", "email": "ada@example.com"}})
+    assert len(calls) == 1
+    invalidations = main._DERIVED.stats()["invalidations"]
+    client.post(f"{url}/message", json={"fields": {"business_name": "Engines"}})
+    assert main._DERIVED.stats()["invalidations"] == invalidations + 1
+    summary = client.post(f"{url}/message", json={"fields": {"needs_summary": "Automate intake", "skip_scheduling": "true"}}).json()
+    assert summary["state"] == "SUMMARY" and len(calls) == 2
+    again = client.post(f"{url}/message", json={"fields": {}, "advance": False}).json()
+    assert again["messages"][-1]["content"] == summary["messages"][-1]["content"] and len(calls) == 2
+
+    ended = client.post(f"{url}/end-and-send", json={}).json()
+    assert ended["conversation"]["intake_brief"]["summary"].startswith("Name: Ada")
+    assert "derived_views" in client.get("/api/admin/stats").json()
+
+
+def test_disabled_cache_uses_the_plain_builders(monkeypatch):
+    monkeypatch.setattr(main, "_DERIVED", DerivedViews(max_entries=0))
+    calls = counting_summary(monkeypatch)
+    assert main._DERIVED.for_fields(uuid4(), {"full_name": "Ada"}) is None
+    main.apply_step(uuid4(), "NEEDS", {"full_name": "Ada"}, main.CreateMessageRequest(fields={"needs_summary": "x", "skip_scheduling": "true"}))
+    assert len(calls) == 2 and main._DERIVED.stats()["misses"] == 0
+
+
+def test_cache_is_on_and_bounded_by_default(monkeypatch):
+    monkeypatch.delenv("DERIVED_CACHE_MAX_ENTRIES", raising=False)
+    derived = DerivedViews.from_env()
+    assert derived.max_entries == 10_000
+    assert derived.for_fields(uuid4(), {"full_name": "Ada"}) is not None
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import threading
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+import main
+from events import EventBroker
+
+
+def parse_event(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().splitlines())
+    return fields.get("event"), json.loads(fields["data"]), fields.get("id")
+
+
+def test_broker_delivers_from_worker_threads_and_cuts_off_laggards():
+    async def scenario():
+        broker = EventBroker(max_pending=2)
+        conversation_id = uuid4()
+        subscription = broker.subscribe(conversation_id)
+        worker = threading.Thread(target=broker.publish, args=(conversation_id, "message", {"n": 1}, 1))
+        worker.start()
+        worker.join()
+        first = await subscription.get(1)
+
+        for n in range(2, 6):
+            broker.publish(conversation_id, "message", {"n": n}, n)
+        await asyncio.sleep(0)
+        cut_off = await subscription.get(1)
+        subscription.close()
+        return first, cut_off, broker.subscriber_count(conversation_id)
+
+    first, cut_off, remaining = asyncio.run(scenario())
+    assert first.data == {"n": 1}
+    assert b"id: 1\nevent: message\n" in first.encode()
+    assert cut_off is None
+    assert remaining == 0
+
+
+def test_event_stream_pushes_deltas_after_snapshot():
+    created = main.create_conversation(main.CreateConversationRequest())
+    conversation_id = created["id"]
+
+    async def scenario():
+        subscription = main._EVENTS.subscribe(conversation_id)
+        snapshot = main.load_conversation(conversation_id, since=1)
+        received = []
+
+        async def is_disconnected():
+            return len(received) >= 4
+
+        stream = main.conversation_event_stream(subscription, snapshot, is_disconnected)
+        received.append(await stream.__anext__())
+        await asyncio.to_thread(
+            main.create_conversation_message, conversation_id, main.CreateMessageRequest(content="Ready")
+        )
+        async for chunk in stream:
+            received.append(chunk)
+        return received
+
+    chunks = asyncio.run(scenario())
+    events = [parse_event(chunk) for chunk in chunks]
+    assert events[0][0] == "snapshot"
+    assert events[0][1]["messages"] == []
+    assert events[1][0] == "conversation" and events[1][1]["state"] == "MODE_SELECT"
+    assert [(name, data["seq"], event_id) for name, data, event_id in events[2:]] == [
+        ("message", 2, "2"),
+        ("message", 3, "3"),
+    ]
+    assert main._EVENTS.subscriber_count(conversation_id) == 0
+
+
+def test_event_stream_unknown_conversation_returns_404():
+    response = TestClient(main.app).get(f"/api/conversations/{uuid4()}/events")
+    assert response.status_code == 404
+    assert main._EVENTS.subscriber_count() == 0
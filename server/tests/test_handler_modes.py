@@ -0,0 +1,118 @@
+import asyncio
+import threading
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+
+import main
+from records import ConversationRecord
+from store import ConversationStore, SpillFile
+from wal import WALConfig, WriteAheadLog
+
+
+def record_handler_threads(monkeypatch, store):
+    threads = []
+    original = store.snapshot
+
+    def snapshot(conversation_id, since=0):
+        threads.append(threading.current_thread().name)
+        return original(conversation_id, since=since)
+
+    monkeypatch.setattr(store, "snapshot", snapshot)
+    return threads
+
+
+def test_async_mode_runs_handlers_on_the_event_loop(monkeypatch, tmp_path):
+    store = ConversationStore(wal=WriteAheadLog(WALConfig(tmp_path, commit_interval=0)))
+    store.recover()
+    monkeypatch.setattr(main, "_STORE", store)
+    threads = record_handler_threads(monkeypatch, store)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+
+    monkeypatch.setattr(main, "HANDLER_MODE", "thread")
+    client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}})
+    monkeypatch.setattr(main, "HANDLER_MODE", "async")
+    response = client.post(f"/api/conversations/{created['id']}/message", json={"fields": {"mode": "prospect"}})
+    assert response.status_code == 201 and response.json()["state"] == "IDENTITY"
+    ended = client.post(f"/api/conversations/{created['id']}/end-and-send", json={})
+    assert ended.json()["conversation"]["status"] == "ended"
+
+    assert threads[0].startswith("AnyIO worker thread")
+    assert not any(name.startswith("AnyIO worker thread") for name in threads[2:])
+    # Every change was acknowledged only after it was durable.
+    wal = store.wal.stats()
+    assert wal["durable_lsn"] == wal["appends"] and store.snapshot(UUID(created["id"]))["state"] == "SUBMIT"
+    store.wal.close()
+
+
+def test_blocking_backends_stay_on_worker_threads(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "HANDLER_MODE", "async")
+    store = ConversationStore(spill=SpillFile(str(tmp_path / "spill.db")))
+    monkeypatch.setattr(main, "_STORE", store)
+    assert not main.runs_inline()
+    threads = record_handler_threads(monkeypatch, store)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    assert client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}}).status_code == 201
+    assert threads and all(name.startswith("AnyIO worker thread") for name in threads)
+    store.spill.close()
+
+
+def test_deferred_appends_are_awaited_until_durable(tmp_path):
+    store = ConversationStore(wal=WriteAheadLog(WALConfig(tmp_path, commit_interval=0.01)))
+    store.recover()
+
+    async def scenario():
+        with store.deferred_durability() as ticket:
+            conversation = ConversationRecord(uuid4(), {})
+            store.insert(conversation)
+            with store.locked(conversation.id) as record:
+                record.set_state("IDENTITY")
+                store.journal(record, "set", record.changes("state"))
+        # Both appends returned without waiting for the 10 ms group-commit window.
+        assert ticket.lsn == 2 and store.wal.stats()["durable_lsn"] < 2
+        await store.durable(ticket)
+        return store.wal.stats()["durable_lsn"]
+
+    assert asyncio.run(scenario()) == 2
+    store.wal.close()
+
+
+def test_requests_with_attachments_leave_the_event_loop(monkeypatch):
+    monkeypatch.setattr(main, "HANDLER_MODE", "async")
+    store = ConversationStore()
+    monkeypatch.setattr(main, "_STORE", store)
+    threads = record_handler_threads(monkeypatch, store)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    url = f"/api/conversations/{created['id']}"
+    attachment = {"file_url": "https://files.example/brief.pdf"}
+    assert client.post(f"{url}/message", json={"fields": {}, "attachments": [attachment]}).status_code == 201
+    assert client.post(f"{url}/steps", json={"steps": [{"attachments": [attachment]}]}).status_code == 201
+    assert client.post(f"{url}/end-and-send", json={"attachments": [attachment]}).status_code == 200
+    assert len(threads) >= 3 and all(name.startswith("AnyIO worker thread") for name in threads)
+
+
+def test_inline_conflicts_back_off_without_sleeping_on_the_loop(monkeypatch):
+    monkeypatch.setattr(main, "HANDLER_MODE", "async")
+    store = ConversationStore()
+    monkeypatch.setattr(main, "_STORE", store)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    original, results = store.update, [False, False]
+
+    def update(*args, **kwargs):
+        # Two commits lose to another writer before the third goes through.
+        return results.pop(0) if results else original(*args, **kwargs)
+
+    def sleep(_seconds):
+        raise AssertionError("time.sleep on the event loop")
+
+    monkeypatch.setattr(store, "update", update)
+    monkeypatch.setattr(main.time, "sleep", sleep)
+    threads = record_handler_threads(monkeypatch, store)
+    response = client.post(f"/api/conversations/{created['id']}/message", json={"content": "hi", "advance": False})
+    assert response.status_code == 201 and [message["content"] for message in response.json()["messages"]].count("hi") == 1
+    # One snapshot per attempt plus the refetch, all on the loop.
+    assert len(threads) == 4 and not any(name.startswith("AnyIO worker thread") for name in threads)
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import anyio
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from idempotency import Idempotency, SQLiteIdempotencyTable, StoredResponse
+from store import ConversationStore
+
+
+def test_retries_replay_the_first_response(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    client = TestClient(main.app)
+    first = client.post("/api/conversations", json={"mode": "prospect"}, headers={"Idempotency-Key": "create-1"})
+    retry = client.post("/api/conversations", json={"mode": "prospect"}, headers={"Idempotency-Key": "create-1"})
+    assert first.status_code == retry.status_code == 201
+    assert retry.content == first.content and retry.headers["etag"] == first.headers["etag"]
+    assert retry.headers["idempotent-replayed"] == "true" and "idempotent-replayed" not in first.headers
+    assert main._STORE.stats()["resident"] == 1
+
+    url = f"/api/conversations/{first.json()['id']}/message"
+    for _ in range(3):
+        response = client.post(url, json={"content": "hello", "advance": False}, headers={"Idempotency-Key": "msg-1"})
+        assert response.status_code == 201
+    messages = client.get(f"/api/conversations/{first.json()['id']}").json()["messages"]
+    assert [message["content"] for message in messages].count("hello") == 1
+
+    reused = client.post(url, json={"content": "other"}, headers={"Idempotency-Key": "msg-1"})
+    assert reused.status_code == 422 and reused.json()["detail"] == "idempotency_key_reused"
+    assert client.post(url, json={}, headers={"Idempotency-Key": "x" * 256}).status_code == 400
+
+
+def test_concurrent_duplicates_wait_for_the_first(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    original, calls = main.create_conversation, []
+
+    def slow_create(payload):
+        calls.append(payload)
+        time.sleep(0.2)
+        return original(payload)
+
+    monkeypatch.setattr(main, "create_conversation", slow_create)
+
+    async def post_twice():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"Idempotency-Key": "concurrent-1"}
+            return await asyncio.gather(*(client.post("/api/conversations", json={}, headers=headers) for _ in range(3)))
+
+    responses = asyncio.run(post_twice())
+    assert len(calls) == 1
+    assert {response.status_code for response in responses} == {201}
+    assert len({response.content for response in responses}) == 1
+    assert sum("idempotent-replayed" in response.headers for response in responses) == 2
+
+
+def test_failed_attempts_release_the_key(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    original, failures = main.create_conversation, [RuntimeError("database went away")]
+
+    def flaky_create(payload):
+        if failures:
+            raise failures.pop()
+        return original(payload)
+
+    monkeypatch.setattr(main, "create_conversation", flaky_create)
+    client = TestClient(main.app, raise_server_exceptions=False)
+    headers = {"Idempotency-Key": "flaky-1"}
+    assert client.post("/api/conversations", json={}, headers=headers).status_code == 500
+    retry = client.post("/api/conversations", json={}, headers=headers)
+    assert retry.status_code == 201 and "idempotent-replayed" not in retry.headers
+    assert main._STORE.stats()["resident"] == 1
+
+
+def test_workers_share_keys_through_the_table(tmp_path):
+    path = tmp_path / "store.db"
+    first = Idempotency(wait_seconds=0.2, table=SQLiteIdempotencyTable(path))
+    second = Idempotency(wait_seconds=0.2, table=SQLiteIdempotencyTable(path))
+    stored = StoredResponse(201, [(b"content-type", b"application/json")], b'{"id": 1}')
+
+    async def scenario():
+        flight = await first.begin("/api/conversations", "k", "hash")
+        # The first worker is still running the handler: the second waits, then gives up.
+        busy = await second.begin("/api/conversations", "k", "hash")
+        await first.finish("/api/conversations", "k", flight, stored)
+        done = await second.begin("/api/conversations", "k", "hash")
+        reused = await second.begin("/api/conversations", "k", "other")
+        return busy, done, reused
+
+    busy, done, reused = anyio.run(scenario)
+    assert (busy.status, busy.detail) == (409, "idempotency_key_in_flight")
+    assert done.body == stored.body and (b"idempotent-replayed", b"true") in done.headers
+    assert reused.status == 422
+    assert second.stats()["in_flight_timeouts"] == 1 and second.stats()["entries"] == 1
+    first.close()
+    second.close()
+
+
+def test_entries_expire_and_are_bounded():
+    cache = Idempotency(ttl_seconds=0.05, max_entries=2)
+    stored = StoredResponse(200, [], b"{}")
+
+    async def fill():
+        for key in ("a", "b", "c"):
+            await cache.finish("/r", key, await cache.begin("/r", key, "h"), stored)
+
+    anyio.run(fill)
+    assert cache.stats()["entries"] == 2 and cache.stats()["evictions"] == 1
+    time.sleep(0.06)
+    assert not isinstance(anyio.run(cache.begin, "/r", "b", "h"), StoredResponse)
+    with pytest.raises(ValueError):
+        Idempotency(ttl_seconds=0)
+
+
+def test_oversized_bodies_are_refused_before_the_handler(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    monkeypatch.setattr(main.IDEMPOTENCY, "max_body_bytes", 64)
+    client = TestClient(main.app)
+    headers = {"Idempotency-Key": "big-1"}
+    response = client.post("/api/conversations", json={"mode": "x" * 100}, headers=headers)
+    assert response.status_code == 413 and response.json()["detail"] == "request_body_too_large"
+    # Without Content-Length the cap applies while the chunks are read.
+    chunked = client.post("/api/conversations", content=iter([b'{"mode": "', b"x" * 100, b'"}']), headers=headers)
+    assert chunked.status_code == 413
+    assert main._STORE.stats()["resident"] == 0
+    # Nothing was claimed, so the key still works for a body under the cap.
+    assert client.post("/api/conversations", json={}, headers=headers).status_code == 201
@@ -0,0 +1,59 @@
+import asyncio
+
+import httpx
+
+import main
+from benchmarks.load_test import compare, percentile, run_level
+from benchmarks.standins import SlackStandIn, StripeStandIn, install
+from store import ConversationStore
+
+
+def test_percentile_is_nearest_rank():
+    ordered = [float(value) for value in range(1, 101)]
+    assert [percentile(ordered, q) for q in (50, 95, 99, 100)] == [50.0, 95.0, 99.0, 100.0]
+    assert percentile([], 95) == 0.0
+
+
+def level(flows_per_second, p95, p99=10.0, failed=0):
+    return {
+        "flows_per_second": flows_per_second,
+        "failed_flows": failed,
+        "endpoints": {"GET /api/conversations/{id}": {"p95_ms": p95, "p99_ms": p99}},
+    }
+
+
+def test_compare_flags_only_regressions_beyond_the_threshold():
+    baseline = {"levels": {"8": level(100.0, 5.0)}}
+    assert compare({"levels": {"8": level(85.0, 5.9)}}, baseline, 0.2) == []
+    assert compare({"levels": {"1": level(1.0, 500.0)}}, baseline, 0.2) == []
+
+    regressions = compare({"levels": {"8": level(70.0, 6.5, failed=2)}}, baseline, 0.2)
+    assert len(regressions) == 3
+    assert regressions[0].startswith("c=8 flows/s")
+    assert "p95_ms 5.0 -> 6.5" in regressions[1]
+
+
+def test_scripted_flows_complete_in_process_with_standins(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    slack = SlackStandIn().start()
+    restore = install(main, slack, StripeStandIn())
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+            return await run_level(client, concurrency=3, flows=6, client_share=0.5, seed=3)
+
+    try:
+        result = asyncio.run(scenario())
+        assert main.SLACK_OUTBOX.drain(5)
+    finally:
+        restore()
+        slack.stop()
+
+    assert result["failed_flows"] == 0 and result["flows"] == 6
+    endpoints = result["endpoints"]
+    assert endpoints["POST /api/conversations"]["count"] == 6
+    assert endpoints["POST /api/conversations/{id}/end-and-send"]["count"] == 6
+    assert all(stats["errors"] == 0 and stats["p50_ms"] <= stats["p99_ms"] for stats in endpoints.values())
+    assert slack.received == 6
+    assert main.SLACK_WEBHOOK_URL != slack.url
@@ -0,0 +1,75 @@
+import re
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from metrics import Metric, Registry
+from store import ConversationStore
+
+
+def sample(text, name, **labels):
+    # The value of one sample line, matched on name and labels regardless of order.
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        metric, _, value = line.rpartition(" ")
+        line_name, _, raw_labels = metric.partition("{")
+        if line_name == name and dict(re.findall(r'(\w+)="([^"]*)"', raw_labels)) == labels:
+            return float(value)
+    return None
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("demo_requests_total", "Requests.", ("path",))
+    latency = registry.histogram("demo_seconds", "Latency.", buckets=(0.1, 1.0))
+    registry.callback("demo_size", "Size.", "gauge", lambda: [((), 7)])
+    requests.labels('/a"b').inc()
+    requests.labels('/a"b').inc(2)
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert "# TYPE demo_requests_total counter" in text and "# TYPE demo_seconds histogram" in text
+    assert 'demo_requests_total{path="/a\\"b"} 3' in text
+    assert [sample(text, "demo_seconds_bucket", le=le) for le in ("0.1", "1", "+Inf")] == [1, 2, 3]
+    assert sample(text, "demo_seconds_count") == 3 and sample(text, "demo_seconds_sum") == 5.55
+    assert sample(text, "demo_size") == 7
+
+
+def test_metrics_endpoint_reports_routes_transitions_and_store(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    client = TestClient(main.app)
+    before = client.get("/metrics").text
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}})
+    client.post(f"/api/conversations/{created['id']}/message", json={"fields": {"mode": "prospect"}})
+    client.get("/api/conversations/not-a-uuid")
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+
+    route = "/api/conversations/{conversation_id}/message"
+
+    def delta(name, **labels):
+        return (sample(text, name, **labels) or 0) - (sample(before, name, **labels) or 0)
+
+    assert delta("onb1_http_request_duration_seconds_count", method="POST", route=route, status="201") == 2
+    assert delta("onb1_http_request_duration_seconds_count", method="GET", route="/api/conversations/{conversation_id}", status="422") == 1
+    assert delta("onb1_state_transitions_total", from_state="WELCOME", to_state="MODE_SELECT") == 1
+    assert delta("onb1_state_transitions_total", from_state="MODE_SELECT", to_state="IDENTITY") == 1
+    assert delta("onb1_store_lock_hold_seconds_count") >= 2
+    assert sample(text, "onb1_store_conversations", location="resident") == 1
+    assert sample(text, "onb1_store_messages") == 5
+    assert sample(text, "onb1_http_requests_in_flight", method="GET") == 1
+
+
+def test_every_family_initialises_the_shared_base():
+    registry = Registry()
+    callback = registry.callback("demo_depth", "Depth.", "gauge", lambda: [(("a",), 1)], ("queue",))
+    assert callback.header() == ["# HELP demo_depth Depth.", "# TYPE demo_depth gauge"]
+    assert callback.labelnames == ("queue",) and not hasattr(callback, "_children")
+    with pytest.raises(TypeError):
+        Metric("demo_abstract", "Abstract.")
@@ -0,0 +1,140 @@
+import threading
+import time
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+from pg_store import PostgresStore
+from store import ConversationStore
+
+
+def slow_apply_step(monkeypatch, delay=0.005):
+    # Widens the gap between reading a snapshot and committing it, so writers overlap.
+    original = main.apply_step
+
+    def apply_step(*args):
+        time.sleep(delay)
+        return original(*args)
+
+    monkeypatch.setattr(main, "apply_step", apply_step)
+
+
+def conflicts(outcome):
+    return main.CAS_CONFLICTS.labels(outcome).value
+
+
+def test_concurrent_posts_lose_no_updates(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    monkeypatch.setattr(main, "CAS_MAX_ATTEMPTS", 50)
+    slow_apply_step(monkeypatch)
+    conversation_id = main.create_conversation(main.CreateConversationRequest())["id"]
+    writers, posts = 6, 3
+    barrier = threading.Barrier(writers)
+    errors = []
+    retried = conflicts("retried")
+
+    def write(worker):
+        barrier.wait()
+        try:
+            for index in range(posts):
+                payload = main.CreateMessageRequest(fields={f"note_{worker}_{index}": "x"}, advance=False)
+                main.create_conversation_message(conversation_id, payload)
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=write, args=(worker,)) for worker in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    conversation = main.load_conversation(conversation_id)
+    fields = conversation["normalized_fields"]
+    assert {f"note_{worker}_{index}" for worker in range(writers) for index in range(posts)} <= fields.keys()
+    assert [message.seq for message in conversation["messages"]] == list(range(1, len(conversation["messages"]) + 1))
+    assert conflicts("retried") > retried
+
+
+def test_if_match_pins_the_version(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    client = TestClient(main.app)
+    response = client.post("/api/conversations", json={"mode": "prospect"})
+    created, etag = response.json(), response.headers["etag"]
+    url = f"/api/conversations/{created['id']}"
+    assert client.get(url).headers["etag"] == etag
+
+    first = client.post(f"{url}/message", json={"fields": {}}, headers={"If-Match": etag})
+    assert first.status_code == 201 and first.headers["etag"] != etag
+    assert first.headers["etag"] == client.get(url).headers["etag"]
+    assert first.json()["version"] == main._STORE.version(UUID(created["id"]))
+
+    stale = client.post(f"{url}/message", json={"fields": {"mode": "prospect"}}, headers={"If-Match": etag})
+    assert stale.status_code == 412 and stale.json()["detail"] == "version_mismatch"
+    assert stale.headers["etag"] == first.headers["etag"]
+    assert client.get(url).json()["state"] == "MODE_SELECT"
+
+    steps = client.post(f"{url}/steps", json={"steps": [{"fields": {"mode": "prospect"}}]}, headers={"If-Match": first.headers["etag"]})
+    assert steps.status_code == 201 and steps.json()["conversation"]["state"] == "IDENTITY"
+    assert client.post(f"{url}/end-and-send", json={}, headers={"If-Match": etag}).status_code == 412
+    assert client.post(f"{url}/end-and-send", json={}, headers={"If-Match": steps.headers["etag"]}).status_code == 200
+
+
+def test_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    monkeypatch.setattr(main, "CAS_MAX_ATTEMPTS", 2)
+    conversation_id = main.create_conversation(main.CreateConversationRequest())["id"]
+    original = main.apply_step
+
+    def apply_step_racing_another_writer(*args):
+        # Every attempt loses: another writer commits between the read and the commit.
+        with main._STORE.locked(conversation_id) as conversation:
+            main._STORE.journal(conversation, "set", {})
+        return original(*args)
+
+    monkeypatch.setattr(main, "apply_step", apply_step_racing_another_writer)
+    exhausted = conflicts("exhausted")
+    with pytest.raises(HTTPException) as error:
+        main.create_conversation_message(conversation_id, main.CreateMessageRequest(fields={"mode": "prospect"}))
+    assert error.value.status_code == 409 and error.value.detail == "conversation_conflict"
+    assert conflicts("exhausted") == exhausted + 1
+    assert main.load_conversation(conversation_id)["state"] == "WELCOME"
+
+
+def test_postgres_update_is_a_conditional_update():
+    executed = []
+
+    class Cursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_exc):
+            return False
+
+        def execute(self, query, params):
+            executed.append((query, params))
+
+        def fetchone(self):
+            return None
+
+    class Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_exc):
+            return False
+
+        def connection(self):
+            return self
+
+        def cursor(self):
+            return Cursor()
+
+    assert PostgresStore(Conn()).update(uuid4(), 7, {}, state="IDENTITY") is False
+    query, params = executed[0]
+    assert "version = version + 1" in query and query.endswith("AND version = %s RETURNING message_seq") and params[-1] == 7
+    # Lost the race: no messages are written.
+    assert len(executed) == 1
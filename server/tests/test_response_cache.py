@@ -0,0 +1,82 @@
+import json
+import threading
+from uuid import UUID
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+import main
+from response_cache import ResponseCache, etag_matches
+from store import ConversationStore
+
+
+def start(monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    monkeypatch.setattr(main, "_RESPONSES", ResponseCache())
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    return client, created["id"]
+
+
+def test_unchanged_conversation_is_served_from_cache_then_304(monkeypatch):
+    client, conversation_id = start(monkeypatch)
+    first = client.get(f"/api/conversations/{conversation_id}")
+    second = client.get(f"/api/conversations/{conversation_id}")
+    assert first.headers["etag"] == second.headers["etag"] and first.content == second.content
+
+    etag = first.headers["etag"]
+    cached = client.get(f"/api/conversations/{conversation_id}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.content == b""
+
+    client.post(f"/api/conversations/{conversation_id}/message", json={"fields": {}})
+    changed = client.get(f"/api/conversations/{conversation_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert len(changed.json()["messages"]) > len(first.json()["messages"])
+    stats = client.get("/api/admin/stats").json()["response_cache"]
+    assert (stats["hits"], stats["not_modified"]) == (1, 1)
+
+
+def test_cached_body_matches_the_jsonable_encoder_rendering(monkeypatch):
+    client, conversation_id = start(monkeypatch)
+    client.post(f"/api/conversations/{conversation_id}/message", json={"fields": {"mode": "prospect"}})
+    client.post(f"/api/conversations/{conversation_id}/end-and-send", json={"notes": "call back"})
+    body = client.get(f"/api/conversations/{conversation_id}").content
+    expected = JSONResponse(jsonable_encoder(main.to_conversation_model(main.load_conversation(UUID(conversation_id))))).body
+    assert json.loads(body) == json.loads(expected)
+
+
+def test_conditional_get_does_not_wait_for_a_busy_conversation(monkeypatch):
+    client, conversation_id = start(monkeypatch)
+    etag = client.get(f"/api/conversations/{conversation_id}").headers["etag"]
+    holding, release = threading.Event(), threading.Event()
+
+    def hold():
+        with main._STORE.locked(UUID(conversation_id)):
+            holding.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=hold)
+    worker.start()
+    holding.wait(5)
+    try:
+        assert client.get(f"/api/conversations/{conversation_id}", headers={"If-None-Match": etag}).status_code == 304
+        assert client.get(f"/api/conversations/{conversation_id}").headers["etag"] == etag
+    finally:
+        release.set()
+        worker.join()
+
+
+def test_audit_events_and_incremental_reads_leave_the_tag_alone(monkeypatch):
+    client, conversation_id = start(monkeypatch)
+    etag = client.get(f"/api/conversations/{conversation_id}").headers["etag"]
+    main.log_audit(UUID(conversation_id), "viewed")
+    assert main.AUDIT_PIPELINE.flush()
+    assert client.get(f"/api/conversations/{conversation_id}").headers["etag"] == etag
+    assert "etag" not in client.get(f"/api/conversations/{conversation_id}", params={"since": 1}).headers
+
+
+def test_if_none_match_lists_and_weak_tags():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"') and not etag_matches(None, '"b"')
@@ -1,11 +1,15 @@
 from uuid import uuid4
 
 import main
+from outbox import OutboxEntry
+from pg_store import PostgresStore
 
 
 class ClaimingCursor:
-    def __init__(self, claim_results):
+    def __init__(self, claim_results, statements, rows=()):
         self._claim_results = claim_results
+        self._statements = statements
+        self._rows = list(rows)
         self.rowcount = 0
 
     def __enter__(self):
@@ -14,34 +18,90 @@ class ClaimingCursor:
     def __exit__(self, exc_type, exc, tb):
         return False
 
-    def execute(self, sql, *_args, **_kwargs):
+    def execute(self, sql, params=()):
+        self._statements.append((sql, params))
         if "SET slack_post_id" in sql:
             self.rowcount = self._claim_results.pop(0)
         else:
             self.rowcount = 1
 
+    def fetchone(self):
+        sql = self._statements[-1][0]
+        if "RETURNING message_seq" in sql:
+            return {"message_seq": 1}
+        if "INSERT INTO intake_briefs" in sql:
+            return {"id": uuid4()}
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        return []
+
 
 class ClaimingConn:
-    def __init__(self, claim_results):
+    def __init__(self, claim_results, rows=()):
         self._claim_results = claim_results
+        self._rows = rows
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def connection(self):
+        return self
 
     def cursor(self):
-        return ClaimingCursor(self._claim_results)
+        return ClaimingCursor(self._claim_results, self.statements, self._rows)
+
+
+def end(conn, conversation_id):
+    handoff = main.slack_handoff(conversation_id, f"queued-{uuid4()}", {"summary": "hi"})
+    handoff["slack_delivery"] = "pending"
+    PostgresStore(conn).end(conversation_id, 1, {}, state="SUBMIT", brief={"summary": "hi"}, attachments=[], handoff=handoff)
+    return handoff["slack_post_id"]
 
 
-def test_maybe_post_slack_idempotent(monkeypatch):
-    sent = {"count": 0}
+def test_handoff_is_recorded_once(monkeypatch):
     conversation_id = uuid4()
+    sent = []
+    monkeypatch.setattr(main.SLACK_OUTBOX, "enqueue", lambda *args, **kwargs: sent.append(args))
 
-    def fake_send(_payload):
-        sent["count"] += 1
+    conn_first = ClaimingConn([1], rows=[{"id": conversation_id, "normalized_fields": {}}])
+    slack_post_id = end(conn_first, conversation_id)
+    inserts = [params for sql, params in conn_first.statements if sql.startswith("INSERT INTO slack_outbox")]
+    assert inserts == [(conversation_id, slack_post_id, inserts[0][2])]
 
-    monkeypatch.setattr(main, "send_slack_webhook", fake_send)
+    conn_second = ClaimingConn([0], rows=[{"id": conversation_id, "normalized_fields": {}}])
+    end(conn_second, conversation_id)
+    assert not any(sql.startswith("INSERT INTO slack_outbox") for sql, _params in conn_second.statements)
+    # Nothing is sent from inside the request's transaction; the poller claims the row after commit.
+    assert sent == []
+
+
+def test_outcomes_settle_by_slack_post_id(monkeypatch):
+    conversation_id = uuid4()
+    conn = ClaimingConn([], rows=[{"id": uuid4()}, {"id": conversation_id}])
+    monkeypatch.setattr(main, "_STORE", PostgresStore(conn))
+    entry = OutboxEntry("pending-abc", {"conversation_id": str(uuid4())}, tracked=True)
+    entry.status, entry.attempts = "delivered", 2
+    main.record_slack_outcome(entry)
+    (settle, settle_params), (posted, posted_params) = conn.statements
+    assert "WHERE slack_post_id = %s AND status = 'sending'" in settle and settle_params[-1] == "pending-abc"
+    # The payload's conversation_id is not trusted; the handoff's post id names the conversation.
+    assert posted.startswith("UPDATE conversations SET slack_posted_at") and posted_params == ("delivered", "pending-abc")
+    assert "WHERE slack_post_id = %s" in posted
 
-    conn_first = ClaimingConn([1])
-    main.maybe_post_slack(conn_first, conversation_id, {"summary": "hi"})
-    assert sent["count"] == 1
+    # A post from /api/handoff/slack settles its outbox row but no conversation.
+    standalone = ClaimingConn([], rows=[{"id": uuid4()}])
+    monkeypatch.setattr(main, "_STORE", PostgresStore(standalone))
+    published = []
+    monkeypatch.setattr(main._EVENTS, "publish", lambda *args: published.append(args))
+    main.record_slack_outcome(entry)
+    assert len(standalone.statements) == 2 and published == []
 
-    conn_second = ClaimingConn([0])
-    main.maybe_post_slack(conn_second, conversation_id, {"summary": "hi"})
-    assert sent["count"] == 1
+    unknown = ClaimingConn([])
+    monkeypatch.setattr(main, "_STORE", PostgresStore(unknown))
+    main.record_slack_outcome(entry)
+    assert len(unknown.statements) == 1
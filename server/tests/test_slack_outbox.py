@@ -0,0 +1,213 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from outbox import SlackOutbox
+
+
+class FakeSlack:
+    def __init__(self, statuses=None, delay=0.0):
+        self.statuses = list(statuses or [])
+        self.delay = delay
+        self.bodies = []
+        self.connections = set()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                fake.connections.add(self.client_address)
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                time.sleep(fake.delay)
+                status = fake.statuses.pop(0) if fake.statuses else 200
+                if status == 200:
+                    fake.bodies.append(json.loads(body))
+                self.send_response(status)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, *_args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/hook"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_slack():
+    servers = []
+
+    def factory(**kwargs):
+        server = FakeSlack(**kwargs)
+        servers.append(server)
+        return server
+
+    yield factory
+    for server in servers:
+        server.close()
+
+
+def test_outbox_delivers_over_keep_alive_connection(fake_slack):
+    slack = fake_slack()
+    outbox = SlackOutbox(slack.url, workers=1)
+    for index in range(5):
+        outbox.enqueue({"conversation_id": None, "n": index})
+    assert outbox.drain(5)
+    outbox.stop()
+    assert [body["n"] for body in slack.bodies] == [0, 1, 2, 3, 4]
+    assert len(slack.connections) == 1
+    assert outbox.stats()["delivered"] == 5
+
+
+def test_outbox_retries_then_dead_letters(fake_slack):
+    slack = fake_slack(statuses=[503, 200, 400, 500, 500])
+    settled = []
+    outbox = SlackOutbox(slack.url, workers=1, max_attempts=2, base_delay=0.01, on_settled=settled.append)
+    outbox.enqueue({"n": "retried"}, tracked=True)
+    assert outbox.drain(5)
+    outbox.enqueue({"n": "rejected"}, tracked=True)
+    assert outbox.drain(5)
+    outbox.enqueue({"n": "exhausted"}, tracked=True)
+    assert outbox.drain(5)
+    outbox.stop()
+
+    assert [body["n"] for body in slack.bodies] == ["retried"]
+    assert [entry.status for entry in settled] == ["delivered", "dead", "dead"]
+    dead = outbox.dead_letters()
+    assert [(item["payload"]["n"], item["attempts"]) for item in dead] == [("rejected", 1), ("exhausted", 2)]
+    assert outbox.stats()["retried"] == 2
+
+
+def test_end_and_send_does_not_wait_for_slack(fake_slack, monkeypatch):
+    slack = fake_slack(delay=1.0)
+    outbox = SlackOutbox(slack.url, workers=2, on_settled=main.record_slack_outcome)
+    monkeypatch.setattr(main, "SLACK_WEBHOOK_URL", slack.url)
+    monkeypatch.setattr(main, "SLACK_OUTBOX", outbox)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"participant_name": "Ada", "participant_email": "ada@example.com"}).json()
+
+    started = time.perf_counter()
+    response = client.post(f"/api/conversations/{created['id']}/end-and-send", json={"summary": "Ship it"})
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    assert response.json()["handoffQueued"] is True
+    assert elapsed < 0.5
+    assert outbox.drain(5)
+    outbox.stop()
+    assert slack.bodies[0]["conversation_id"] == created["id"]
+    assert main._STORE.snapshot(main.UUID(created["id"]))["slack_delivery"] == "delivered"
+
+
+def test_poller_delivers_only_claimed_rows(fake_slack):
+    slack = fake_slack()
+    rows = [("pending-1", {"n": 1}), ("pending-2", {"n": 2})]
+    claims, settled = [], []
+
+    def claim(limit):
+        claims.append(limit)
+        taken, rows[:] = rows[:limit], rows[limit:]
+        return taken
+
+    outbox = SlackOutbox(slack.url, workers=1, claim=claim, poll_interval=0.01, on_settled=settled.append)
+    outbox.start()
+    deadline = time.monotonic() + 5
+    while len(settled) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    outbox.enqueue({"n": "handoff"})
+    assert outbox.drain(5)
+    outbox.stop()
+    assert sorted(body["n"] for body in slack.bodies if body["n"] != "handoff") == [1, 2]
+    # Entries that were never stored are delivered but not reported back.
+    assert sorted(entry.id for entry in settled) == ["pending-1", "pending-2"]
+    assert max(claims) <= 2 and outbox.stats()["claimed"] == 2
+
+
+def test_handoffs_do_not_settle_other_conversations(fake_slack, monkeypatch):
+    slack = fake_slack()
+    outbox = SlackOutbox(slack.url, workers=1, on_settled=main.record_slack_outcome)
+    monkeypatch.setattr(main, "_STORE", main.ConversationStore())
+    monkeypatch.setattr(main, "SLACK_WEBHOOK_URL", slack.url)
+    monkeypatch.setattr(main, "SLACK_OUTBOX", outbox)
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={}).json()
+    record = main._STORE.snapshot(main.UUID(created["id"]))
+    assert record["slack_delivery"] is None
+
+    response = client.post("/api/handoff/slack", json={"conversation_id": created["id"], "brief": {"summary": "hi"}})
+    assert response.status_code == 202
+    assert outbox.drain(5)
+    outbox.stop()
+    assert len(slack.bodies) == 1
+    assert main._STORE.snapshot(main.UUID(created["id"]))["slack_delivery"] is None
+    with main._STORE.locked(main.UUID(created["id"])) as record:
+        assert record.slack_posts is None
+
+    missing = client.post("/api/handoff/slack", json={"conversation_id": str(main.uuid4()), "brief": {}})
+    assert missing.status_code == 404 and missing.json()["detail"] == "conversation_not_found"
+
+
+def test_handoff_posts_are_stored_before_they_are_sent(fake_slack, monkeypatch):
+    slack = fake_slack()
+    store = main.ConversationStore()
+    monkeypatch.setattr(main, "_STORE", store)
+    monkeypatch.setattr(main, "SLACK_WEBHOOK_URL", slack.url)
+    # A worker that accepts the post and dies before its outbox sends anything.
+    monkeypatch.setattr(main, "SLACK_OUTBOX", SlackOutbox(None))
+    client = TestClient(main.app)
+    conversation_id = main.UUID(client.post("/api/conversations", json={}).json()["id"])
+    response = client.post("/api/handoff/slack", json={"conversation_id": str(conversation_id), "brief": {"summary": "hi"}})
+    assert response.status_code == 202
+    post_id = response.json()["message_ts"]
+    with store.locked(conversation_id) as record:
+        assert list(record.slack_posts) == [post_id]
+        # The dead worker's lease runs out.
+        record.slack_posts[post_id]["lease_until"] = time.time() - 1
+
+    outbox = SlackOutbox(slack.url, workers=1, on_settled=main.record_slack_outcome)
+    monkeypatch.setattr(main, "SLACK_OUTBOX", outbox)
+    assert main.recover_slack_outbox() == 1
+    assert outbox.drain(5)
+    outbox.stop()
+    assert [body["brief"] for body in slack.bodies] == [{"summary": "hi"}]
+    with store.locked(conversation_id) as record:
+        assert record.slack_posts is None and record.slack_delivery is None
+
+
+def test_local_recovery_requeues_pending_handoffs_once(fake_slack, monkeypatch):
+    slack = fake_slack()
+    outbox = SlackOutbox(slack.url, workers=1, on_settled=main.record_slack_outcome)
+    store = main.ConversationStore()
+    monkeypatch.setattr(main, "_STORE", store)
+    monkeypatch.setattr(main, "SLACK_WEBHOOK_URL", slack.url)
+    monkeypatch.setattr(main, "SLACK_OUTBOX", outbox)
+    now = time.time()
+    conversations = []
+    # Left pending by a crashed worker (lease over), and one another worker still owns.
+    for lease in (now - 1, now + 60):
+        conversation = main.ConversationRecord(main.uuid4(), {})
+        conversation.slack_post_id = f"queued-{conversation.id}"
+        conversation.slack_payload = {"conversation_id": str(conversation.id), "brief": {}}
+        conversation.slack_delivery = "pending"
+        conversation.slack_lease_until = lease
+        store.insert(conversation)
+        conversations.append(conversation)
+
+    assert main.recover_slack_outbox() == 1
+    assert main.recover_slack_outbox() == 0
+    assert outbox.drain(5)
+    outbox.stop()
+    assert [body["conversation_id"] for body in slack.bodies] == [str(conversations[0].id)]
+    assert [conversation.slack_delivery for conversation in conversations] == ["delivered", "pending"]
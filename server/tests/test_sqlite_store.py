@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from records import ConversationRecord, MessageRecord
+from sqlite_store import SQLiteConfig, SQLiteStore
+
+WORKER = """
+import sys
+from fastapi.testclient import TestClient
+import main
+
+conversation_id, worker, steps = sys.argv[1], sys.argv[2], int(sys.argv[3])
+client = TestClient(main.app)
+for index in range(steps):
+    body = {"steps": [{"content": f"{worker}-{index}", "advance": False}]}
+    response = client.post(f"/api/conversations/{conversation_id}/steps", json=body)
+    assert response.status_code == 201, response.text
+"""
+
+
+def test_workers_share_one_consistent_store(monkeypatch, tmp_path):
+    path = tmp_path / "store.db"
+    monkeypatch.setattr(main, "_STORE", SQLiteStore(SQLiteConfig(path)))
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+
+    env = {**os.environ, "STORE_BACKEND": "sqlite", "STORE_SQLITE_PATH": str(path), "WAL_DIR": "", "STORE_SPILL_PATH": ""}
+    # Workers race on one conversation, so give the version-checked commits room to retry.
+    env["CAS_MAX_ATTEMPTS"] = "100"
+    workers, steps = 3, 8
+    app_dir = Path(main.__file__).parent
+    processes = [
+        subprocess.Popen([sys.executable, "-c", WORKER, created["id"], f"w{worker}", str(steps)], cwd=app_dir, env=env)
+        for worker in range(workers)
+    ]
+    assert [process.wait(120) for process in processes] == [0] * workers
+
+    conversation = client.get(f"/api/conversations/{created['id']}").json()
+    messages = conversation["messages"]
+    # Every worker's writes landed exactly once, in one gap-free sequence.
+    assert [message["seq"] for message in messages] == list(range(1, len(messages) + 1))
+    contents = [message["content"] for message in messages if message["role"] == "user"]
+    assert sorted(contents) == sorted(f"w{worker}-{index}" for worker in range(workers) for index in range(steps))
+    for worker in range(workers):
+        assert [content for content in contents if content.startswith(f"w{worker}-")] == [f"w{worker}-{index}" for index in range(steps)]
+    main._STORE.close()
+
+
+def test_a_write_in_one_worker_is_visible_to_the_next_request_in_another(monkeypatch, tmp_path):
+    first, second = (SQLiteStore(SQLiteConfig(tmp_path / "store.db")) for _ in range(2))
+    client = TestClient(main.app)
+    monkeypatch.setattr(main, "_STORE", first)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    etag = client.get(f"/api/conversations/{created['id']}").headers["etag"]
+
+    monkeypatch.setattr(main, "_STORE", second)
+    assert client.get(f"/api/conversations/{created['id']}", headers={"If-None-Match": etag}).status_code == 304
+    client.post(f"/api/conversations/{created['id']}/message", json={"fields": {"mode": "prospect"}})
+
+    monkeypatch.setattr(main, "_STORE", first)
+    response = client.get(f"/api/conversations/{created['id']}", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.headers["etag"] != etag
+    assert response.json()["state"] == "MODE_SELECT"
+    assert first.stats()["resident"] == 1 and first.version(UUID(created["id"])) == second.version(UUID(created["id"]))
+    first.close()
+    second.close()
+
+
+def test_failed_handlers_roll_back_and_nested_locks_share_a_transaction(tmp_path):
+    store = SQLiteStore(SQLiteConfig(tmp_path / "store.db"))
+    conversation = ConversationRecord(uuid4(), {})
+    store.insert(conversation)
+    with pytest.raises(RuntimeError):
+        with store.locked(conversation.id) as record:
+            record.set_state("IDENTITY")
+            store.journal(record, "set", record.changes("state"))
+            raise RuntimeError("handler failed")
+    assert store.snapshot(conversation.id)["state"] == "WELCOME" and store.version(conversation.id) == 1
+
+    with store.locked(conversation.id) as outer:
+        assert store.append_messages(conversation.id, [MessageRecord(uuid4(), "user", "hi")]) == 1
+        # The nested call saw and changed the same record; nothing is committed yet.
+        assert len(outer.messages) == 1 and store.snapshot(conversation.id)["message_seq"] == 1
+    assert store.version(conversation.id) == 2 and store.stats()["resident_messages"] == 1
+    with pytest.raises(KeyError):
+        with store.locked(uuid4()):
+            pass
+    with pytest.raises(RuntimeError):
+        store.journal(conversation, "set")
+    store.close()
@@ -1,10 +1,10 @@
-import json
 from uuid import uuid4
 
 import pytest
 from fastapi import HTTPException
 
 import main
+from state_machine import StateMachine
 
 
 def test_next_state_sequence():
@@ -34,50 +34,29 @@ def test_end_and_send_forces_submit(monkeypatch):
     old_row = {
         "id": conversation_id,
         "state": "NEEDS",
-        "normalized_fields": json.dumps({"summary": "Draft"}),
+        "normalized_fields": {"summary": "Draft"},
+        "version": 3,
     }
-    updated_row = {
-        "id": conversation_id,
-        "state": "SUBMIT",
-        "normalized_fields": json.dumps({"summary": "Done"}),
-    }
-    fetch_rows = [old_row, updated_row]
-
-    class FakeCursor:
-        def __enter__(self):
-            return self
-
-        def __exit__(self, exc_type, exc, tb):
-            return False
 
-        def execute(self, *_args, **_kwargs):
-            return None
+    class FakeStore:
+        epoch = "test"
 
-    class FakeConn:
-        def __enter__(self):
-            return self
+        def __init__(self):
+            self.ended = []
 
-        def __exit__(self, exc_type, exc, tb):
-            return False
+        def snapshot(self, _id, since=0):
+            return dict(old_row, normalized_fields=dict(old_row["normalized_fields"]))
 
-        def cursor(self):
-            return FakeCursor()
+        def end(self, _id, expected_version, fields, *, state, brief, attachments, handoff):
+            self.ended.append((expected_version, state, handoff["slack_payload"]["brief"] is brief))
+            return {"id": conversation_id, "state": state, "normalized_fields": fields, "version": 4, "slack_post_id": None}
 
-    def fake_fetch(_conn, _id):
-        return fetch_rows.pop(0)
-
-    calls = {"slack": 0, "audit": 0}
-
-    monkeypatch.setattr(main, "get_conn", lambda: FakeConn())
-    monkeypatch.setattr(main, "fetch_conversation", fake_fetch)
-    monkeypatch.setattr(main, "persist_intake_brief", lambda *_a, **_k: uuid4())
-    monkeypatch.setattr(main, "persist_attachments", lambda *_a, **_k: None)
+    calls = {"audit": 0}
+    store = FakeStore()
+    monkeypatch.setattr(main, "_STORE", store)
     monkeypatch.setattr(
         main, "log_audit", lambda *_a, **_k: calls.__setitem__("audit", calls["audit"] + 1)
     )
-    monkeypatch.setattr(
-        main, "maybe_post_slack", lambda *_a, **_k: calls.__setitem__("slack", calls["slack"] + 1)
-    )
     monkeypatch.setattr(main, "to_conversation_model", lambda row: row)
 
     response = main.end_and_send(
@@ -85,5 +64,66 @@ def test_end_and_send_forces_submit(monkeypatch):
     )
 
     assert response["state"] == "SUBMIT"
-    assert calls["slack"] == 1
+    assert response["normalized_fields"]["summary"] == "Done"
+    # The handoff is committed with the state change, carrying the brief it announces.
+    assert store.ended == [(3, "SUBMIT", True)]
     assert calls["audit"] == 1
+
+
+def test_validation_reports_every_failure_in_one_pass():
+    with pytest.raises(HTTPException) as excinfo:
+        main.validate_required_fields("IDENTITY", {"email": "not-an-email"})
+    detail = excinfo.value.detail
+    assert detail["error"] == "missing_fields"
+    assert detail["fields"] == ["full_name"]
+    assert detail["errors"] == [
+        {"error": "missing_fields", "fields": ["full_name"]},
+        {"error": "invalid_email", "field": "email"},
+    ]
+
+    with pytest.raises(HTTPException) as excinfo:
+        main.validate_required_fields("IDENTITY", {"full_name": "Ada", "email": "nope"})
+    assert excinfo.value.detail["error"] == "invalid_email"
+
+
+def test_engine_is_driven_by_the_json_spec():
+    spec = {
+        "states": [
+            {"name": "START", "required_fields": ["choice"], "prompt": "Pick"},
+            {"name": "LEFT", "prompt": "Left"},
+            {"name": "RIGHT", "rules": ["a=yes OR b+c"], "prompt": "Right"},
+            {"name": "DONE", "prompt": "Done"},
+        ],
+        "transitions": [
+            {"from": "START", "to": "LEFT", "when": "choice=left"},
+            {"from": "START", "to": "RIGHT", "when": "choice=right"},
+            {"from": "RIGHT", "to": "DONE", "skip_if": "fast == true"},
+            {"from": "RIGHT", "to": "LEFT", "when_skipped": "fast == true"},
+            {"from": "LEFT", "to": "RIGHT", "when": "x=1 OR y+z"},
+            {"from": "LEFT", "to": "DONE"},
+        ],
+        "end_and_send": {"to": "DONE"},
+    }
+    machine = StateMachine(spec)
+    assert machine.next_state("START", {"choice": "RIGHT"}) == "RIGHT"
+    assert machine.next_state("START", {"choice": "other"}) == "LEFT"
+    assert machine.next_state("RIGHT", {"fast": "yes"}) == "LEFT"
+    assert machine.next_state("RIGHT", {}) == "DONE"
+    assert machine.next_state("LEFT", {}) == "DONE"
+    assert machine.next_state("LEFT", {"y": "1", "z": "2"}) == "RIGHT"
+    assert machine.next_state("DONE", {}) == "DONE"
+    assert machine.validate("RIGHT", {"a": "yes"}) is None
+    assert machine.validate("RIGHT", {"b": "1"}).missing == ["c"]
+
+    with pytest.raises(ValueError):
+        StateMachine({"states": [{"name": "A"}], "transitions": [{"from": "A", "to": "B"}]})
+
+
+def test_prompts_and_step_responses_come_from_the_spec():
+    assert main.prompt_for_state("MODE_SELECT", {}) == "Are you a new prospect or an existing client?"
+    assert main.prompt_for_state("SUBMIT", {"mode": "client"}).startswith("Existing-client intake")
+    assert main.prompt_for_state("SUMMARY", {"full_name": "Ada"}).endswith("\n\nName: Ada")
+    assert main.summarize_step_response("MODE_SELECT", {"mode": "client"}) == "Existing client"
+    assert main.summarize_step_response("IDENTITY", {"full_name": "Ada", "email": "a@b.co"}) == "Ada | a@b.co"
+    assert main.summarize_step_response("SCHEDULING", {}) == "Skipped scheduling"
+    assert main.summarize_step_response("SUMMARY", {"full_name": "Ada"}) == "Name: Ada"
@@ -0,0 +1,360 @@
+import threading
+import time
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from pg_store import PostgresStore
+from records import ConversationRecord, MessageRecord
+from store import ConversationStore, SpillFile, StoreLimits
+
+
+def make_conversation():
+    return ConversationRecord(uuid4(), {})
+
+
+def test_locked_raises_for_unknown_conversation():
+    store = ConversationStore()
+    with pytest.raises(KeyError):
+        with store.locked(uuid4()):
+            pass
+    with store.locked(uuid4(), missing_ok=True) as conversation:
+        assert conversation is None
+
+
+def test_busy_conversation_does_not_block_others():
+    store = ConversationStore()
+    slow, fast = make_conversation(), make_conversation()
+    store.insert(slow)
+    store.insert(fast)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold_slow():
+        with store.locked(slow.id):
+            holding.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=hold_slow)
+    worker.start()
+    try:
+        assert holding.wait(5)
+        done = threading.Event()
+
+        def write_fast():
+            with store.locked(fast.id) as conversation:
+                conversation.set_state("MODE_SELECT")
+            assert store.snapshot(fast.id)["state"] == "MODE_SELECT"
+            done.set()
+
+        threading.Thread(target=write_fast).start()
+        assert done.wait(1)
+    finally:
+        release.set()
+        worker.join()
+
+
+def test_snapshot_copies_message_list():
+    store = ConversationStore()
+    conversation = make_conversation()
+    store.insert(conversation)
+    row = store.snapshot(conversation.id)
+    row["messages"].append({"content": "hi"})
+    assert conversation.messages == []
+
+
+def test_records_round_trip_to_api_shape():
+    conversation = make_conversation()
+    message = MessageRecord(uuid4(), "user", "hello", attachments=[{"file_url": "https://files.local/a.pdf"}])
+    store = ConversationStore()
+    store.insert(conversation)
+    store.append_messages(conversation.id, [message, MessageRecord(uuid4(), "assistant", "hi")])
+
+    model = main.to_conversation_model(store.snapshot(conversation.id))
+    first, second = model["messages"]
+    assert first["id"] == message.id and first["conversation_id"] == conversation.id
+    assert first["created_at"] == message.created_at and first["created_at"].tzinfo is not None
+    assert (first["seq"], first["role"], first["content"]) == (1, "user", "hello")
+    assert first["attachments"] == [{"file_url": "https://files.local/a.pdf"}]
+    assert second["attachments"] == []
+    assert model["message_seq"] == 2
+    assert conversation.audit_log is None
+
+
+def test_http_flow_uses_store():
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    response = client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}})
+    assert response.status_code == 201
+    fetched = client.get(f"/api/conversations/{created['id']}").json()
+    assert fetched["state"] == "MODE_SELECT"
+    assert len(fetched["messages"]) == 3
+    assert client.get(f"/api/conversations/{uuid4()}").status_code == 404
+
+
+def test_rows_carry_decoded_fields_in_both_backends():
+    store = ConversationStore()
+    conversation = ConversationRecord(uuid4(), {"mode": "prospect"})
+    store.insert(conversation)
+    assert store.snapshot(conversation.id)["normalized_fields"] == {"mode": "prospect"}
+
+    class Cursor:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_exc):
+            return False
+
+        def execute(self, *_args):
+            pass
+
+        def fetchone(self):
+            return {"id": conversation.id, "normalized_fields": {"mode": " prospect ", "email": "", "vip": True}}
+
+        def fetchall(self):
+            return []
+
+    class Conn:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_exc):
+            return False
+
+        def connection(self):
+            return self
+
+        def cursor(self):
+            return Cursor()
+
+    row = PostgresStore(Conn()).snapshot(conversation.id)
+    assert row["normalized_fields"] == {"mode": "prospect", "vip": "true"}
+    assert main.to_conversation_model(row)["normalized_fields"] is row["normalized_fields"]
+
+
+def test_since_cursor_returns_only_new_messages():
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    assert created["message_seq"] == 1
+    assert created["messages"][0]["seq"] == 1
+
+    stepped = client.post(
+        f"/api/conversations/{created['id']}/message",
+        params={"since": created["message_seq"]},
+        json={"fields": {}},
+    ).json()
+    assert [message["seq"] for message in stepped["messages"]] == [2, 3]
+    assert stepped["message_seq"] == 3
+
+    unchanged = client.get(f"/api/conversations/{created['id']}", params={"since": 3}).json()
+    assert unchanged["messages"] == []
+    assert unchanged["message_seq"] == 3
+    full = client.get(f"/api/conversations/{created['id']}").json()
+    assert [message["seq"] for message in full["messages"]] == [1, 2, 3]
+
+
+def test_batch_steps_match_sequential_posts():
+    client = TestClient(main.app)
+    steps = [
+        {"fields": {}},
+        {"fields": {"mode": "prospect"}},
+        {"fields": {"full_name": "Ada Lovelace", "email": "ada@example.com"}},
+        {"fields": {"business_name": "Analytical Engines"}},
+        {"fields": {"needs_summary": "Automate intake", "skip_scheduling": True}},
+    ]
+    sequential = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    for step in steps:
+        assert client.post(f"/api/conversations/{sequential['id']}/message", json=step).status_code == 201
+    expected = client.get(f"/api/conversations/{sequential['id']}").json()
+
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    response = client.post(f"/api/conversations/{created['id']}/steps", json={"steps": steps})
+    assert response.status_code == 201
+    body = response.json()
+    assert body["applied"] == len(steps)
+    assert body["failed_step"] is None
+    batched = body["conversation"]
+    assert batched["state"] == expected["state"] == "SUMMARY"
+    assert batched["normalized_fields"] == expected["normalized_fields"]
+    assert [m["content"] for m in batched["messages"]] == [m["content"] for m in expected["messages"]]
+    assert [m["seq"] for m in batched["messages"]] == list(range(1, len(expected["messages"]) + 1))
+
+
+def test_batch_steps_report_failing_step_and_keep_prefix():
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    steps = [
+        {"fields": {}},
+        {"fields": {"mode": "prospect"}},
+        {"fields": {"full_name": "Ada Lovelace", "email": "not-an-email"}},
+        {"fields": {"business_name": "Analytical Engines"}},
+    ]
+    body = client.post(f"/api/conversations/{created['id']}/steps", json={"steps": steps}).json()
+    assert body["applied"] == 2
+    assert body["failed_step"]["index"] == 2
+    assert body["failed_step"]["state"] == "IDENTITY"
+    assert body["failed_step"]["error"] == "invalid_email"
+    assert body["conversation"]["state"] == "IDENTITY"
+    assert client.get(f"/api/conversations/{created['id']}").json()["state"] == "IDENTITY"
+
+    assert client.post(f"/api/conversations/{uuid4()}/steps", json={"steps": steps}).status_code == 404
+    assert client.post(f"/api/conversations/{created['id']}/steps", json={"steps": []}).status_code == 422
+
+
+def test_lru_eviction_spills_and_faults_back_in(tmp_path):
+    store = ConversationStore(StoreLimits(max_entries=2), SpillFile(tmp_path / "spill.sqlite3"))
+    first, second, third = make_conversation(), make_conversation(), make_conversation()
+    store.insert(first)
+    store.insert(second)
+    store.append_messages(first.id, [MessageRecord(uuid4(), "user", "hello")])
+    store.insert(third)
+
+    # `second` was least recently used, so it is the one written to disk.
+    assert set(store.ids()) == {first.id, third.id}
+    assert second.id in store
+    assert store.stats()["spilled"] == 1
+
+    row = store.snapshot(second.id)
+    assert row["id"] == second.id
+    assert second.id in store.ids() and len(store) == 2
+    stats = store.stats()
+    # The faulted-in copy stays on disk until the next eviction replaces it.
+    assert (stats["faults"], stats["evictions"], stats["spilled"]) == (1, 2, 2)
+    assert store.snapshot(first.id)["messages"][0].content == "hello"
+
+
+def test_slow_fault_in_does_not_block_other_lookups(tmp_path):
+    spill = SpillFile(tmp_path / "spill.sqlite3")
+    store = ConversationStore(StoreLimits(max_entries=1), spill)
+    cold, hot = make_conversation(), make_conversation()
+    store.insert(cold)
+    store.insert(hot)
+
+    reading, release, reads = threading.Event(), threading.Event(), []
+    get = spill.get
+
+    def slow_get(conversation_id):
+        reads.append(conversation_id)
+        reading.set()
+        release.wait(5)
+        return get(conversation_id)
+
+    spill.get = slow_get
+    rows = []
+    faulting = [threading.Thread(target=lambda: rows.append(store.snapshot(cold.id))) for _ in range(2)]
+    for thread in faulting:
+        thread.start()
+    assert reading.wait(5)
+    # The spill read is in progress; the resident conversation is still served.
+    started = time.monotonic()
+    assert store.snapshot(hot.id)["id"] == hot.id
+    assert time.monotonic() - started < 1
+    release.set()
+    for thread in faulting:
+        thread.join(5)
+    assert [row["id"] for row in rows] == [cold.id, cold.id]
+    assert reads == [cold.id] and store.stats()["faults"] == 1
+
+
+def test_ttl_expires_ended_before_idle_and_skips_held_conversations(tmp_path):
+    store = ConversationStore(StoreLimits(ended_ttl=10, idle_ttl=100), SpillFile(tmp_path / "spill.sqlite3"))
+    ended, active, held = make_conversation(), make_conversation(), make_conversation()
+    ended.set_status("ended")
+    held.set_status("ended")
+    for conversation in (ended, active, held):
+        store.insert(conversation)
+
+    now = time.monotonic()
+    with store.locked(held.id):
+        holder = threading.Thread(target=lambda: store.sweep(now + 50))
+        holder.start()
+        holder.join()
+    assert set(store.ids()) == {active.id, held.id}
+    assert store.sweep(now + 200) == 2
+    assert len(store) == 0 and store.stats()["expirations"] == 3
+    assert store.snapshot(active.id)["status"] == "active"
+
+
+def test_without_spill_file_only_ended_conversations_are_dropped():
+    store = ConversationStore(StoreLimits(max_bytes=1))
+    removed = []
+    store.on_removed = removed.append
+    first, second, ended = make_conversation(), make_conversation(), make_conversation()
+    store.insert(first)
+    store.insert(second)
+    # Over the limit, but live conversations have nowhere to go, so they stay.
+    assert set(store.ids()) == {first.id, second.id} and store.stats()["dropped"] == 0
+    ended.set_status("ended")
+    store.insert(ended)
+    store.insert(make_conversation())
+    assert ended.id not in store.ids() and store.snapshot(ended.id) is None
+    assert first.id in store.ids() and store.stats()["dropped"] == 1
+    store.remove(second.id)
+    assert removed == [ended.id, second.id]
+
+
+def test_spill_writes_do_not_hold_the_map_lock(tmp_path):
+    spill = SpillFile(tmp_path / "spill.sqlite3")
+    store = ConversationStore(StoreLimits(max_entries=2), spill)
+    cold, warm = make_conversation(), make_conversation()
+    store.insert(cold)
+    store.insert(warm)
+
+    writing, release = threading.Event(), threading.Event()
+    put_many = spill.put_many
+
+    def slow_put_many(records):
+        writing.set()
+        release.wait(5)
+        put_many(records)
+
+    spill.put_many = slow_put_many
+    inserter = threading.Thread(target=lambda: store.insert(make_conversation()))
+    inserter.start()
+    assert writing.wait(5)
+    started = time.monotonic()
+    assert store.snapshot(warm.id)["id"] == warm.id
+    assert store.stats()["resident"] == 2
+    assert time.monotonic() - started < 1
+    # A lookup of the conversation being written waits for that write, then faults it in.
+    rows = []
+    reader = threading.Thread(target=lambda: rows.append(store.snapshot(cold.id)))
+    reader.start()
+    reader.join(0.2)
+    assert not rows
+    release.set()
+    inserter.join(5)
+    reader.join(5)
+    assert rows[0]["id"] == cold.id and store.stats()["faults"] == 1
+
+
+def test_get_conversation_faults_spilled_conversation(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "_STORE", ConversationStore(StoreLimits(max_entries=1), SpillFile(tmp_path / "spill.sqlite3")))
+    client = TestClient(main.app)
+    cold = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    client.post("/api/conversations", json={"mode": "prospect"})
+    assert client.get("/api/admin/stats").json()["store"]["spilled"] == 1
+
+    response = client.post(f"/api/conversations/{cold['id']}/message", json={"fields": {}})
+    assert response.status_code == 201
+    assert response.json()["state"] == "MODE_SELECT"
+    assert client.get("/api/admin/stats").json()["store"]["faults"] >= 1
+
+
+def test_batch_steps_report_steps_after_submit():
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "client"}).json()
+    url = f"/api/conversations/{created['id']}/steps"
+    steps = [{"fields": {}}, {"fields": {"mode": "client"}}, {"content": "late"}, {"content": "later"}]
+    response = client.post(url, json={"steps": steps})
+    body = response.json()
+    assert response.status_code == 201 and body["applied"] == 2 and body["conversation"]["state"] == "SUBMIT"
+    assert body["skipped"] == {"index": 2, "count": 2, "reason": "conversation_submitted"}
+    assert "late" not in [message["content"] for message in body["conversation"]["messages"]]
+
+    # Nothing applied: no 201.
+    response = client.post(url, json={"steps": [{"content": "again"}]})
+    assert response.status_code == 200 and response.json()["applied"] == 0
+    assert response.json()["skipped"] == {"index": 0, "count": 1, "reason": "conversation_submitted"}
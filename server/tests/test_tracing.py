@@ -0,0 +1,139 @@
+import json
+import logging
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import main
+from db import TracedCursor
+from store import ConversationStore
+from tracing import Span, Trace, TraceExporter, Tracer, span
+
+
+def names(node):
+    return [child["name"] for child in node.get("children", [])]
+
+
+def start(monkeypatch, **settings):
+    monkeypatch.setattr(main, "_STORE", ConversationStore())
+    for key, value in settings.items():
+        monkeypatch.setattr(main.TRACER, key, value)
+    return TestClient(main.app)
+
+
+def test_end_and_send_trace_has_a_span_per_stage(monkeypatch):
+    client = start(monkeypatch, sample_rate=1.0)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    response = client.post(
+        f"/api/conversations/{created['id']}/end-and-send",
+        json={"notes": "call me"},
+        headers={"X-Request-ID": "trace-end-and-send"},
+    )
+    assert response.status_code == 200 and response.headers["x-request-id"] == "trace-end-and-send"
+
+    trace = client.get("/api/admin/traces/trace-end-and-send").json()
+    assert trace["name"] == "POST /api/conversations/{conversation_id}/end-and-send"
+    assert trace["sampled"] is True and trace["slow"] is False
+    assert names(trace["spans"]) == [
+        "resolve_attachments",
+        "fetch",
+        "build_summary",
+        "build_intake_brief",
+        "end_conversation",
+        "log_audit",
+    ]
+    stages = trace["spans"]["children"]
+    assert all(stage["start_ms"] >= 0 and stage["duration_ms"] >= 0 for stage in stages)
+    assert [stage["start_ms"] for stage in stages] == sorted(stage["start_ms"] for stage in stages)
+    listed = client.get("/api/admin/traces", params={"limit": 5}).json()["traces"]
+    assert "trace-end-and-send" in [record["request_id"] for record in listed]
+
+
+def test_unsampled_requests_get_an_id_but_no_trace(monkeypatch):
+    client = start(monkeypatch, sample_rate=0.0, slow_ms=0.0)
+    response = client.get("/health")
+    request_id = response.headers["x-request-id"]
+    assert len(request_id) == 32
+    assert client.get(f"/api/admin/traces/{request_id}").status_code == 404
+
+
+def test_slow_requests_are_dumped_with_their_span_tree(monkeypatch, caplog):
+    client = start(monkeypatch, sample_rate=0.0, slow_ms=0.001)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    with caplog.at_level(logging.WARNING, logger="tracing"):
+        client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}}, headers={"X-Request-ID": "slow-one"})
+
+    trace = client.get("/api/admin/traces/slow-one").json()
+    assert trace["slow"] is True and trace["sampled"] is False
+    assert names(trace["spans"]) == ["fetch", "apply_step", "commit", "refetch"]
+    assert any("slow-one" in record.getMessage() and '"apply_step"' in record.getMessage() for record in caplog.records)
+    slow_ids = [record["request_id"] for record in client.get("/api/admin/traces", params={"slow": True}).json()["traces"]]
+    assert "slow-one" in slow_ids
+
+
+def test_traces_are_exported_as_jsonl(tmp_path):
+    tracer = Tracer(sample_rate=1.0, ring_size=2, export_path=str(tmp_path / "traces" / "spans.jsonl"))
+    for index in range(3):
+        trace = tracer.begin("job", f"req-{index}")
+        with trace.root, span("stage", index=index):
+            pass
+        tracer.finish(trace)
+    tracer.close()
+
+    lines = [json.loads(line) for line in (tmp_path / "traces" / "spans.jsonl").read_text().splitlines()]
+    assert [line["request_id"] for line in lines] == ["req-0", "req-1", "req-2"]
+    stage = lines[2]["spans"]["children"][0]
+    assert (stage["name"], stage["attrs"]) == ("stage", {"index": 2})
+    assert [record["request_id"] for record in tracer.recent()] == ["req-2", "req-1"]
+    assert tracer.stats()["exported"] == 3
+
+
+def test_export_happens_off_the_finishing_thread(tmp_path, monkeypatch):
+    release, writers = threading.Event(), []
+    write = TraceExporter._write
+
+    def slow_write(self, lines):
+        writers.append(threading.current_thread().name)
+        release.wait(5)
+        return write(self, lines)
+
+    monkeypatch.setattr(TraceExporter, "_write", slow_write)
+    tracer = Tracer(sample_rate=1.0, export_path=str(tmp_path / "spans.jsonl"), export_buffer=2)
+    started = time.perf_counter()
+    for index in range(4):
+        trace = tracer.begin("job", f"req-{index}")
+        with trace.root:
+            pass
+        tracer.finish(trace)
+    assert time.perf_counter() - started < 1
+    release.set()
+    tracer.close()
+
+    assert writers and set(writers) == {"trace-exporter"}
+    exported = [json.loads(line)["request_id"] for line in (tmp_path / "spans.jsonl").read_text().splitlines()]
+    stats = tracer.stats()
+    assert stats["exported"] == len(exported) and stats["exported"] + stats["export_dropped"] == 4
+    assert exported[0] == "req-0"
+
+
+def test_db_statements_become_spans_while_tracing():
+    class FakeCursor:
+        def __init__(self):
+            self.executed = []
+
+        def execute(self, query, params=None):
+            self.executed.append(query)
+
+        def fetchone(self):
+            return {"id": 1}
+
+    assert span("outside").__class__ is not Span
+    trace = Trace("db", "request", sampled=True)
+    fake = FakeCursor()
+    with trace.root:
+        cursor = TracedCursor(fake)
+        cursor.execute("SELECT *\n  FROM conversations WHERE id = %s", (1,))
+        assert cursor.fetchone() == {"id": 1}
+    assert fake.executed and trace.root.children[0].name == "db.execute"
+    assert trace.root.children[0].attrs == {"statement": "SELECT * FROM conversations"}
@@ -0,0 +1,192 @@
+import hashlib
+import time
+from urllib.parse import urlsplit
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from pg_store import attachment_row
+from store import ConversationStore
+from uploads import LocalUploads, UploadConfig
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "_UPLOADS", LocalUploads(UploadConfig(tmp_path, chunk_bytes=4)))
+    return TestClient(main.app)
+
+
+def presign(client, content_length=None, content_type="text/plain"):
+    body = {"file_name": "../notes.txt", "content_type": content_type, "content_length": content_length}
+    response = client.post("/api/uploads/presign", json=body)
+    assert response.status_code == 201
+    links = response.json()
+    return urlsplit(links["upload_url"]).path, urlsplit(links["file_url"]).path
+
+
+def test_secret_is_owner_only(tmp_path):
+    LocalUploads(UploadConfig(tmp_path)).close()
+    assert (tmp_path / ".secret").stat().st_mode & 0o777 == 0o600
+
+
+def test_upload_then_download_with_ranges(client):
+    upload, download = presign(client, content_length=10)
+    assert download.endswith("/notes.txt")
+    assert client.get(download).status_code == 404
+
+    put = client.put(upload, content=b"0123456789", headers={"Content-Type": "text/plain"})
+    assert put.status_code == 201 and put.json()["size_bytes"] == 10
+    assert client.put(upload, content=b"0123456789").json()["detail"] == "upload_complete"
+
+    full = client.get(download)
+    assert full.status_code == 200 and full.content == b"0123456789"
+    assert full.headers["accept-ranges"] == "bytes" and full.headers["content-type"].startswith("text/plain")
+    ranged = client.get(download, headers={"Range": "bytes=2-5"})
+    assert ranged.status_code == 206 and ranged.content == b"2345"
+    assert ranged.headers["content-range"] == "bytes 2-5/10"
+    assert client.get(download, headers={"Range": "bytes=-3"}).content == b"789"
+    assert client.get(download, headers={"Range": "bytes=7-"}).content == b"789"
+    unsatisfiable = client.get(download, headers={"Range": "bytes=10-"})
+    assert unsatisfiable.status_code == 416 and unsatisfiable.headers["content-range"] == "bytes */10"
+
+
+def test_interrupted_uploads_resume_from_the_stored_offset(client):
+    upload, download = presign(client, content_length=10)
+    first = client.put(upload, content=b"0123", headers={"Content-Range": "bytes 0-3/10"})
+    assert first.status_code == 202 and first.headers["upload-offset"] == "4"
+    assert client.head(upload).headers["upload-offset"] == "4"
+
+    gap = client.put(upload, content=b"6789", headers={"Content-Range": "bytes 6-9/10"})
+    assert gap.status_code == 416 and gap.headers["upload-offset"] == "4"
+    # A whole-file PUT whose Content-Length disagrees with the presign is refused unread.
+    short = client.put(upload, content=b"0123456")
+    assert short.status_code == 400 and short.json()["detail"] == "content_length_mismatch"
+    assert client.head(upload).headers["upload-offset"] == "4"
+
+    rest = client.put(upload, content=b"456789", headers={"Content-Range": "bytes 4-9/10"})
+    assert rest.status_code == 201
+    head = client.head(upload)
+    assert (head.headers["upload-offset"], head.headers["upload-complete"]) == ("10", "1")
+    assert client.get(download).content == b"0123456789"
+
+
+def test_tokens_and_lengths_are_enforced(client):
+    upload, download = presign(client, content_length=4)
+    oversized = client.put(upload, content=b"0123456789", headers={"Content-Range": "bytes 0-9/4"})
+    assert oversized.status_code == 400
+    assert client.put(upload, content=b"01234").status_code == 400
+    assert client.put(upload, content=b"01", headers={"Content-Range": "bytes 0-3/4"}).status_code == 400
+    assert client.head(upload).headers["upload-offset"] == "0"
+    assert client.put(upload, content=b"0123", headers={"Content-Type": "image/png"}).status_code == 415
+
+    # The read-only token in file_url cannot write, probe or delete the upload, nor the reverse.
+    read_token = download.split("/")[-2]
+    assert client.put(f"/api/uploads/local/{read_token}", content=b"0123").json()["detail"] == "invalid_upload_token"
+    assert client.head(f"/api/uploads/local/{read_token}").status_code == 403
+    assert client.delete(f"/api/uploads/local/{read_token}").status_code == 403
+    assert client.get(f"{upload}/notes.txt").status_code == 403
+    tampered = upload[:-2] + ("AA" if not upload.endswith("AA") else "BB")
+    assert client.put(tampered, content=b"0123").status_code == 403
+    record = main._UPLOADS.verify(upload.rsplit("/", 1)[1])
+    expired = main._UPLOADS.sign(record.id, int(time.time()) - 1)
+    assert client.put(f"/api/uploads/local/{expired}", content=b"0123").json()["detail"] == "upload_token_expired"
+
+    unbounded, _ = presign(client)
+    main._UPLOADS.config.max_bytes = 8
+    too_large = client.put(unbounded, content=b"x" * 9)
+    assert too_large.status_code == 413 and client.head(unbounded).headers["upload-offset"] == "0"
+    assert client.put(unbounded, content=b"0", headers={"Content-Length": "one"}).json()["detail"] == "invalid_content_length"
+    assert client.put(unbounded, content=b"0123", headers={"Content-Range": "bytes 0-3/6"}).status_code == 202
+    # The first range fixed the length; a later chunk cannot change it.
+    assert client.put(unbounded, content=b"4567", headers={"Content-Range": "bytes 4-7/8"}).status_code == 400
+    assert client.head(unbounded).headers["upload-length"] == "6"
+    assert client.put(unbounded, content=b"45", headers={"Content-Range": "bytes 4-5/6"}).status_code == 201
+    big = client.post("/api/uploads/presign", json={"file_name": "a.bin", "content_type": "application/octet-stream", "content_length": 9})
+    assert big.status_code == 413
+
+
+def test_duplicate_uploads_share_one_blob_until_released(client, monkeypatch):
+    uploads = main._UPLOADS
+    store = ConversationStore()
+    store.on_removed = uploads.detach
+    monkeypatch.setattr(main, "_STORE", store)
+    content = b"brochure " * 10
+    digest = hashlib.sha256(content).hexdigest()
+    links = [presign(client, content_length=len(content)) for _ in range(2)]
+    for upload, _download in links:
+        assert client.put(upload, content=content).status_code == 201
+    assert [client.get(download).content for _upload, download in links] == [content, content]
+    stats = uploads.stats()
+    assert (stats["blobs"], stats["references"], stats["deduplicated"]) == (1, 2, 1)
+    assert stats["blob_bytes"] == len(content) and stats["referenced_bytes"] == 2 * len(content)
+    assert not list(uploads.config.directory.glob("*.part"))
+
+    created = client.post("/api/conversations", json={}).json()
+    file_url = f"http://testserver{links[1][1]}"
+    message = client.post(f"/api/conversations/{created['id']}/message", json={"content": "see attached", "attachments": [{"file_url": file_url}]})
+    attachment = next(sent for sent in message.json()["messages"] if sent["role"] == "user")["attachments"][0]
+    assert (attachment["content_sha256"], attachment["size_bytes"], attachment["file_name"]) == (digest, len(content), "notes.txt")
+    resolved, record = main.resolve_attachment(main.Attachment(file_url=file_url))
+    assert record.sha256 == digest
+    row = attachment_row(main.UUID(created["id"]), None, resolved.model_dump(), main.utc_now())
+    assert row[6] == f"blobs/{digest[:2]}/{digest}" and row[-1] == digest
+    # Two uploads plus one pin for the conversation, however many attachments name the blob.
+    assert (uploads.stats()["references"], uploads.stats()["pins"]) == (3, 1)
+
+    assert client.delete(links[0][0]).status_code == 204
+    assert client.get(links[0][1]).status_code == 404
+    assert uploads.collect(now=time.time() + 10 * uploads.config.gc_grace) == {"blobs": 0, "uploads": 0, "pins": 0}
+    assert client.get(links[1][1]).content == content
+    client.delete(links[1][0])
+    # Both uploads are gone, but the conversation still attaches the blob.
+    assert uploads.collect(now=time.time() + 10 * uploads.config.gc_grace)["blobs"] == 0
+    assert uploads.blob_path(digest).exists()
+    store.remove(main.UUID(created["id"]))
+    # Unreferenced blobs survive the grace period, then go.
+    assert uploads.collect()["blobs"] == 0 and uploads.blob_path(digest).exists()
+    assert uploads.collect(now=time.time() + uploads.config.gc_grace + 1)["blobs"] == 1
+    assert not uploads.blob_path(digest).exists() and uploads.stats()["blobs"] == 0
+
+
+def test_resumed_uploads_hash_the_whole_file_and_abandoned_ones_are_collected(client):
+    uploads = main._UPLOADS
+    upload, download = presign(client, content_length=10)
+    client.put(upload, content=b"0123", headers={"Content-Range": "bytes 0-3/10"})
+    # Another worker finishes it, without this process's hash state.
+    uploads._hashers.clear()
+    assert client.put(upload, content=b"456789", headers={"Content-Range": "bytes 4-9/10"}).status_code == 201
+    assert uploads.lookup(f"http://testserver{download}").sha256 == hashlib.sha256(b"0123456789").hexdigest()
+
+    abandoned, _ = presign(client, content_length=10)
+    client.put(abandoned, content=b"01", headers={"Content-Range": "bytes 0-1/10"})
+    expiry = time.time() + uploads.config.token_ttl
+    assert uploads.collect(now=expiry)["uploads"] == 0
+    assert uploads.collect(now=expiry + uploads.config.gc_grace + 1)["uploads"] == 1
+    assert client.head(abandoned).status_code == 404 and not list(uploads.config.directory.glob("*.part"))
+
+
+def test_only_committed_attachments_pin_and_deleted_holders_release(client, monkeypatch):
+    uploads = main._UPLOADS
+    uploads.existing_holders = lambda conversation_ids: main._STORE.existing(conversation_ids)
+    store = ConversationStore()
+    monkeypatch.setattr(main, "_STORE", store)
+    upload, download = presign(client, content_length=4)
+    client.put(upload, content=b"data")
+    attachment = {"file_url": f"http://testserver{download}"}
+    created = client.post("/api/conversations", json={}).json()
+    url = f"/api/conversations/{created['id']}"
+
+    # A commit that never lands pins nothing.
+    with monkeypatch.context() as patch:
+        patch.setattr(store, "update", lambda *args, **kwargs: False)
+        assert client.post(f"{url}/message", json={"content": "x", "attachments": [attachment]}).status_code == 409
+    assert uploads.stats()["pins"] == 0
+    assert client.post(f"{url}/end-and-send", json={"attachments": [attachment, attachment]}).status_code == 200
+    assert uploads.stats()["pins"] == 1
+
+    # Deleted without the store telling anyone (no on_removed), as a Postgres row deleted
+    # elsewhere would be.
+    store.remove(main.UUID(created["id"]))
+    assert uploads.collect() == {"blobs": 0, "uploads": 0, "pins": 1}
+    assert uploads.stats()["pins"] == 0
@@ -0,0 +1,154 @@
+import threading
+import time
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+import main
+from records import ConversationRecord, MessageRecord
+from store import ConversationStore, SpillFile, StoreLimits
+from wal import WALConfig, WriteAheadLog
+
+
+def open_store(directory, **kwargs):
+    store = ConversationStore(wal=WriteAheadLog(WALConfig(directory, commit_interval=0, **kwargs)))
+    store.recover()
+    return store
+
+
+def comparable(store, conversation_id):
+    row = store.snapshot(conversation_id)
+    row["messages"] = [(m.seq, m.role, m.content, m.created_us) for m in row["messages"]]
+    return row
+
+
+def test_recovery_replays_every_mutation(tmp_path):
+    store = open_store(tmp_path)
+    kept, removed = ConversationRecord(uuid4(), {"mode": "prospect"}), ConversationRecord(uuid4(), {})
+    store.insert(kept)
+    store.insert(removed)
+    store.append_messages(kept.id, [MessageRecord(uuid4(), "user", "hello"), MessageRecord(uuid4(), "assistant", "hi")])
+    with store.locked(kept.id) as conversation:
+        conversation.set_state("IDENTITY")
+        conversation.normalized_fields = {"mode": "prospect", "email": "ada@example.com"}
+        store.journal(conversation, "set", conversation.changes("state", "normalized_fields"))
+        conversation.add_audit_events([{"event_type": "end_and_send"}], 10)
+        store.journal(conversation, "audit", ([{"event_type": "end_and_send"}], 10))
+    store.remove(removed.id)
+    expected = comparable(store, kept.id)
+    store.wal.close()
+
+    recovered = open_store(tmp_path)
+    assert recovered.ids() == [kept.id]
+    assert comparable(recovered, kept.id) == expected
+    assert recovered.snapshot(kept.id)["state"] == "IDENTITY"
+
+
+def test_snapshot_bounds_replay_and_prunes_segments(tmp_path):
+    store = open_store(tmp_path)
+    conversations = [ConversationRecord(uuid4(), {}) for _ in range(5)]
+    for conversation in conversations:
+        store.insert(conversation)
+    assert store.checkpoint() == 5
+    store.append_messages(conversations[0].id, [MessageRecord(uuid4(), "user", "after snapshot")])
+    store.wal.close()
+    assert len(store.wal.segments()) == 1 and len(store.wal.snapshots()) == 1
+
+    recovered = ConversationStore(wal=WriteAheadLog(WALConfig(tmp_path, commit_interval=0)))
+    report = recovered.recover()
+    assert (report["snapshot_records"], report["replayed"]) == (5, 1)
+    assert recovered.snapshot(conversations[0].id)["messages"][0].content == "after snapshot"
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    store = open_store(tmp_path)
+    conversation = ConversationRecord(uuid4(), {})
+    store.insert(conversation)
+    store.wal.close()
+    segment = store.wal.segments()[-1]
+    with open(segment, "ab") as handle:
+        handle.write(b"\x40\x00\x00\x00partial")
+
+    recovered = open_store(tmp_path)
+    recovered.append_messages(conversation.id, [MessageRecord(uuid4(), "user", "still writable")])
+    recovered.wal.close()
+    assert open_store(tmp_path).snapshot(conversation.id)["message_seq"] == 1
+
+
+def test_concurrent_writers_share_fsyncs(tmp_path):
+    store = open_store(tmp_path, fsync=True)
+    conversations = [ConversationRecord(uuid4(), {}) for _ in range(16)]
+    threads = [threading.Thread(target=store.insert, args=(conversation,)) for conversation in conversations]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = store.wal.stats()
+    store.wal.close()
+    assert stats["appends"] == 16 and stats["durable_lsn"] == 16
+    assert stats["flushes"] <= stats["appends"]
+
+
+def test_rotation_waits_for_the_flush_writing_the_old_segment(tmp_path, monkeypatch):
+    import wal as wal_module
+
+    log = WriteAheadLog(WALConfig(tmp_path, commit_interval=0))
+    log.open()
+    real_write, torn = wal_module.os.write, []
+
+    def slow_write(fd, data):
+        # A segment closed (and its fd number reused) mid-flush would change under us.
+        before = wal_module.os.fstat(fd).st_ino
+        time.sleep(0.002)
+        torn.extend([fd] if wal_module.os.fstat(fd).st_ino != before else [])
+        return real_write(fd, data)
+
+    monkeypatch.setattr(wal_module.os, "write", slow_write)
+    stop = threading.Event()
+
+    def rotate():
+        while not stop.is_set():
+            log.rotate()
+
+    rotator = threading.Thread(target=rotate)
+    rotator.start()
+    for _ in range(200):
+        log.append("set", uuid4(), {}, wait=False)
+        time.sleep(0.0005)
+    stop.set()
+    rotator.join()
+    assert log.append("set", uuid4(), {}) == 201
+    log.close()
+    assert torn == [] and [lsn for lsn, *_ in log.replay()] == list(range(1, 202))
+
+
+def test_replay_skips_changes_already_in_spilled_copy(tmp_path):
+    limits = StoreLimits(max_entries=1)
+    store = ConversationStore(limits, SpillFile(tmp_path / "spill.sqlite3"), WriteAheadLog(WALConfig(tmp_path / "wal", commit_interval=0)))
+    store.recover()
+    first, second = ConversationRecord(uuid4(), {}), ConversationRecord(uuid4(), {})
+    store.insert(first)
+    store.append_messages(first.id, [MessageRecord(uuid4(), "user", "once")])
+    store.insert(second)
+    store.wal.close()
+    store.spill.close()
+
+    recovered = ConversationStore(limits, SpillFile(tmp_path / "spill.sqlite3"), WriteAheadLog(WALConfig(tmp_path / "wal", commit_interval=0)))
+    recovered.recover()
+    assert [m.content for m in recovered.snapshot(first.id)["messages"]] == ["once"]
+
+
+def test_http_intake_survives_restart(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "_STORE", open_store(tmp_path))
+    client = TestClient(main.app)
+    created = client.post("/api/conversations", json={"mode": "prospect"}).json()
+    client.post(f"/api/conversations/{created['id']}/message", json={"fields": {}})
+    client.post(f"/api/conversations/{created['id']}/end-and-send", json={"notes": "call back"})
+    before = client.get(f"/api/conversations/{created['id']}").json()
+    assert main.AUDIT_PIPELINE.flush()
+    main._STORE.wal.close()
+
+    monkeypatch.setattr(main, "_STORE", open_store(tmp_path))
+    after = client.get(f"/api/conversations/{created['id']}").json()
+    assert after == before
+    assert after["status"] == "ended" and after["intake_brief"]
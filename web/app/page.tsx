@@ -37,6 +37,7 @@ type ConversationState = (typeof STEP_ORDER)[number];
 
 type ConversationMessage = {
   id: string;
+  seq: number;
   role: "assistant" | "user" | "system";
   content: string;
   created_at: string;
@@ -48,6 +49,7 @@ type Conversation = {
   state: ConversationState;
   normalized_fields: Record<string, string>;
   messages: ConversationMessage[];
+  message_seq: number;
   intake_brief?: {
     summary: string;
     goals: string[];
@@ -93,6 +95,11 @@ function getApiBase() {
   return "http://localhost:8011";
 }
 
+function mergeMessages(current: ConversationMessage[], incoming: ConversationMessage[]) {
+  const lastSeq = current.length ? current[current.length - 1].seq : 0;
+  return [...current, ...incoming.filter((message) => message.seq > lastSeq)];
+}
+
 async function parseJson(response: Response) {
   const payload = await response.json().catch(() => null);
   if (!response.ok) {
@@ -164,6 +171,36 @@ export default function HomePage() {
     setFields((current) => ({ ...current, ...conversation.normalized_fields }));
   }, [conversation]);
 
+  const conversationId = conversation?.id;
+  useEffect(() => {
+    if (!conversationId || typeof EventSource === "undefined") {
+      return;
+    }
+    const source = new EventSource(`${getApiBase()}/api/conversations/${conversationId}/events`);
+    const apply = (update: (current: Conversation) => Conversation) =>
+      setConversation((current) => (current && current.id === conversationId ? update(current) : current));
+
+    source.addEventListener("snapshot", (event) => {
+      const snapshot = JSON.parse((event as MessageEvent).data) as Conversation;
+      apply((current) => ({ ...snapshot, messages: mergeMessages(current.messages, snapshot.messages) }));
+    });
+    source.addEventListener("message", (event) => {
+      const message = JSON.parse((event as MessageEvent).data) as ConversationMessage;
+      apply((current) => ({
+        ...current,
+        messages: mergeMessages(current.messages, [message]),
+        message_seq: Math.max(current.message_seq, message.seq),
+      }));
+    });
+    for (const name of ["conversation", "intake_brief", "slack"]) {
+      source.addEventListener(name, (event) => {
+        const delta = JSON.parse((event as MessageEvent).data) as Partial<Conversation>;
+        apply((current) => ({ ...current, ...delta }));
+      });
+    }
+    return () => source.close();
+  }, [conversationId]);
+
   useEffect(() => {
     if (!conversation || conversation.state !== "SUMMARY") {
       return;
@@ -213,7 +250,8 @@ export default function HomePage() {
     setLoading(true);
     setError("");
     try {
-      const response = await fetch(`${getApiBase()}/api/conversations/${conversation.id}/message`, {
+      const since = conversation.message_seq;
+      const response = await fetch(`${getApiBase()}/api/conversations/${conversation.id}/message?since=${since}`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({
@@ -222,7 +260,7 @@ export default function HomePage() {
         }),
       });
       const payload = (await parseJson(response)) as Conversation;
-      setConversation(payload);
+      setConversation((current) => ({ ...payload, messages: mergeMessages(current?.messages ?? [], payload.messages) }));
     } catch (nextError) {
       setError((nextError as Error).message);
     } finally {